@@ -0,0 +1,4 @@
+from crm_app.asgi import create_asgi_app
+
+# gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker asgi:app
+app = create_asgi_app()
@@ -6,8 +6,10 @@ from pathlib import Path
 from flask import Flask, jsonify, make_response, redirect, request, session, url_for
 from werkzeug.middleware.proxy_fix import ProxyFix
 
+from . import cli, metrics
 from .core import get_app_root
-from .blueprints import admin_bp, auth_bp, spa_bp, user_bp
+from .json_provider import CRMJSONProvider
+from .blueprints import admin_bp, auth_bp, ops_bp, spa_bp, user_bp
 
 
 def create_app():
@@ -21,6 +23,7 @@ def create_app():
         static_url_path="",
         template_folder=str(template_dir),
     )
+    app.json = CRMJSONProvider(app)
 
     app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_port=1, x_prefix=1)
 
@@ -36,9 +39,13 @@ def create_app():
     if os.environ.get("K_SERVICE"):
         app.config["SESSION_COOKIE_SECURE"] = True
 
+    metrics.init_app(app)
+    cli.init_app(app)
+
     app.register_blueprint(auth_bp)
     app.register_blueprint(user_bp)
     app.register_blueprint(admin_bp)
+    app.register_blueprint(ops_bp)
     app.register_blueprint(spa_bp)
 
     @app.after_request
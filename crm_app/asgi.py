@@ -0,0 +1,358 @@
+"""
+Modo ASGI opcional (``gunicorn -k uvicorn.workers.UvicornWorker asgi:app``).
+
+As rotas que passam a maior parte do tempo esperando I/O rodam nativamente em
+asyncio, sem ocupar uma thread por requisicao:
+- ``GET .../conversations/<id>/messages?after=`` (polling do chat aberto) sobre
+  ``firestore.AsyncClient``;
+- ``GET .../conversations/<id>/messages/stream``: SSE com as mensagens novas
+  (substitui o polling; so existe neste modo);
+- ``GET /api/admin/media/<conversation_id>/<message_id>``: proxy de midia em
+  streaming com ``httpx.AsyncClient``.
+O resto cai no app Flask de sempre (``WsgiToAsgi``, em threads). Serializacao,
+cursores, autenticacao (sessao ou CRM_ADMIN_TOKEN) e regras do Twilio (retry, Retry-After, circuit breaker) sao os
+mesmos do modo WSGI. Dependencias extras em ``requirements-asgi.txt``.
+"""
+import asyncio
+import os
+import re
+import time
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs
+
+import httpx
+from asgiref.wsgi import WsgiToAsgi
+from google.cloud import firestore
+from google.cloud.firestore_v1.field_path import FieldPath
+
+from . import media_meta, message_format, metrics
+from .core import (
+    FS_CONV_COLL,
+    FS_MSG_SUBCOLL,
+    TWILIO_ACCOUNT_SID,
+    TWILIO_AUTH_TOKEN_REST,
+    _coerce_ts_to_dt,
+    _admin_authorized,
+    _logger,
+    _message_cursor,
+    _parse_message_anchor,
+    _serialize_message,
+)
+from .twilio_client import (
+    RETRYABLE_GET_STATUSES,
+    TWILIO_CONNECT_TIMEOUT_SEC,
+    TWILIO_MAX_RETRIES,
+    TWILIO_READ_TIMEOUT_SEC,
+    TwilioClient,
+    _retry_after_seconds,
+    twilio_media_client,
+)
+
+MESSAGE_STREAM_POLL_SEC = float(os.getenv("MESSAGE_STREAM_POLL_SEC", "2"))
+MESSAGE_STREAM_HEARTBEAT_SEC = 15.0
+# O EventSource reconecta sozinho (Last-Event-ID); conexoes muito longas so atrapalham deploys
+MESSAGE_STREAM_MAX_SEC = float(os.getenv("MESSAGE_STREAM_MAX_SEC", "300"))
+MESSAGE_STREAM_BATCH = 50
+MEDIA_CHUNK_BYTES = 8192
+
+
+class AsgiApp:
+    def __init__(self, flask_app, async_fs=None, http: httpx.AsyncClient | None = None):
+        self.flask_app = flask_app
+        self.wsgi = WsgiToAsgi(flask_app)
+        self.fs = async_fs or firestore.AsyncClient()
+        self.http = http or httpx.AsyncClient(
+            timeout=httpx.Timeout(TWILIO_READ_TIMEOUT_SEC, connect=TWILIO_CONNECT_TIMEOUT_SEC)
+        )
+        self._session_serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+        self._dumps = flask_app.json.dumps
+        self.routes = [
+            (re.compile(r"/api/admin/conversations/([^/]+)/messages/stream"), "message_stream", self.message_stream),
+            (re.compile(r"/api/admin/conversations/([^/]+)/messages"), "list_messages_after", self.list_messages_after),
+            (re.compile(r"/api/admin/media/(.+)/([^/]+)"), "proxy_media", self.proxy_media),
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] == "http" and scope["method"] == "GET":
+            query = {k: v[0] for k, v in parse_qs(scope.get("query_string", b"").decode()).items()}
+            for pattern, name, handler in self.routes:
+                m = pattern.fullmatch(scope["path"])
+                # Sem ``after`` a listagem de mensagens continua no Flask; miniaturas tambem
+                if m and (name != "list_messages_after" or query.get("after")) and not (
+                    name == "proxy_media" and query.get("variant")
+                ):
+                    await self._dispatch(name, handler, scope, receive, send, query, m.groups())
+                    return
+        await self.wsgi(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.http.aclose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _dispatch(self, name, handler, scope, receive, send, query, args):
+        headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope.get("headers", [])}
+        started = time.perf_counter()
+        status = 500
+        try:
+            if not self._authorized(headers, query):
+                status = await self._json(send, 401, {"error": {"code": "UNAUTHORIZED", "message": "Login requerido"}})
+            else:
+                status = await handler(send, receive, headers, query, *args)
+        except Exception as e:
+            _logger().error("Erro na rota ASGI %s: %s", name, e, exc_info=True)
+            raise
+        finally:
+            endpoint = f"asgi.{name}"
+            metrics.inc("crm_http_requests_total", {"endpoint": endpoint, "method": "GET", "status": status})
+            metrics.observe(
+                "crm_http_request_duration_seconds",
+                time.perf_counter() - started,
+                {"endpoint": endpoint, "method": "GET"},
+            )
+            metrics.flush()
+
+    # ---------- auth / respostas ----------
+
+    def _authorized(self, headers: dict, query: dict) -> bool:
+        """Mesma regra das rotas Flask (``_admin_authorized``): sessao ou X-Admin-Token / ``?token=``."""
+        return _admin_authorized(self._session_user(headers), headers.get("x-admin-token"), query.get("token"))
+
+    def _session_user(self, headers: dict) -> str | None:
+        """``user`` da sessao do Flask lida do cookie (None se ausente ou invalida)."""
+        cookie_name = self.flask_app.config["SESSION_COOKIE_NAME"]
+        cookie = SimpleCookie()
+        try:
+            cookie.load(headers.get("cookie", ""))
+        except Exception:
+            return None
+        if cookie_name not in cookie or self._session_serializer is None:
+            return None
+        max_age = int(self.flask_app.permanent_session_lifetime.total_seconds())
+        try:
+            return (self._session_serializer.loads(cookie[cookie_name].value, max_age=max_age) or {}).get("user")
+        except Exception:
+            return None
+
+    async def _json(self, send, status: int, payload: dict) -> int:
+        body = self._dumps(payload).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
+        return status
+
+    @staticmethod
+    async def _empty(send, status: int) -> int:
+        await send({"type": "http.response.start", "status": status, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+        return status
+
+    # ---------- mensagens ----------
+
+    def _messages_ref(self, conversation_id: str):
+        return self.fs.collection(FS_CONV_COLL).document(conversation_id).collection(FS_MSG_SUBCOLL)
+
+    async def _messages_after(self, conversation_id: str, anchor: tuple, limit: int) -> list[dict]:
+        dt, msg_id = anchor
+        q = (
+            self._messages_ref(conversation_id)
+            .order_by("ts", direction=firestore.Query.ASCENDING)
+            .order_by(FieldPath.document_id(), direction=firestore.Query.ASCENDING)
+            .start_after({"ts": dt, FieldPath.document_id(): msg_id})
+            .limit(limit)
+        )
+        return [_serialize_message(d) async for d in q.stream()]
+
+    async def list_messages_after(self, send, receive, headers, query, conversation_id) -> int:
+        """Mesmo contrato de ``_list_messages_after`` (204 sem novidades)."""
+        anchor = _parse_message_anchor(query.get("after", "").strip())
+        if not anchor:
+            return await self._json(send, 400, {
+                "error": {"code": "BAD_REQUEST", "message": "after invalido (use <ts,id> ou latest_cursor)"},
+            })
+        try:
+            limit = int(query.get("limit") or 25)
+        except ValueError:
+            limit = 25
+        fmt = (query.get("format") or "v1").strip().lower()
+        layout = (query.get("layout") or "items").strip().lower()
+        if fmt not in message_format.MESSAGE_FORMATS or layout not in message_format.MESSAGE_LAYOUTS:
+            return await self._json(send, 400, {
+                "error": {"code": "BAD_REQUEST", "message": "format/layout invalido (format=v1|v2, layout=items|columns)"},
+            })
+        items = await self._messages_after(conversation_id, anchor, limit)
+        if not items:
+            return await self._empty(send, 204)
+        media_meta.schedule(conversation_id, items)
+        out = {"items": items, "latest_cursor": _message_cursor(items[-1])}
+        if len(items) == limit:
+            out["has_more"] = True
+        return await self._json(send, 200, message_format.render(conversation_id, out, fmt, layout))
+
+    async def _latest_anchor(self, conversation_id: str):
+        q = self._messages_ref(conversation_id).order_by("ts", direction=firestore.Query.DESCENDING).limit(1)
+        async for d in q.stream():
+            dt = _coerce_ts_to_dt((d.to_dict() or {}).get("ts"))
+            return (dt, d.id) if dt else None
+        return None
+
+    async def message_stream(self, send, receive, headers, query, conversation_id) -> int:
+        """
+        SSE: ``event: message`` para cada mensagem nova (``id`` = cursor, aceito de volta em
+        Last-Event-ID ou ``?after=``). Sem ``after`` comeca depois da mensagem mais recente.
+        """
+        after = (headers.get("last-event-id") or query.get("after") or "").strip()
+        if after:
+            anchor = _parse_message_anchor(after)
+            if not anchor:
+                return await self._json(send, 400, {"error": {"code": "BAD_REQUEST", "message": "after invalido"}})
+        else:
+            anchor = await self._latest_anchor(conversation_id)
+
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"text/event-stream"),
+                (b"cache-control", b"no-store"),
+                (b"x-accel-buffering", b"no"),
+            ],
+        })
+        disconnected = asyncio.Event()
+
+        async def watch_disconnect():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            disconnected.set()
+
+        watcher = asyncio.create_task(watch_disconnect())
+        deadline = time.monotonic() + MESSAGE_STREAM_MAX_SEC
+        last_write = time.monotonic()
+        try:
+            await send({"type": "http.response.body", "body": b"retry: 3000\n\n", "more_body": True})
+            while not disconnected.is_set() and time.monotonic() < deadline:
+                items = await self._messages_after(conversation_id, anchor, MESSAGE_STREAM_BATCH) if anchor else []
+                if not anchor:
+                    anchor = await self._latest_anchor(conversation_id)
+                chunks = []
+                for item in items:
+                    cursor = _message_cursor(item)
+                    chunks.append(f"id: {cursor}\nevent: message\ndata: {self._dumps(item)}\n\n")
+                    anchor = (_coerce_ts_to_dt(item["ts"]), item["message_id"])
+                if not chunks and time.monotonic() - last_write >= MESSAGE_STREAM_HEARTBEAT_SEC:
+                    chunks.append(": ping\n\n")
+                if chunks:
+                    await send({"type": "http.response.body", "body": "".join(chunks).encode("utf-8"), "more_body": True})
+                    last_write = time.monotonic()
+                if len(items) == MESSAGE_STREAM_BATCH:
+                    continue
+                try:
+                    await asyncio.wait_for(disconnected.wait(), timeout=MESSAGE_STREAM_POLL_SEC)
+                except asyncio.TimeoutError:
+                    pass
+            if not disconnected.is_set():
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            watcher.cancel()
+        return 200
+
+    # ---------- midia ----------
+
+    async def _fetch_media(self, url: str) -> httpx.Response:
+        """GET com as mesmas regras do TwilioClient (retry em 429/5xx/rede, Retry-After, circuito de midia)."""
+        breaker = twilio_media_client.breaker
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                metrics.inc("crm_twilio_client_outcomes_total", {"op": "media", "outcome": "circuit_open"})
+                return None
+            started = time.perf_counter()
+            retry_after = None
+            try:
+                resp = await self.http.send(
+                    self.http.build_request("GET", url),
+                    auth=(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN_REST),
+                    stream=True,
+                )
+            except httpx.HTTPError:
+                metrics.observe_twilio("media", started, "error")
+                breaker.on_failure()
+                if attempt >= TWILIO_MAX_RETRIES:
+                    metrics.inc("crm_twilio_client_outcomes_total", {"op": "media", "outcome": "network_error"})
+                    raise
+            else:
+                metrics.observe_twilio("media", started, resp.status_code)
+                if resp.status_code >= 500:
+                    breaker.on_failure()
+                else:
+                    breaker.on_success()
+                if resp.status_code not in RETRYABLE_GET_STATUSES or attempt >= TWILIO_MAX_RETRIES:
+                    outcome = "ok" if resp.status_code < 400 else "client_error" if resp.status_code < 500 else "server_error"
+                    metrics.inc("crm_twilio_client_outcomes_total", {"op": "media", "outcome": outcome})
+                    return resp
+                retry_after = _retry_after_seconds(resp.headers.get("retry-after"))
+                await resp.aclose()
+            metrics.inc("crm_twilio_client_outcomes_total", {"op": "media", "outcome": "retry"})
+            await asyncio.sleep(TwilioClient._backoff(attempt, retry_after))
+            attempt += 1
+
+    async def proxy_media(self, send, receive, headers, query, conversation_id, message_id) -> int:
+        snap = await self._messages_ref(conversation_id).document(message_id).get()
+        if not snap.exists:
+            return await self._json(send, 404, {"error": {"code": "NOT_FOUND", "message": "Message not found"}})
+        m = snap.to_dict() or {}
+        media_url = m.get("media_url")
+        media_type = m.get("media_type", "application/octet-stream")
+        if not media_url:
+            return await self._json(send, 404, {"error": {"code": "NO_MEDIA", "message": "Message has no media"}})
+
+        try:
+            resp = await self._fetch_media(media_url)
+        except httpx.HTTPError as e:
+            _logger().error("Media proxy error: %s", e)
+            return await self._json(send, 500, {"error": {"code": "PROXY_ERROR", "message": str(e)}})
+        if resp is None:
+            return await self._json(send, 503, {
+                "error": {"code": "TWILIO_UNAVAILABLE", "message": "Twilio indisponivel (circuito aberto)"},
+            })
+
+        total = 0
+        try:
+            if resp.status_code != 200:
+                return await self._json(send, 502, {"error": {"code": "TWILIO_ERROR", "message": "Failed to fetch media"}})
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", media_type.encode("latin-1")),
+                    (b"cache-control", b"public, max-age=31536000"),
+                ],
+            })
+            async for chunk in resp.aiter_bytes(MEDIA_CHUNK_BYTES):
+                total += len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return 200
+        finally:
+            await resp.aclose()
+            if total:
+                metrics.inc("crm_media_proxy_bytes_total", value=total)
+
+
+def create_asgi_app(flask_app=None, async_fs=None, http=None) -> AsgiApp:
+    if flask_app is None:
+        from . import create_app
+
+        flask_app = create_app()
+    return AsgiApp(flask_app, async_fs=async_fs, http=http)
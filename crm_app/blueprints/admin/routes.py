@@ -1,15 +1,34 @@
-﻿import uuid
-from datetime import datetime, timezone, timedelta
+﻿import math
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import wraps
 import os
-import unicodedata
 
-from flask import Response, jsonify, request, session
+from flask import Response, current_app, jsonify, request, session, stream_with_context
 from google.cloud import firestore
-
+from google.cloud.firestore_v1.field_path import FieldPath
+
+from ... import conditional, media_meta, message_format, metrics, quick_replies, thumbnails
+from ...bulk import (
+    BULK_ACTIONS,
+    BULK_MAX_IDS,
+    BULK_TAG_MODES,
+    TAG_MAX_PER_CONVERSATION,
+    iter_filter,
+    iter_ids,
+    normalize_tags,
+    run_bulk,
+    tag_planner,
+    transition_planner,
+)
+from ...cache import MicroCache, rate_limit, shared_cache
 from ...core import (
     REOPEN_TEMPLATE_SID_BOT,
     REOPEN_TEMPLATE_SID_DEFAULT,
     REOPEN_TEMPLATE_SID_PENDING_HANDOFF,
+    RATE_LIMIT_SEND_PER_CONVO_PER_SEC,
+    SEND_IDEMPOTENCY_TTL_SEC,
     TWILIO_ACCOUNT_SID,
     TWILIO_AUTH_TOKEN_REST,
     _agent_from_headers,
@@ -23,19 +42,65 @@ from ...core import (
     _iso,
     _is_outside_24h_window,
     _logger,
+    _message_cursor,
     _parse_iso,
+    _parse_message_anchor,
     _require_auth,
+    _serialize_message,
+    _tag_query_variants,
     _twilio_send_template,
     _twilio_send_whatsapp,
     _validate_twilio_signature,
+    admin_login_required,
     conv_ref,
     fs,
-    http_session,
-    login_required,
     log_event,
     messages_ref,
     FS_CONV_COLL,
 )
+from ...export import (
+    EXPORT_FORMATS,
+    buffered,
+    csv_lines,
+    export_records,
+    gzip_chunks,
+    ndjson_lines,
+)
+from ...reopen import (
+    ELIGIBLE,
+    SKIPPED_CHANGED,
+    SKIPPED_NOT_ALLOWED,
+    SKIPPED_RECENT,
+    SKIPPED_WINDOW_OPEN,
+    PreviewWriter,
+    ReopenPreviewError,
+    candidates as reopen_candidates,
+    REOPEN_PREVIEW_PAGE_MAX,
+    claim_preview,
+    decode_preview_cursor,
+    encode_preview_cursor,
+    evaluate,
+    iter_preview_items,
+    iter_revalidated,
+    load_preview,
+    normalize_status as normalize_reopen_status,
+    preview_item,
+    preview_page,
+    reopen_one,
+    template_for as reopen_template_for,
+)
+from ...replica import conversation_replica
+from ...search_index import fold_text, index_message, maybe_sync_in_background, search as search_message_index
+from ...summaries import (
+    SUMMARY_FIELD_PATHS,
+    SUMMARY_READ_REPAIR,
+    build_conversation_summary,
+    summary_is_fresh,
+    summary_to_item,
+    update_with_summary,
+)
+from ...transitions import TransitionError, apply_transition
+from ...twilio_client import TwilioUnavailable, twilio_media_client
 from . import bp
 
 
@@ -56,6 +121,69 @@ REOPEN_BATCH_SCOPES = {
     "active": ["pending_handoff", "pending", "claimed", "active"],
     "staging_test": ["bot", "pending_handoff", "pending", "claimed", "active"],
 }
+REOPEN_PREVIEW_SAMPLE_LIMIT = 50
+
+# Todos os atendentes fazem polling das mesmas abas: resultado compartilhado por ~1.5s
+CONVERSATION_LIST_CACHE_TTL_SEC = float(os.getenv("CONVERSATION_LIST_CACHE_TTL_SEC", "1.5"))
+conversation_list_cache = MicroCache(
+    "conversation_list", CONVERSATION_LIST_CACHE_TTL_SEC, broadcast_invalidation=True
+)
+
+# Badges das abas: count() por status (e "minhas" por atendente)
+CONVERSATION_COUNT_STATUSES = ("bot", "pending_handoff", "claimed", "active")
+CONVERSATION_MINE_STATUSES = ("claimed", "active")
+CONVERSATION_COUNTS_CACHE_TTL_SEC = float(os.getenv("CONVERSATION_COUNTS_CACHE_TTL_SEC", "5"))
+conversation_counts_cache = MicroCache(
+    "conversation_counts", CONVERSATION_COUNTS_CACHE_TTL_SEC, broadcast_invalidation=True
+)
+# Campos lidos por _serialize_conversation (mascara do batchGet)
+CONVERSATION_ITEM_FIELD_PATHS = [
+    "status",
+    "assignee",
+    "assignee_name",
+    "session_parameters.user_name",
+    "wa_profile_name",
+    "tags",
+    "last_message_text",
+    "last_message_by",
+    "updated_at",
+]
+CONVERSATION_BATCH_GET_MAX = int(os.getenv("CONVERSATION_BATCH_GET_MAX", "100"))
+
+# Reserva do client_request_id enquanto o envio ao Twilio esta em andamento
+SEND_PENDING_TTL_SEC = 60.0
+
+_count_executor = ThreadPoolExecutor(max_workers=len(CONVERSATION_COUNT_STATUSES), thread_name_prefix="fs-count")
+
+
+def _invalidate_conversation_caches():
+    conversation_list_cache.invalidate()
+    conversation_counts_cache.invalidate()
+
+
+def _invalidates_conversation_lists(fn):
+    """
+    Rotas que gravam conversas descartam os micro-caches de lista/contagem deste processo
+    e releem a conversa na replica em memoria (quem gravou ve o resultado na hora).
+    """
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _invalidate_conversation_caches()
+            if kwargs.get("conversation_id"):
+                conversation_replica.refresh(kwargs["conversation_id"])
+    return wrapper
+
+
+def _use_replica(endpoint: str, statuses=()) -> bool:
+    """Replica em memoria cobre esses status (vazio = todos) e esta pronta; senao Firestore."""
+    if not conversation_replica.covers(statuses):
+        return False
+    ok = conversation_replica.usable()
+    metrics.inc("crm_replica_requests_total", {"endpoint": endpoint, "result": "hit" if ok else "fallback"})
+    return ok
 
 
 def _parse_bool(value, default=False):
@@ -110,11 +238,7 @@ def _normalize_phone_query(value: str) -> str:
 
 
 def _normalize_tag_token(value: str) -> str:
-    token = (value or "").strip().casefold()
-    if not token:
-        return ""
-    token = unicodedata.normalize("NFKD", token)
-    token = "".join(ch for ch in token if not unicodedata.combining(ch))
+    token = fold_text((value or "").strip())
     return "".join(ch for ch in token if ch.isalnum() or ch in ("_", "-"))
 
 
@@ -147,7 +271,7 @@ def _sort_and_serialize_conversations(docs_with_data: list[tuple], limit: int):
         key=lambda item: _coerce_ts_to_dt(item[1].get("updated_at")) or datetime(1970, 1, 1, tzinfo=timezone.utc),
         reverse=True,
     )
-    return [_serialize_conversation(doc, data) for doc, data in docs_with_data[:limit]]
+    return _serialize_conversation_summaries(docs_with_data[:limit])
 
 
 def _search_conversations_by_tag(tag_query: str, limit: int):
@@ -162,16 +286,15 @@ def _search_conversations_by_tag(tag_query: str, limit: int):
         seen_ids.add(snapshot.id)
 
     query_limit = max(limit * 5, limit)
-    tag_candidates = {
-        tag_query,
-        tag_query.lower(),
-        tag_query.upper(),
-        tag_query.capitalize(),
-    }
-    for candidate in tag_candidates:
+    for candidate in _tag_query_variants(tag_query):
         if len(docs_with_data) >= query_limit:
             break
-        q = fs.collection(FS_CONV_COLL).where("tags", "array_contains", candidate).limit(query_limit)
+        q = (
+            fs.collection(FS_CONV_COLL)
+            .where("tags", "array_contains", candidate)
+            .select(SUMMARY_FIELD_PATHS)
+            .limit(query_limit)
+        )
         for snap in q.stream():
             add_doc(snap)
             if len(docs_with_data) >= query_limit:
@@ -182,7 +305,6 @@ def _search_conversations_by_tag(tag_query: str, limit: int):
 
 def _serialize_conversation(doc, data: dict | None = None):
     dd = data or doc.to_dict() or {}
-    up = dd.get("updated_at")
     user_name = _extract_user_name(dd)
     wa_profile_name = dd.get("wa_profile_name")
     tags = dd.get("tags") if isinstance(dd.get("tags"), list) else []
@@ -196,12 +318,49 @@ def _serialize_conversation(doc, data: dict | None = None):
         "tags": tags,
         "last_message_text": dd.get("last_message_text", ""),
         "last_message_by": dd.get("last_message_by"),
-        "updated_at": _iso(up) if up else None,
+        "updated_at": dd.get("updated_at"),
     }
 
 
+def _serialize_conversation_summaries(docs_with_data: list[tuple]):
+    """
+    Serializa snapshots projetados em SUMMARY_FIELD_PATHS.
+    Conversas sem summary atualizado sao relidas inteiras (get_all) e reparadas.
+    """
+    items = []
+    stale_positions = {}
+    for doc, data in docs_with_data:
+        if summary_is_fresh(data):
+            items.append(summary_to_item(doc.id, data["summary"], data.get("updated_at")))
+        else:
+            stale_positions[doc.id] = len(items)
+            items.append(None)
+
+    if stale_positions:
+        refs = [conv_ref(conv_id) for conv_id in stale_positions]
+        for full in fs.get_all(refs):
+            if not full.exists:
+                continue
+            full_data = full.to_dict() or {}
+            items[stale_positions[full.id]] = _serialize_conversation(full, full_data)
+            if SUMMARY_READ_REPAIR:
+                _repair_conversation_summary(full, full_data)
+
+    return [item for item in items if item is not None]
+
+
+def _repair_conversation_summary(snapshot, data: dict):
+    try:
+        snapshot.reference.update(
+            {"summary": build_conversation_summary(snapshot.id, data)},
+            option=fs.write_option(last_update_time=snapshot.update_time),
+        )
+    except Exception as e:
+        _logger().info("summary repair skipped for %s: %s", snapshot.id, e)
+
+
 @bp.get("/api/admin/conversations")
-@login_required
+@admin_login_required
 def list_conversations():
     unauth = _require_auth(allow_session=True, allow_query=True)
     if unauth:
@@ -214,7 +373,20 @@ def list_conversations():
     cursor_str = (request.args.get("cursor") or "").strip()
 
     username = session.get("user") or ""
+    assignee = username if mine and username else ""
+
+    if _use_replica("list", status_list):
+        return jsonify(conversation_replica.list_conversations(status_list, assignee, limit, cursor_str))
+
+    cache_key = (tuple(sorted(set(status_list))), assignee, limit, cursor_str)
+    out = conversation_list_cache.get_or_compute(
+        cache_key,
+        lambda: _query_conversation_list(status_list, assignee, limit, cursor_str),
+    )
+    return jsonify(out)
+
 
+def _query_conversation_list(status_list: list, assignee: str, limit: int, cursor_str: str) -> dict:
     q = fs.collection(FS_CONV_COLL)
     if status_list:
         if len(status_list) == 1:
@@ -222,35 +394,33 @@ def list_conversations():
         else:
             q = q.where("status", "in", status_list)
 
-    if mine and username:
-        q = q.where("assignee", "==", username)
+    if assignee:
+        q = q.where("assignee", "==", assignee)
 
-    q = q.order_by("updated_at", direction=firestore.Query.DESCENDING).limit(limit)
+    q = q.order_by("updated_at", direction=firestore.Query.DESCENDING).select(SUMMARY_FIELD_PATHS).limit(limit)
 
     cursor_obj = _decode_cursor(cursor_str)
     if cursor_obj:
         dt = _parse_iso(cursor_obj["updated_at"])
         doc_ref = conv_ref(cursor_obj["id"])
         if dt and doc_ref:
-            snap = doc_ref.get()
+            snap = doc_ref.get(field_paths=["updated_at"])
             if snap.exists:
                 q = q.start_after(snap)
 
     docs = list(q.stream())
-    items = []
-    for d in docs:
-        items.append(_serialize_conversation(d))
+    items = _serialize_conversation_summaries([(d, d.to_dict() or {}) for d in docs])
 
     out = {"items": items}
     if len(items) == limit and items:
         last_item = items[-1]
-        out["next_cursor"] = _encode_cursor({"updated_at": last_item["updated_at"], "id": last_item["conversation_id"]})
+        out["next_cursor"] = _encode_cursor({"updated_at": _iso(last_item["updated_at"]), "id": last_item["conversation_id"]})
 
-    return jsonify(out)
+    return out
 
 
 @bp.get("/api/admin/conversations/search")
-@login_required
+@admin_login_required
 def search_conversations():
     unauth = _require_auth(allow_session=True, allow_query=True)
     if unauth:
@@ -264,10 +434,15 @@ def search_conversations():
     limit = max(1, min(limit, 100))
 
     tag_query = _extract_tag_query(raw_query)
+    normalized_query = _normalize_phone_query(raw_query)
+    if (tag_query or normalized_query) and _use_replica("search"):
+        if tag_query:
+            return jsonify({"items": conversation_replica.search_tag(tag_query, limit)})
+        return jsonify({"items": conversation_replica.search_phone(normalized_query, limit)})
+
     if tag_query:
         return jsonify(_search_conversations_by_tag(tag_query, limit))
 
-    normalized_query = _normalize_phone_query(raw_query)
     if not normalized_query:
         return jsonify({"items": []})
 
@@ -292,7 +467,7 @@ def search_conversations():
     for conv_id in exact_candidates:
         if not conv_id or conv_id in seen_ids:
             continue
-        add_doc(conv_ref(conv_id).get())
+        add_doc(conv_ref(conv_id).get(field_paths=SUMMARY_FIELD_PATHS))
         if len(docs_with_data) >= limit:
             break
 
@@ -307,6 +482,7 @@ def search_conversations():
             .where("conversation_id", ">=", prefix)
             .where("conversation_id", "<=", upper_bound)
             .order_by("conversation_id")
+            .select(SUMMARY_FIELD_PATHS)
             .limit(remaining * 3)
         )
         for snap in prefix_query.stream():
@@ -322,9 +498,10 @@ def search_conversations():
         try:
             doc_id_prefix_query = (
                 fs.collection(FS_CONV_COLL)
-                .where(firestore.FieldPath.document_id(), ">=", prefix)
-                .where(firestore.FieldPath.document_id(), "<=", upper_bound)
-                .order_by(firestore.FieldPath.document_id())
+                .where(FieldPath.document_id(), ">=", prefix)
+                .where(FieldPath.document_id(), "<=", upper_bound)
+                .order_by(FieldPath.document_id())
+                .select(SUMMARY_FIELD_PATHS)
                 .limit(remaining * 3)
             )
             for snap in doc_id_prefix_query.stream():
@@ -338,22 +515,234 @@ def search_conversations():
     return jsonify({"items": items})
 
 
+@bp.get("/api/admin/messages/search")
+@admin_login_required
+def search_messages():
+    """Conversas cujas mensagens contem todos os termos de ``q`` (sem acento), mais recentes primeiro."""
+    unauth = _require_auth(allow_session=True, allow_query=True)
+    if unauth:
+        return unauth
+
+    raw_query = (request.args.get("q") or "").strip()
+    try:
+        limit = max(1, min(int(request.args.get("limit") or 20), 100))
+    except ValueError:
+        return jsonify(error={"code": "BAD_REQUEST", "message": "limit invalido"}), 400
+
+    # Mensagens de entrada sao gravadas pelo bot: o indice alcanca em segundo plano
+    maybe_sync_in_background()
+
+    matches, terms = search_message_index(raw_query, limit)
+    if not matches:
+        return jsonify(items=[], terms=terms)
+
+    refs = [conv_ref(conv_id) for conv_id, _ in matches]
+    snaps = [snap for snap in fs.get_all(refs, field_paths=SUMMARY_FIELD_PATHS) if snap.exists]
+    by_id = {item["conversation_id"]: item for item in _serialize_conversation_summaries(
+        [(snap, snap.to_dict() or {}) for snap in snaps]
+    )}
+    items = []
+    for conv_id, matched_at in matches:
+        item = by_id.get(conv_id)
+        if item is not None:
+            items.append({**item, "matched_at": matched_at})
+    return jsonify(items=items, terms=terms)
+
+
+@bp.get("/api/admin/conversations/counts")
+@admin_login_required
+def conversation_counts():
+    unauth = _require_auth(allow_session=True, allow_query=True)
+    if unauth:
+        return unauth
+
+    username = session.get("user") or ""
+    if _use_replica("counts", CONVERSATION_COUNT_STATUSES):
+        out = {"counts": conversation_replica.counts(CONVERSATION_COUNT_STATUSES)}
+        if username:
+            out["mine"] = conversation_replica.counts(CONVERSATION_MINE_STATUSES, assignee=username)
+        return jsonify(out)
+
+    counts = conversation_counts_cache.get_or_compute(
+        ("status",),
+        lambda: _count_conversations(CONVERSATION_COUNT_STATUSES),
+    )
+    out = {"counts": counts}
+    if username:
+        out["mine"] = conversation_counts_cache.get_or_compute(
+            ("mine", username),
+            lambda: _count_conversations(CONVERSATION_MINE_STATUSES, assignee=username),
+        )
+    return jsonify(out)
+
+
+def _count_conversations(statuses: tuple, assignee: str = "") -> dict:
+    """Uma agregacao count() por status, em paralelo."""
+    def count_status(status: str) -> int:
+        q = fs.collection(FS_CONV_COLL).where("status", "==", status)
+        if assignee:
+            q = q.where("assignee", "==", assignee)
+        results = q.count(alias="n").get()
+        return int(results[0][0].value) if results and results[0] else 0
+
+    values = _count_executor.map(metrics.bind_request_cost(count_status), statuses)
+    return dict(zip(statuses, values))
+
+
+@bp.post("/api/admin/conversations:batchGet")
+@admin_login_required
+def batch_get_conversations():
+    """Varias conversas em um unico get_all (ordem do pedido; ids inexistentes em missing)."""
+    unauth = _require_auth(allow_session=True, allow_query=True)
+    if unauth:
+        return unauth
+
+    body = request.get_json(silent=True) or {}
+    ids = body.get("ids")
+    if not isinstance(ids, list) or not all(isinstance(i, str) for i in ids):
+        return jsonify(error={"code": "BAD_REQUEST", "message": "ids deve ser uma lista de strings"}), 400
+    if len(ids) > CONVERSATION_BATCH_GET_MAX:
+        return jsonify(error={
+            "code": "BAD_REQUEST",
+            "message": f"Maximo de {CONVERSATION_BATCH_GET_MAX} ids por requisicao",
+        }), 400
+
+    requested = list(dict.fromkeys(i.strip() for i in ids if i.strip()))
+    valid_ids = [i for i in requested if "/" not in i]
+
+    found = {}
+    if valid_ids:
+        refs = [conv_ref(conv_id) for conv_id in valid_ids]
+        for snap in fs.get_all(refs, field_paths=CONVERSATION_ITEM_FIELD_PATHS):
+            if snap.exists:
+                found[snap.id] = _serialize_conversation(snap)
+
+    return jsonify(
+        items=[found[conv_id] for conv_id in requested if conv_id in found],
+        missing=[conv_id for conv_id in requested if conv_id not in found],
+    )
+
+
+@bp.post("/api/admin/conversations/bulk")
+@admin_login_required
+def bulk_conversations():
+    """
+    Acao em massa (resolve/tag/assign) sobre ``ids`` ou ``filter`` {status, tag, limit}.
+    Responde em NDJSON: uma linha por conversa, progresso a cada lote e totais no fim.
+    """
+    unauth = _require_auth(allow_session=True)
+    if unauth:
+        return unauth
+
+    agent_id, _ = _agent_from_headers()
+    if not agent_id:
+        return jsonify(error={"code": "BAD_REQUEST", "message": "agent_id obrigatório"}), 400
+
+    body = request.get_json(silent=True) or {}
+    action = str(body.get("action") or "").strip().lower()
+    if action not in BULK_ACTIONS:
+        return jsonify(error={"code": "BAD_REQUEST", "message": f"action deve ser um de {', '.join(BULK_ACTIONS)}"}), 400
+
+    ids = body.get("ids")
+    flt = body.get("filter")
+    if (ids is None) == (flt is None):
+        return jsonify(error={"code": "BAD_REQUEST", "message": "Informe ids ou filter"}), 400
+
+    if ids is not None:
+        if not isinstance(ids, list) or not all(isinstance(i, str) for i in ids):
+            return jsonify(error={"code": "BAD_REQUEST", "message": "ids deve ser uma lista de strings"}), 400
+        if len(ids) > BULK_MAX_IDS:
+            return jsonify(error={"code": "BAD_REQUEST", "message": f"Maximo de {BULK_MAX_IDS} ids por requisicao"}), 400
+        requested = list(dict.fromkeys(i.strip() for i in ids if i.strip()))
+        source = iter_ids(requested)
+        scope = {"ids": len(requested)}
+    else:
+        if not isinstance(flt, dict):
+            return jsonify(error={"code": "BAD_REQUEST", "message": "filter deve ser um objeto"}), 400
+        f_status = str(flt.get("status") or "").strip()
+        f_tag = str(flt.get("tag") or "").strip()
+        if not f_status and not f_tag:
+            return jsonify(error={"code": "BAD_REQUEST", "message": "filter precisa de status ou tag"}), 400
+        try:
+            f_limit = max(0, int(flt.get("limit") or 0))
+        except (TypeError, ValueError):
+            return jsonify(error={"code": "BAD_REQUEST", "message": "filter.limit invalido"}), 400
+        source = iter_filter(f_status, f_tag, f_limit)
+        scope = {"status": f_status or None, "tag": f_tag or None, "limit": f_limit or None}
+
+    if action == "tag":
+        tags = body.get("tags")
+        mode = str(body.get("mode") or "add").strip().lower()
+        if not isinstance(tags, list):
+            return jsonify(error={"code": "BAD_REQUEST", "message": "tags deve ser uma lista"}), 400
+        if mode not in BULK_TAG_MODES:
+            return jsonify(error={"code": "BAD_REQUEST", "message": f"mode deve ser um de {', '.join(BULK_TAG_MODES)}"}), 400
+        try:
+            tags = normalize_tags(tags)
+        except ValueError as e:
+            return jsonify(error={"code": "BAD_REQUEST", "message": str(e)}), 400
+        plan = tag_planner(tags, mode)
+        scope.update(tags=tags, mode=mode)
+    elif action == "assign":
+        target_id = str(body.get("agent_id") or "").strip()
+        if not target_id:
+            return jsonify(error={"code": "BAD_REQUEST", "message": "agent_id do destino obrigatorio"}), 400
+        target_name = str(body.get("agent_name") or "").strip() or target_id
+        plan = transition_planner("assign", target_id, target_name)
+        scope.update(assignee=target_id)
+    else:
+        plan = transition_planner("resolve", agent_id)
+
+    dumps = current_app.json.dumps
+
+    def generate():
+        try:
+            for event in run_bulk(source, plan):
+                if event["event"] == "done":
+                    log_event(
+                        f"bulk_{action}",
+                        agent_id=agent_id,
+                        processed=event["processed"],
+                        ok=event["ok"],
+                        skipped=event["skipped"],
+                        errors=event["errors"],
+                        **scope,
+                    )
+                yield dumps(event) + "\n"
+        finally:
+            _invalidate_conversation_caches()
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
 @bp.get("/api/admin/conversations/<conversation_id>")
-@login_required
+@admin_login_required
 def get_conversation(conversation_id):
     unauth = _require_auth(allow_session=True, allow_query=True)
     if unauth:
         return unauth
 
-    snap = conv_ref(conversation_id).get()
+    ref = conv_ref(conversation_id)
+    if conditional.wants_revalidation():
+        # So o update_time importa; a projecao evita trazer o documento inteiro
+        head = ref.get(field_paths=["updated_at"])
+        if not head.exists:
+            return jsonify(error={"code": "NOT_FOUND", "message": "Conversa nao encontrada"}), 404
+        unchanged = conditional.not_modified(conditional.make_etag("conversation", head.update_time))
+        if unchanged is not None:
+            return unchanged
+
+    snap = ref.get()
     if not snap.exists:
         return jsonify(error={"code": "NOT_FOUND", "message": "Conversa nao encontrada"}), 404
 
-    return jsonify(_serialize_conversation(snap))
+    etag = conditional.make_etag("conversation", snap.update_time)
+    return conditional.with_etag(jsonify(_serialize_conversation(snap)), etag)
 
 
 @bp.post("/api/admin/conversations/<conversation_id>/user-name")
-@login_required
+@admin_login_required
+@_invalidates_conversation_lists
 def update_user_name(conversation_id):
     """Atualiza o nome do cliente em session_parameters.user_name"""
     unauth = _require_auth(allow_session=True)
@@ -376,19 +765,18 @@ def update_user_name(conversation_id):
 
     agent_id, _ = _agent_from_headers()
 
-    ref.set({
-        "session_parameters": {
-            "user_name": user_name,
-        },
+    update_with_summary(conversation_id, {
+        "session_parameters.user_name": user_name,
         "updated_at": firestore.SERVER_TIMESTAMP,
-    }, merge=True)
+    }, snap)
 
     log_event("update_user_name", conversation_id=conversation_id, agent_id=agent_id, user_name=user_name)
     return jsonify(ok=True)
 
 
 @bp.post("/api/admin/conversations/<conversation_id>/tags")
-@login_required
+@admin_login_required
+@_invalidates_conversation_lists
 def update_conversation_tags(conversation_id):
     """Atualiza tags da conversa"""
     unauth = _require_auth(allow_session=True)
@@ -400,21 +788,16 @@ def update_conversation_tags(conversation_id):
     if not isinstance(tags, list):
         return jsonify(error={"code": "BAD_REQUEST", "message": "tags deve ser uma lista"}), 400
 
-    normalized = []
-    seen = set()
-    for raw in tags:
-        tag = str(raw or "").strip()
-        if not tag:
-            continue
-        if len(tag) > 40:
-            return jsonify(error={"code": "BAD_REQUEST", "message": "Tag muito longa (max 40 caracteres)"}), 400
-        if tag in seen:
-            continue
-        seen.add(tag)
-        normalized.append(tag)
+    try:
+        normalized = normalize_tags(tags)
+    except ValueError as e:
+        return jsonify(error={"code": "BAD_REQUEST", "message": str(e)}), 400
 
-    if len(normalized) > 12:
-        return jsonify(error={"code": "BAD_REQUEST", "message": "Máximo de 12 tags por conversa"}), 400
+    if len(normalized) > TAG_MAX_PER_CONVERSATION:
+        return jsonify(error={
+            "code": "BAD_REQUEST",
+            "message": f"Máximo de {TAG_MAX_PER_CONVERSATION} tags por conversa",
+        }), 400
 
     ref = conv_ref(conversation_id)
     snap = ref.get()
@@ -423,17 +806,17 @@ def update_conversation_tags(conversation_id):
 
     agent_id, _ = _agent_from_headers()
 
-    ref.set({
+    update_with_summary(conversation_id, {
         "tags": normalized,
         "updated_at": firestore.SERVER_TIMESTAMP,
-    }, merge=True)
+    }, snap)
 
     log_event("update_tags", conversation_id=conversation_id, agent_id=agent_id, tags=normalized)
     return jsonify(ok=True, tags=normalized)
 
 
 @bp.get("/api/admin/conversations/<conversation_id>/messages")
-@login_required
+@admin_login_required
 def list_messages(conversation_id):
     unauth = _require_auth(allow_session=True, allow_query=True)
     if unauth:
@@ -441,6 +824,26 @@ def list_messages(conversation_id):
 
     limit = int(request.args.get("limit") or 25)
     cursor_str = (request.args.get("cursor") or "").strip()
+    after_str = (request.args.get("after") or "").strip()
+    fmt = (request.args.get("format") or "v1").strip().lower()
+    layout = (request.args.get("layout") or "items").strip().lower()
+    if fmt not in message_format.MESSAGE_FORMATS or layout not in message_format.MESSAGE_LAYOUTS:
+        return jsonify(error={"code": "BAD_REQUEST", "message": "format/layout invalido (format=v1|v2, layout=items|columns)"}), 400
+
+    if after_str:
+        anchor = _parse_message_anchor(after_str)
+        if not anchor:
+            return jsonify(error={"code": "BAD_REQUEST", "message": "after invalido (use <ts,id> ou latest_cursor)"}), 400
+        return _list_messages_after(conversation_id, anchor, limit, fmt, layout)
+
+    etag_params = (limit, cursor_str, fmt, layout)
+    etag = None
+    if conditional.wants_revalidation():
+        # Calculado antes da consulta: se algo chegar no meio, o proximo GET so vem completo de novo
+        etag = _messages_etag(conversation_id, _latest_message_validator(conversation_id), etag_params)
+        unchanged = conditional.not_modified(etag)
+        if unchanged is not None:
+            return unchanged
 
     q = messages_ref(conversation_id).order_by("ts", direction=firestore.Query.DESCENDING).limit(limit)
 
@@ -453,37 +856,79 @@ def list_messages(conversation_id):
             if snap.exists:
                 q = q.start_after(snap)
 
-    docs = list(q.stream())
-    items = []
-    for d in docs:
-        dd = d.to_dict() or {}
-        ts = dd.get("ts")
-        items.append({
-            "message_id": d.id,
-            "direction": dd.get("direction"),
-            "by": dd.get("by"),
-            "display_name": dd.get("display_name"),
-            "text": dd.get("text"),
-            "media_url": dd.get("media_url"),
-            "media_type": dd.get("media_type"),
-            "media": dd.get("media"),
-            "media_urls": dd.get("media_urls"),
-            "mime": dd.get("mime"),
-            "content_type": dd.get("content_type"),
-            "url": dd.get("url"),
-            "ts": _iso(ts) if ts else None,
-            "client_request_id": dd.get("client_request_id"),
-        })
+    items = [_serialize_message(d) for d in q.stream()]
+    media_meta.schedule(conversation_id, items)
 
     out = {"items": items}
     if len(items) == limit and items:
         last_item = items[-1]
-        out["next_cursor"] = _encode_cursor({"ts": last_item["ts"], "id": last_item["message_id"]})
+        out["next_cursor"] = _encode_cursor({"ts": _iso(last_item["ts"]), "id": last_item["message_id"]})
+    if items and items[0]["ts"]:
+        out["latest_cursor"] = _message_cursor(items[0])
+
+    resp = jsonify(message_format.render(conversation_id, out, fmt, layout))
+    if media_meta.pending(items):
+        # media_meta gravado depois nao muda o ETag: sem validador o proximo GET vem completo
+        resp.headers["Cache-Control"] = conditional.CACHE_CONTROL
+        return resp
+    if etag is None:
+        # Sem cursor a pagina comeca na mensagem mais recente: o validador sai dela
+        latest = (items[0]["message_id"], items[0]["ts"]) if items and not cursor_str else None
+        if latest is None:
+            latest = _latest_message_validator(conversation_id)
+        etag = _messages_etag(conversation_id, latest, etag_params)
+    return conditional.with_etag(resp, etag)
+
+
+def _latest_message_validator(conversation_id: str) -> tuple:
+    """(id, ts) da mensagem mais recente, lendo so o campo ``ts``."""
+    q = (
+        messages_ref(conversation_id)
+        .order_by("ts", direction=firestore.Query.DESCENDING)
+        .limit(1)
+        .select(["ts"])
+    )
+    for d in q.stream():
+        return d.id, (d.to_dict() or {}).get("ts")
+    return None, None
+
+
+def _messages_etag(conversation_id: str, latest: tuple, params: tuple) -> str:
+    """
+    ETag da pagina de mensagens: update_time da conversa (projecao de ``updated_at``),
+    mensagem mais recente e parametros da requisicao.
+    """
+    head = conv_ref(conversation_id).get(field_paths=["updated_at"])
+    return conditional.make_etag("messages", head.update_time if head.exists else None, *latest, *params)
+
+
+def _list_messages_after(conversation_id: str, anchor: tuple, limit: int, fmt: str = "v1", layout: str = "items"):
+    """
+    Mensagens mais novas que ``anchor`` em ordem crescente (polling do chat aberto).
+    O cursor vai direto na query (ts + id), sem ler o documento ancora: sem
+    novidades custa uma leitura e responde 204 sem corpo.
+    """
+    dt, msg_id = anchor
+    q = (
+        messages_ref(conversation_id)
+        .order_by("ts", direction=firestore.Query.ASCENDING)
+        .order_by(FieldPath.document_id(), direction=firestore.Query.ASCENDING)
+        .start_after({"ts": dt, FieldPath.document_id(): msg_id})
+        .limit(limit)
+    )
+    items = [_serialize_message(d) for d in q.stream()]
+    if not items:
+        return Response(status=204)
+    media_meta.schedule(conversation_id, items)
 
-    return jsonify(out)
+    out = {"items": items, "latest_cursor": _message_cursor(items[-1])}
+    if len(items) == limit:
+        out["has_more"] = True
+    return jsonify(message_format.render(conversation_id, out, fmt, layout))
 
 @bp.post("/api/admin/conversations/<conversation_id>/claim")
-@login_required
+@admin_login_required
+@_invalidates_conversation_lists
 def claim_conversation(conversation_id):
     unauth = _require_auth(allow_session=True)
     if unauth:
@@ -493,37 +938,24 @@ def claim_conversation(conversation_id):
     if not agent_id:
         return jsonify(error={"code": "BAD_REQUEST", "message": "agent_id obrigatório"}), 400
 
-    ref = conv_ref(conversation_id)
-    snap = ref.get()
-    if not snap.exists:
-        return jsonify(error={"code": "NOT_FOUND", "message": "Conversa não encontrada"}), 404
-
-    d = snap.to_dict() or {}
-    st = d.get("status", "pending_handoff")
-    if st != "pending_handoff":
-        return jsonify(error={"code": "INVALID", "message": f"status atual={st} não é pending_handoff"}), 400
-
-    ref.set({
-        "status": "claimed",
-        "assignee": agent_id,
-        "assignee_name": (display_name or agent_id),
-        "updated_at": firestore.SERVER_TIMESTAMP,
-        "handoff_active": False,
-    }, merge=True)
-
     try:
-        ref.update({
-            "session_parameters.handoff_requested": firestore.DELETE_FIELD
-        })
-    except Exception as e:
-        _logger().warning("Erro ao limpar handoff_requested no claim: %s", e)
+        result = apply_transition(conversation_id, "claim", agent_id, display_name)
+    except TransitionError as e:
+        return jsonify(error={"code": e.code, "message": e.message}), e.http_status
 
-    log_event("claim", conversation_id=conversation_id, agent_id=agent_id, old_status=st, new_status="claimed")
-    return jsonify(ok=True, new_status="claimed")
+    log_event(
+        "claim",
+        conversation_id=conversation_id,
+        agent_id=agent_id,
+        old_status=result["old_status"],
+        new_status=result["new_status"],
+    )
+    return jsonify(ok=True, new_status=result["new_status"])
 
 
 @bp.post("/api/admin/conversations/<conversation_id>/takeover")
-@login_required
+@admin_login_required
+@_invalidates_conversation_lists
 def takeover_conversation(conversation_id):
     """Assumir conversa já claimed/active (transferência)"""
     unauth = _require_auth(allow_session=True)
@@ -534,40 +966,28 @@ def takeover_conversation(conversation_id):
     if not agent_id:
         return jsonify(error={"code": "BAD_REQUEST", "message": "agent_id obrigatório"}), 400
 
-    ref = conv_ref(conversation_id)
-    snap = ref.get()
-    if not snap.exists:
-        return jsonify(error={"code": "NOT_FOUND", "message": "Conversa não encontrada"}), 404
-
-    d = snap.to_dict() or {}
-    st = d.get("status", "")
-    if st not in ("claimed", "active"):
-        return jsonify(error={"code": "INVALID", "message": f"status atual={st} não permite takeover"}), 400
+    try:
+        result = apply_transition(conversation_id, "takeover", agent_id, display_name)
+    except TransitionError as e:
+        return jsonify(error={"code": e.code, "message": e.message}), e.http_status
 
-    old_assignee = d.get("assignee")
-    if old_assignee == agent_id:
-        return jsonify(ok=True, new_status=st, already=True)
-
-    ref.set({
-        "assignee": agent_id,
-        "assignee_name": (display_name or agent_id),
-        "updated_at": firestore.SERVER_TIMESTAMP,
-        "handoff_active": False,
-    }, merge=True)
+    if result["already"]:
+        return jsonify(ok=True, new_status=result["new_status"], already=True)
 
     log_event(
         "takeover",
         conversation_id=conversation_id,
         agent_id=agent_id,
-        old_assignee=old_assignee,
+        old_assignee=result["old_assignee"],
         new_assignee=agent_id,
-        status=st,
+        status=result["new_status"],
     )
-    return jsonify(ok=True, new_status=st)
+    return jsonify(ok=True, new_status=result["new_status"])
 
 
 @bp.post("/api/admin/conversations/<conversation_id>/handoff")
-@login_required
+@admin_login_required
+@_invalidates_conversation_lists
 def handoff_from_bot(conversation_id):
     """Assumir conversa do bot (bot -> claimed)"""
     unauth = _require_auth(allow_session=True)
@@ -578,30 +998,24 @@ def handoff_from_bot(conversation_id):
     if not agent_id:
         return jsonify(error={"code": "BAD_REQUEST", "message": "agent_id obrigatório"}), 400
 
-    ref = conv_ref(conversation_id)
-    snap = ref.get()
-    if not snap.exists:
-        return jsonify(error={"code": "NOT_FOUND", "message": "Conversa não encontrada"}), 404
-
-    d = snap.to_dict() or {}
-    st = d.get("status", "bot")
-    if st != "bot":
-        return jsonify(error={"code": "INVALID", "message": f"status atual={st} não é bot"}), 400
-
-    ref.set({
-        "status": "claimed",
-        "assignee": agent_id,
-        "assignee_name": (display_name or agent_id),
-        "updated_at": firestore.SERVER_TIMESTAMP,
-        "handoff_active": False,
-    }, merge=True)
+    try:
+        result = apply_transition(conversation_id, "handoff", agent_id, display_name)
+    except TransitionError as e:
+        return jsonify(error={"code": e.code, "message": e.message}), e.http_status
 
-    log_event("handoff_from_bot", conversation_id=conversation_id, agent_id=agent_id, old_status=st, new_status="claimed")
-    return jsonify(ok=True, new_status="claimed")
+    log_event(
+        "handoff_from_bot",
+        conversation_id=conversation_id,
+        agent_id=agent_id,
+        old_status=result["old_status"],
+        new_status=result["new_status"],
+    )
+    return jsonify(ok=True, new_status=result["new_status"])
 
 
 @bp.post("/api/admin/conversations/<conversation_id>/resolve")
-@login_required
+@admin_login_required
+@_invalidates_conversation_lists
 def resolve_conversation(conversation_id):
     unauth = _require_auth(allow_session=True)
     if unauth:
@@ -611,37 +1025,23 @@ def resolve_conversation(conversation_id):
     if not agent_id:
         return jsonify(error={"code": "BAD_REQUEST", "message": "agent_id obrigatório"}), 400
 
-    ref = conv_ref(conversation_id)
-    snap = ref.get()
-    if not snap.exists:
-        return jsonify(error={"code": "NOT_FOUND", "message": "Conversa não encontrada"}), 404
-
-    d = snap.to_dict() or {}
-    st = d.get("status", "")
-    if st not in ("claimed", "active", "bot"):
-        return jsonify(error={"code": "INVALID", "message": f"status atual={st} não permite encerramento"}), 400
-
-    ref.set({
-        "status": "resolved",
-        "assignee": firestore.DELETE_FIELD,
-        "assignee_name": firestore.DELETE_FIELD,
-        "updated_at": firestore.SERVER_TIMESTAMP,
-        "handoff_active": False,
-    }, merge=True)
-
     try:
-        ref.update({
-            "session_parameters.handoff_requested": firestore.DELETE_FIELD
-        })
-    except Exception as e:
-        _logger().warning("Erro ao limpar handoff_requested: %s", e)
+        result = apply_transition(conversation_id, "resolve", agent_id)
+    except TransitionError as e:
+        return jsonify(error={"code": e.code, "message": e.message}), e.http_status
 
-    log_event("resolve", conversation_id=conversation_id, agent_id=agent_id, old_status=st, new_status="resolved")
-    return jsonify(ok=True, new_status="resolved")
+    log_event(
+        "resolve",
+        conversation_id=conversation_id,
+        agent_id=agent_id,
+        old_status=result["old_status"],
+        new_status=result["new_status"],
+    )
+    return jsonify(ok=True, new_status=result["new_status"])
 
 
 @bp.get("/api/admin/conversations/<conversation_id>/window-status")
-@login_required
+@admin_login_required
 def check_24h_window(conversation_id):
     unauth = _require_auth(allow_session=True, allow_query=True)
     if unauth:
@@ -665,7 +1065,7 @@ def check_24h_window(conversation_id):
 
 
 @bp.get("/api/admin/conversations/<conversation_id>/window-debug")
-@login_required
+@admin_login_required
 def debug_24h_window(conversation_id):
     """Endpoint de debug para diagnosticar problemas com janela de 24h"""
     unauth = _require_auth(allow_session=True, allow_query=True)
@@ -740,7 +1140,7 @@ def debug_24h_window(conversation_id):
 
 
 @bp.get("/api/admin/conversations/<conversation_id>/user-name-debug")
-@login_required
+@admin_login_required
 def debug_user_name(conversation_id):
     """Endpoint de debug para verificar session_parameters.user_name"""
     unauth = _require_auth(allow_session=True, allow_query=True)
@@ -793,7 +1193,8 @@ def debug_user_name(conversation_id):
         return jsonify({"error": str(e)}), 500
 
 @bp.post("/api/admin/conversations/<conversation_id>/reopen")
-@login_required
+@admin_login_required
+@_invalidates_conversation_lists
 def reopen_conversation(conversation_id):
     unauth = _require_auth(allow_session=True, allow_query=True)
     if unauth:
@@ -898,15 +1299,9 @@ def reopen_conversation(conversation_id):
 
     if isinstance(conv, dict) and "claimed_by" in conv:
         update_data["claimed_by"] = firestore.DELETE_FIELD
+    update_data["session_parameters.handoff_requested"] = firestore.DELETE_FIELD
 
-    ref.set(update_data, merge=True)
-
-    try:
-        ref.update({
-            "session_parameters.handoff_requested": firestore.DELETE_FIELD
-        })
-    except Exception as e:
-        _logger().warning("Erro ao limpar handoff_requested no reopen: %s", e)
+    update_with_summary(conversation_id, update_data, snap)
 
     log_event(
         "reopen",
@@ -931,7 +1326,8 @@ def reopen_conversation(conversation_id):
 
 
 @bp.post("/api/admin/conversations/<conversation_id>/send")
-@login_required
+@admin_login_required
+@_invalidates_conversation_lists
 def send_message(conversation_id):
     unauth = _require_auth(allow_session=True)
     if unauth:
@@ -942,11 +1338,73 @@ def send_message(conversation_id):
     if not text:
         return jsonify(error={"code": "BAD_REQUEST", "message": "text obrigatório"}), 400
 
+    # Atalho de resposta rapida do usuario logado enviado como texto exato
+    quick_reply_id = None
+    if data.get("expand_shortcut"):
+        try:
+            reply = quick_replies.expand_fresh(session.get("user") or "", text)
+        except Exception as e:
+            _logger().warning("Falha ao ler quick replies para expandir atalho: %s", e)
+            return jsonify(error={"code": "QUICK_REPLIES_UNAVAILABLE", "message": "Nao foi possivel expandir o atalho"}), 503
+        if reply is not None and (reply.get("text") or "").strip():
+            text, quick_reply_id = reply["text"].strip(), reply.get("id")
+
     client_req_id = (data.get("client_request_id") or "").strip()
     agent_id, display_name = _agent_from_headers()
     if not agent_id:
         return jsonify(error={"code": "BAD_REQUEST", "message": "agent_id obrigatório"}), 400
 
+    idem_key = f"idem:send:{conversation_id}:{client_req_id}" if client_req_id else None
+    if idem_key and not shared_cache.set_json(idem_key, {"state": "pending"}, ttl_sec=SEND_PENDING_TTL_SEC, nx=True):
+        previous = shared_cache.get_json(idem_key)
+        if previous and previous.get("state") == "done":
+            metrics.inc("crm_idempotent_replays_total", {"endpoint": "send_message"})
+            resp = jsonify(previous["body"])
+            resp.headers["Idempotent-Replayed"] = "true"
+            return resp, previous["status"]
+        if previous:
+            return jsonify(error={"code": "IN_PROGRESS", "message": "Envio com este client_request_id em andamento"}), 409
+        # Cache indisponivel: segue sem deduplicar
+
+    try:
+        resp, status = _send_message(conversation_id, text, client_req_id, agent_id, display_name, quick_reply_id)
+    except Exception:
+        # Sem resposta para guardar: libera o client_request_id antes de propagar
+        if idem_key:
+            shared_cache.delete(idem_key)
+        raise
+    if idem_key:
+        if status == 200:
+            shared_cache.set_json(
+                idem_key,
+                {"state": "done", "status": status, "body": resp.get_json()},
+                ttl_sec=SEND_IDEMPOTENCY_TTL_SEC,
+            )
+        else:
+            # Erro: libera o client_request_id para o cliente tentar de novo
+            shared_cache.delete(idem_key)
+    return resp, status
+
+
+def _send_rate_window() -> tuple[int, float]:
+    """(limite, janela em s) equivalentes a RATE_LIMIT_SEND_PER_CONVO_PER_SEC."""
+    if RATE_LIMIT_SEND_PER_CONVO_PER_SEC >= 1:
+        return int(RATE_LIMIT_SEND_PER_CONVO_PER_SEC), 1.0
+    return 1, 1.0 / RATE_LIMIT_SEND_PER_CONVO_PER_SEC
+
+
+def _send_message(conversation_id, text, client_req_id, agent_id, display_name, quick_reply_id=None):
+    if RATE_LIMIT_SEND_PER_CONVO_PER_SEC > 0:
+        retry_after = rate_limit(f"send:{conversation_id}", *_send_rate_window())
+        if retry_after is not None:
+            resp = jsonify(error={
+                "code": "RATE_LIMIT",
+                "message": "Muitos envios nesta conversa",
+                "retry_after_ms": math.ceil(retry_after * 1000),
+            })
+            resp.headers["Retry-After"] = str(math.ceil(retry_after))
+            return resp, 429
+
     prof = _agent_profile()
     use_prefix = prof.get("use_prefix", False)
 
@@ -1001,15 +1459,16 @@ def send_message(conversation_id):
         msg_doc_for_firestore["error"] = info
 
     messages_ref(conversation_id).document(message_id).set(msg_doc_for_firestore)
+    index_message(conversation_id, prefixed_text)
 
-    ref.set({
+    update_with_summary(conversation_id, {
         "status": status_after,
         "assignee": agent_id,
         "assignee_name": (display_name or agent_id),
         "updated_at": firestore.SERVER_TIMESTAMP,
         "last_message_text": prefixed_text[:200],
         "last_message_by": by,
-    }, merge=True)
+    }, snap)
 
     msg_doc_for_response = {
         "message_id": message_id,
@@ -1043,6 +1502,7 @@ def send_message(conversation_id):
         status_after=status_after,
         twilio_sid=info.get("sid"),
         client_request_id=client_req_id,
+        quick_reply_id=quick_reply_id,
     )
     return jsonify(message=msg_doc_for_response), 200
 
@@ -1080,7 +1540,7 @@ def twilio_status():
 
 
 @bp.get("/api/admin/media/<path:conversation_id>/<path:message_id>")
-@login_required
+@admin_login_required
 def proxy_media(conversation_id, message_id):
     unauth = _require_auth(allow_session=True, allow_query=True)
     if unauth:
@@ -1097,28 +1557,49 @@ def proxy_media(conversation_id, message_id):
     if not media_url:
         return jsonify(error={"code": "NO_MEDIA", "message": "Message has no media"}), 404
 
+    variant = (request.args.get("variant") or "").strip().lower()
+    if variant and variant != "thumb":
+        return jsonify(error={"code": "BAD_REQUEST", "message": "variant invalido (use thumb)"}), 400
+    # Original servido no lugar da miniatura nao pode ficar no cache como a variante
+    cache_control = "public, max-age=31536000"
+    if variant == "thumb":
+        try:
+            body, thumb_type = thumbnails.get_thumbnail(conversation_id, message_id, media_url, media_type)
+            return Response(
+                body,
+                mimetype=thumb_type,
+                headers={"Cache-Control": "public, max-age=31536000, immutable", "X-Media-Variant": "thumb"},
+            )
+        except thumbnails.ThumbnailUnavailable as e:
+            # Imagem sem miniatura agora: serve o original (o <img> continua funcionando)
+            if not media_type.startswith("image/"):
+                return jsonify(error={"code": "NO_THUMBNAIL", "message": str(e)}), 404
+            cache_control = "no-store"
+
     try:
-        resp = http_session.get(
+        resp = twilio_media_client.get(
+            "media",
             media_url,
             auth=(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN_REST),
-            timeout=30,
             stream=True,
         )
         if resp.status_code != 200:
             return jsonify(error={"code": "TWILIO_ERROR", "message": "Failed to fetch media"}), 502
 
         return Response(
-            resp.iter_content(chunk_size=8192),
+            metrics.count_media_bytes(resp.iter_content(chunk_size=8192)),
             mimetype=media_type,
-            headers={"Cache-Control": "public, max-age=31536000", "Content-Type": media_type},
+            headers={"Cache-Control": cache_control, "Content-Type": media_type},
         )
+    except TwilioUnavailable as e:
+        return jsonify(error={"code": "TWILIO_UNAVAILABLE", "message": str(e)}), 503
     except Exception as e:
         _logger().error("Media proxy error: %s", e)
         return jsonify(error={"code": "PROXY_ERROR", "message": str(e)}), 500
 
 
 @bp.get("/api/admin/reopen-outdated-conversations/capabilities")
-@login_required
+@admin_login_required
 def reopen_outdated_conversations_capabilities():
     unauth = _require_auth(allow_session=True, allow_query=True)
     if unauth:
@@ -1143,7 +1624,8 @@ def reopen_outdated_conversations_capabilities():
 
 
 @bp.post("/api/admin/reopen-outdated-conversations")
-@login_required
+@admin_login_required
+@_invalidates_conversation_lists
 def reopen_outdated_conversations():
     unauth = _require_auth(allow_session=True, allow_query=True)
     if unauth:
@@ -1158,6 +1640,7 @@ def reopen_outdated_conversations():
 
     scope = _normalize_reopen_scope(scope_raw or "all")
     preview = _parse_bool(preview_raw, default=False)
+    preview_id = str(data.get("preview_id") or request.args.get("preview_id") or "").strip()
     is_staging = _is_staging_environment()
 
     if scope not in REOPEN_BATCH_SCOPES:
@@ -1180,193 +1663,130 @@ def reopen_outdated_conversations():
                 "message": "REOPEN_TEST_ALLOWED_PHONES não configurado no staging",
             }), 400
 
+    allowed_phones = allowed_test_phones if scope == "staging_test" else None
+
     try:
-        candidate_statuses = REOPEN_BATCH_SCOPES[scope]
         now = datetime.now(timezone.utc)
-        reopened_count = 0
-        eligible_count = 0
-        skipped_recent = 0
-        skipped_window_open = 0
-        skipped_not_allowed = 0
-        checked = 0
-        errors = []
-        preview_items = []
-        preview_limit = 50
-
-        for st in candidate_statuses:
-            q = fs.collection(FS_CONV_COLL).where("status", "==", st).stream()
-            for conv_doc in q:
-                checked += 1
-                conv_id = conv_doc.id
-                conv_data = conv_doc.to_dict() or {}
-                current_status = (conv_data.get("status") or st)
-                normalized_status = "pending_handoff" if current_status == "pending" else current_status
-
-                if scope == "staging_test":
-                    conv_phone_norm = _normalize_phone_query(conv_id)
-                    if conv_phone_norm not in allowed_test_phones:
-                        skipped_not_allowed += 1
-                        continue
-
-                last_sent_dt = _coerce_ts_to_dt(conv_data.get("last_reopen_template_at"))
-                if last_sent_dt and (now - last_sent_dt) < timedelta(hours=24):
-                    skipped_recent += 1
-                    continue
+        counts = {
+            "checked": 0,
+            "eligible_count": 0,
+            SKIPPED_RECENT: 0,
+            SKIPPED_WINDOW_OPEN: 0,
+            SKIPPED_NOT_ALLOWED: 0,
+        }
 
-                if not _is_outside_24h_window(
-                    conv_id,
+        if preview:
+            writer = PreviewWriter(scope, agent_id, now)
+            preview_items = []
+            for st, conv_doc in reopen_candidates(REOPEN_BATCH_SCOPES[scope]):
+                counts["checked"] += 1
+                conv_data = conv_doc.to_dict() or {}
+                result = evaluate(
+                    conv_doc.id,
                     conv_data,
                     conv_doc.reference,
-                    cache_last_inbound_at=(not preview),
-                ):
-                    skipped_window_open += 1
-                    continue
-
-                eligible_count += 1
-
-                if preview:
-                    if len(preview_items) < preview_limit:
-                        up = conv_data.get("updated_at")
-                        preview_items.append({
-                            "conversation_id": conv_id,
-                            "status": normalized_status,
-                            "updated_at": _iso(up) if up else None,
-                            "last_message_text": (conv_data.get("last_message_text") or "")[:120],
-                        })
-                    continue
-
-                if normalized_status == "pending_handoff":
-                    template_sid = REOPEN_TEMPLATE_SID_PENDING_HANDOFF
-                    template_name = "handoff_request"
-                elif normalized_status == "bot":
-                    template_sid = REOPEN_TEMPLATE_SID_BOT
-                    template_name = "retomada_bot"
-                else:
-                    template_sid = REOPEN_TEMPLATE_SID_DEFAULT
-                    template_name = "br_varizemed_reabertura_de_atendimento_utility"
-
-                user_name = _extract_user_name(conv_data).strip() or "Sr(a)"
-                created_date = _conversation_created_date(conv_data)
-                if not created_date:
-                    _logger().warning("conversation %s missing created_at; using current date for template", conv_id)
-                    created_date = _format_date_br(now)
-
-                variables = {
-                    "1": user_name,
-                    "2": created_date,
-                }
-
-                ok, info = _twilio_send_template(conv_id, template_sid, variables)
-                if not ok:
-                    log_event(
-                        "reopen_batch_error",
-                        conversation_id=conv_id,
-                        agent_id=agent_id,
-                        error_code=info.get("code"),
-                        error_message=info.get("message"),
-                        template_sid=template_sid,
-                        old_status=current_status,
-                        scope=scope,
-                    )
-                    errors.append({"conversation_id": conv_id, "error": info})
-                    continue
-
-                message_id = str(uuid.uuid4())
-                by = "system:template"
-                system_text = f"🔓 Conversa reaberta automaticamente por {actor_name}"
-                msg_doc = {
-                    "message_id": message_id,
-                    "direction": "out",
-                    "by": by,
-                    "display_name": actor_name,
-                    "text": system_text,
-                    "ts": firestore.SERVER_TIMESTAMP,
-                    "twilio_sid": info.get("sid"),
-                    "template_sid": template_sid,
-                    "template_name": template_name,
-                }
-
-                messages_ref(conv_id).document(message_id).set(msg_doc)
-
-                update_data = {
-                    "updated_at": firestore.SERVER_TIMESTAMP,
-                    "last_message_text": system_text[:200],
-                    "last_message_by": by,
-                    "reopened_at": firestore.SERVER_TIMESTAMP,
-                    "reopened_by": agent_id,
-                    "last_reopen_template_at": firestore.SERVER_TIMESTAMP,
-                    "last_reopen_template_sid": template_sid,
-                    "last_reopen_template_by": agent_id,
-                    "last_reopen_template_by_name": actor_name,
-                    "handoff_active": False,
-                }
-
-                if normalized_status != current_status:
-                    update_data["status"] = normalized_status
-
-                if normalized_status not in ("claimed", "active"):
-                    update_data["assignee"] = firestore.DELETE_FIELD
-                    update_data["assignee_name"] = firestore.DELETE_FIELD
-
-                    if normalized_status == "pending_handoff":
-                        update_data["status"] = "pending_handoff"
-                        update_data["assignee"] = firestore.DELETE_FIELD
-                        update_data["assignee_name"] = firestore.DELETE_FIELD
-                else:
-                    if normalized_status == "claimed" and conv_data.get("assignee"):
-                        update_data["assignee_name"] = conv_data.get("assignee")
-
-                if isinstance(conv_data, dict) and "claimed_by" in conv_data:
-                    update_data["claimed_by"] = firestore.DELETE_FIELD
-
-                conv_doc.reference.set(update_data, merge=True)
-                reopened_count += 1
-                log_event(
-                    "conversation_reopened_batch",
-                    conversation_id=conv_id,
-                    old_status=current_status,
-                    new_status=update_data.get("status", normalized_status),
-                    template_sid=template_sid,
-                    twilio_sid=info.get("sid"),
-                    actor=agent_id,
-                    scope=scope,
+                    now,
+                    allowed_phones,
+                    cache_last_inbound_at=False,
                 )
+                if result != ELIGIBLE:
+                    counts[result] += 1
+                    continue
 
-        if preview:
+                counts["eligible_count"] += 1
+                item = preview_item(conv_doc.id, conv_data, normalize_reopen_status(conv_data.get("status") or st))
+                writer.add(item)
+                if len(preview_items) < REOPEN_PREVIEW_SAMPLE_LIMIT:
+                    preview_items.append({
+                        "conversation_id": item["conversation_id"],
+                        "status": item["status"],
+                        "updated_at": item["updated_at"],
+                        "last_message_text": item["last_message_text"],
+                    })
+
+            expires_at = writer.finish(counts)
             log_event(
                 "reopen_batch_preview",
                 actor=agent_id,
                 scope=scope,
-                checked=checked,
-                eligible_count=eligible_count,
-                skipped_recent=skipped_recent,
-                skipped_window_open=skipped_window_open,
-                skipped_not_allowed=skipped_not_allowed,
+                preview_id=writer.preview_id,
+                **counts,
             )
             return jsonify(
                 success=True,
                 preview=True,
                 scope=scope,
                 is_staging=is_staging,
-                eligible_count=eligible_count,
-                skipped_recent=skipped_recent,
-                skipped_window_open=skipped_window_open,
-                skipped_not_allowed=skipped_not_allowed,
-                checked=checked,
+                preview_id=writer.preview_id,
+                expires_at=expires_at,
+                **counts,
                 sample_count=len(preview_items),
                 sample_conversations=preview_items,
+                # Continua a amostra em GET .../previews/<preview_id>?cursor=
+                next_cursor=encode_preview_cursor(
+                    (0, len(preview_items)) if counts["eligible_count"] > len(preview_items) else None
+                ),
             ), 200
 
+        if preview_id:
+            # Executa exatamente o conjunto da pre-visualizacao, relido em lotes e revalidado
+            try:
+                snapshot = claim_preview(preview_id, scope, agent_id, now)
+            except ReopenPreviewError as e:
+                return jsonify(error={"code": e.code, "message": e.message}), e.http_status
+            counts[SKIPPED_CHANGED] = 0
+            selected = (
+                (item["status"], item, snap)
+                for item, snap in iter_revalidated(iter_preview_items(preview_id, snapshot.get("chunk_count") or 0))
+            )
+        else:
+            selected = ((st, None, conv_doc) for st, conv_doc in reopen_candidates(REOPEN_BATCH_SCOPES[scope]))
+
+        reopened_count = 0
+        errors = []
+        for st, item, conv_doc in selected:
+            counts["checked"] += 1
+            if conv_doc is None:
+                counts[SKIPPED_CHANGED] += 1
+                continue
+            conv_data = conv_doc.to_dict() or {}
+            normalized_status = normalize_reopen_status(conv_data.get("status") or st)
+            if item is not None and normalized_status != item["status"]:
+                counts[SKIPPED_CHANGED] += 1
+                continue
+
+            result = evaluate(conv_doc.id, conv_data, conv_doc.reference, now, allowed_phones)
+            if result != ELIGIBLE:
+                counts[result] += 1
+                continue
+            counts["eligible_count"] += 1
+
+            if item is not None:
+                template_sid, template_name = item["template_sid"], item["template_name"]
+            else:
+                template_sid, template_name = reopen_template_for(normalized_status)
+            ok, info = reopen_one(
+                conv_doc,
+                conv_data,
+                normalized_status,
+                template_sid,
+                template_name,
+                agent_id,
+                actor_name,
+                scope,
+                now,
+            )
+            if ok:
+                reopened_count += 1
+            else:
+                errors.append({"conversation_id": conv_doc.id, "error": info})
+
         _logger().info(
-            "Reopen batch done: scope=%s reopened=%s eligible=%s skipped_recent=%s skipped_window_open=%s "
-            "skipped_not_allowed=%s checked=%s errors=%s",
+            "Reopen batch done: scope=%s preview_id=%s reopened=%s counts=%s errors=%s",
             scope,
+            preview_id or "-",
             reopened_count,
-            eligible_count,
-            skipped_recent,
-            skipped_window_open,
-            skipped_not_allowed,
-            checked,
+            counts,
             len(errors),
         )
 
@@ -1375,15 +1795,179 @@ def reopen_outdated_conversations():
             preview=False,
             scope=scope,
             is_staging=is_staging,
+            preview_id=preview_id or None,
             reopened_count=reopened_count,
-            eligible_count=eligible_count,
-            skipped_recent=skipped_recent,
-            skipped_window_open=skipped_window_open,
-            skipped_not_allowed=skipped_not_allowed,
-            checked=checked,
+            **counts,
             errors=errors[:50],
         ), 200
 
     except Exception as e:
         _logger().error("Error reopening outdated conversations: %s", e, exc_info=True)
         return jsonify(error={"code": "REOPEN_ERROR", "message": str(e)}), 500
+
+
+def _preview_page_item(item: dict) -> dict:
+    return {
+        "conversation_id": item["conversation_id"],
+        "status": item["status"],
+        "template_name": item.get("template_name"),
+        "updated_at": item.get("updated_at"),
+        "last_message_text": item.get("last_message_text") or "",
+    }
+
+
+@bp.get("/api/admin/reopen-outdated-conversations/previews/<preview_id>")
+@admin_login_required
+def reopen_preview_items(preview_id):
+    """
+    Revisao de um snapshot da pre-visualizacao: pagina de itens elegiveis (``limit`` +
+    ``cursor``) ou, com ``format=ndjson``, todos os itens a partir do cursor em streaming.
+    As contagens vem do snapshot (calculadas uma vez, na pre-visualizacao).
+    """
+    unauth = _require_auth(allow_session=True, allow_query=True)
+    if unauth:
+        return unauth
+
+    try:
+        snapshot = load_preview(preview_id, datetime.now(timezone.utc))
+    except ReopenPreviewError as e:
+        return jsonify(error={"code": e.code, "message": e.message}), e.http_status
+
+    position = decode_preview_cursor(request.args.get("cursor", ""))
+    if position is None:
+        return jsonify(error={"code": "BAD_REQUEST", "message": "cursor inválido"}), 400
+    fmt = (request.args.get("format") or "json").strip().lower()
+    if fmt not in ("json", "ndjson"):
+        return jsonify(error={"code": "BAD_REQUEST", "message": "format deve ser json ou ndjson"}), 400
+
+    chunk_count = snapshot.get("chunk_count") or 0
+    header = {
+        "preview_id": preview_id,
+        "scope": snapshot.get("scope"),
+        "created_at": snapshot.get("created_at"),
+        "expires_at": snapshot.get("expires_at"),
+        **(snapshot.get("counts") or {}),
+    }
+
+    if fmt == "ndjson":
+        dumps = current_app.json.dumps
+
+        def generate():
+            yield dumps({"event": "summary", **header}) + "\n"
+            sent = 0
+            for item in iter_preview_items(preview_id, chunk_count, position):
+                sent += 1
+                yield dumps({"event": "item", **_preview_page_item(item)}) + "\n"
+            yield dumps({"event": "done", "items": sent}) + "\n"
+
+        return Response(
+            stream_with_context(buffered(generate())),
+            mimetype="application/x-ndjson",
+            headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no"},
+        )
+
+    try:
+        limit = max(1, min(REOPEN_PREVIEW_PAGE_MAX, int(request.args.get("limit", REOPEN_PREVIEW_SAMPLE_LIMIT))))
+    except ValueError:
+        return jsonify(error={"code": "BAD_REQUEST", "message": "limit inválido"}), 400
+
+    items, next_position = preview_page(preview_id, chunk_count, position, limit)
+    return jsonify(
+        **header,
+        items=[_preview_page_item(item) for item in items],
+        next_cursor=encode_preview_cursor(next_position),
+    ), 200
+
+
+def _parse_export_date(value: str):
+    value = (value or "").strip()
+    if len(value) == 10:
+        value += "T00:00:00Z"  # so a data: meia-noite UTC
+    return _parse_iso(value)
+
+
+@bp.get("/api/admin/export")
+@admin_login_required
+def export_conversations():
+    """
+    Exporta conversas (``messages=1`` inclui as mensagens) em NDJSON ou CSV, em streaming.
+    Filtros: ``status`` (CSV), ``since``/``until`` sobre updated_at, ``limit``; ``cursor`` retoma;
+    ``gzip=1`` comprime na hora.
+    """
+    unauth = _require_auth(allow_session=True, allow_query=True)
+    if unauth:
+        return unauth
+
+    fmt = (request.args.get("format") or "ndjson").strip().lower()
+    if fmt not in EXPORT_FORMATS:
+        return jsonify(error={"code": "BAD_REQUEST", "message": "format deve ser ndjson ou csv"}), 400
+
+    statuses = [s.strip() for s in (request.args.get("status") or "").split(",") if s.strip()]
+    if len(statuses) > 10:
+        return jsonify(error={"code": "BAD_REQUEST", "message": "Maximo de 10 status"}), 400
+
+    since = until = None
+    for name in ("since", "until"):
+        raw = request.args.get(name)
+        if raw:
+            parsed = _parse_export_date(raw)
+            if not parsed:
+                return jsonify(error={"code": "BAD_REQUEST", "message": f"{name} invalido (use ISO 8601)"}), 400
+            if name == "since":
+                since = parsed
+            else:
+                until = parsed
+
+    try:
+        limit = max(0, int(request.args.get("limit") or 0))
+    except ValueError:
+        return jsonify(error={"code": "BAD_REQUEST", "message": "limit invalido"}), 400
+
+    after = None
+    cursor_str = (request.args.get("cursor") or "").strip()
+    if cursor_str:
+        cursor_obj = _decode_cursor(cursor_str) or {}
+        dt = _parse_iso(cursor_obj.get("updated_at") or "")
+        if not dt or not cursor_obj.get("id"):
+            return jsonify(error={"code": "BAD_REQUEST", "message": "cursor invalido"}), 400
+        after = (dt, cursor_obj["id"])
+
+    include_messages = _parse_bool(request.args.get("messages"), default=False)
+    use_gzip = _parse_bool(request.args.get("gzip"), default=False)
+    agent_id, _ = _agent_from_headers(allow_query=True)
+
+    def logged(records):
+        for record in records:
+            if record["type"] == "end":
+                log_event(
+                    "export",
+                    agent_id=agent_id,
+                    format=fmt,
+                    status=",".join(statuses) or None,
+                    since=_iso(since) if since else None,
+                    until=_iso(until) if until else None,
+                    messages=include_messages,
+                    conversations=record["conversations"],
+                    message_count=record["messages"],
+                )
+            yield record
+
+    records = logged(export_records(statuses, since, until, after, include_messages, limit))
+    if fmt == "csv":
+        body = buffered(csv_lines(records))
+        mimetype = "text/csv"
+    else:
+        body = buffered(ndjson_lines(records, current_app.json.dumps))
+        mimetype = "application/x-ndjson"
+
+    filename = f"crm-export-{datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S')}.{fmt}"
+    if use_gzip:
+        body = gzip_chunks(body)
+        mimetype = "application/gzip"
+        filename += ".gz"
+
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"', "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,14 @@
+from flask import Response
+
+from ... import metrics
+from ...core import _require_auth
+from . import bp
+
+
+@bp.get("/metrics")
+def prometheus_metrics():
+    """Metricas no formato Prometheus (sessao ou X-Admin-Token)."""
+    unauth = _require_auth(allow_session=True, allow_query=False)
+    if unauth:
+        return unauth
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
@@ -3,7 +3,8 @@ import uuid
 from flask import jsonify, request, session
 from google.cloud import firestore
 
-from ...core import FS_USERS_COLL, _agent_profile, _logger, fs, login_required, log_event
+from ... import conditional, quick_replies
+from ...core import FS_USERS_COLL, _agent_profile, _logger, fs, invalidate_agent_profile, login_required, log_event
 from . import bp
 
 
@@ -40,6 +41,7 @@ def user_profile_update():
             "use_prefix": use_prefix,
             "updated_at": firestore.SERVER_TIMESTAMP,
         }, merge=True)
+        invalidate_agent_profile(username)
 
         log_event("profile_update", user=username, display_name=display_name, use_prefix=use_prefix)
         return jsonify({"ok": True, "display_name": display_name, "use_prefix": use_prefix})
@@ -48,28 +50,6 @@ def user_profile_update():
         return jsonify({"error": "Erro ao atualizar perfil"}), 500
 
 
-def _load_quick_replies(username: str):
-    if not username:
-        return []
-    try:
-        snap = fs.collection(FS_USERS_COLL).document(username).get()
-        if not snap.exists:
-            return []
-        data = snap.to_dict() or {}
-        replies = data.get("quick_replies")
-        return replies if isinstance(replies, list) else []
-    except Exception as e:
-        _logger().warning("Erro ao carregar quick replies: %s", e)
-        return []
-
-
-def _save_quick_replies(username: str, replies: list):
-    fs.collection(FS_USERS_COLL).document(username).set({
-        "quick_replies": replies,
-        "updated_at": firestore.SERVER_TIMESTAMP,
-    }, merge=True)
-
-
 def _normalize_shortcut(raw: str):
     shortcut = (raw or "").strip()
     if not shortcut:
@@ -85,8 +65,29 @@ def list_quick_replies():
     username = session.get("user")
     if not username:
         return jsonify({"error": "unauthorized"}), 401
-    replies = _load_quick_replies(username)
-    return jsonify({"items": replies})
+    qr = quick_replies.load(username)
+    if conditional.wants_revalidation():
+        not_modified = conditional.not_modified(qr.etag)
+        if not_modified is not None:
+            return not_modified
+    return conditional.with_etag(jsonify({"items": qr.items}), qr.etag)
+
+
+@bp.get("/api/user/quick-replies/suggest")
+@login_required
+def suggest_quick_replies():
+    """Autocomplete de atalhos: respostas cujo atalho comeca com ``prefix``"""
+    username = session.get("user")
+    if not username:
+        return jsonify({"error": "unauthorized"}), 401
+    prefix = _normalize_shortcut(request.args.get("prefix") or "")
+    try:
+        limit = int(request.args.get("limit") or 10)
+    except ValueError:
+        return jsonify({"error": "limit invalido"}), 400
+    limit = max(1, min(limit, quick_replies.QUICK_REPLIES_SUGGEST_MAX))
+    qr = quick_replies.load(username)
+    return jsonify({"items": qr.suggest(prefix, limit)})
 
 
 @bp.post("/api/user/quick-replies")
@@ -112,11 +113,10 @@ def create_quick_reply():
     if shortcut and (" " in shortcut or len(shortcut) > 40):
         return jsonify({"error": "shortcut invalido (sem espacos, max 40)"}), 400
 
-    replies = _load_quick_replies(username)
-    if shortcut:
-        for r in replies:
-            if (r.get("shortcut") or "").strip() == shortcut:
-                return jsonify({"error": "shortcut ja existe"}), 400
+    current = quick_replies.load(username, fresh=True)
+    if shortcut and current.shortcut_taken(shortcut):
+        return jsonify({"error": "shortcut ja existe"}), 400
+    replies = [dict(r) for r in current.items]
 
     reply = {
         "id": str(uuid.uuid4()),
@@ -125,7 +125,7 @@ def create_quick_reply():
         "shortcut": shortcut,
     }
     replies.append(reply)
-    _save_quick_replies(username, replies)
+    quick_replies.save(username, replies)
 
     log_event("quick_reply_create", user=username, reply_id=reply["id"])
     return jsonify(reply), 201
@@ -154,21 +154,17 @@ def update_quick_reply(reply_id):
     if shortcut and (" " in shortcut or len(shortcut) > 40):
         return jsonify({"error": "shortcut invalido (sem espacos, max 40)"}), 400
 
-    replies = _load_quick_replies(username)
-    found = False
-    for r in replies:
-        if r.get("id") == reply_id:
-            found = True
-            r["title"] = title
-            r["text"] = text
-            r["shortcut"] = shortcut
-        elif shortcut and (r.get("shortcut") or "").strip() == shortcut:
-            return jsonify({"error": "shortcut ja existe"}), 400
-
-    if not found:
+    current = quick_replies.load(username, fresh=True)
+    if reply_id not in current.by_id:
         return jsonify({"error": "quick reply nao encontrada"}), 404
-
-    _save_quick_replies(username, replies)
+    if shortcut and current.shortcut_taken(shortcut, exclude_id=reply_id):
+        return jsonify({"error": "shortcut ja existe"}), 400
+
+    replies = [
+        {**r, "title": title, "text": text, "shortcut": shortcut} if r.get("id") == reply_id else r
+        for r in current.items
+    ]
+    quick_replies.save(username, replies)
     log_event("quick_reply_update", user=username, reply_id=reply_id)
     return jsonify({"ok": True, "id": reply_id})
 
@@ -180,11 +176,11 @@ def delete_quick_reply(reply_id):
     if not username:
         return jsonify({"error": "unauthorized"}), 401
 
-    replies = _load_quick_replies(username)
+    replies = quick_replies.load(username, fresh=True).items
     next_replies = [r for r in replies if r.get("id") != reply_id]
     if len(next_replies) == len(replies):
         return jsonify({"error": "quick reply nao encontrada"}), 404
 
-    _save_quick_replies(username, next_replies)
+    quick_replies.save(username, next_replies)
     log_event("quick_reply_delete", user=username, reply_id=reply_id)
     return jsonify({"ok": True})
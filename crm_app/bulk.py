@@ -0,0 +1,204 @@
+"""
+Acoes em lote sobre conversas (resolve, tag, assign).
+
+Os documentos sao lidos em paginas (get_all para ids, consulta ordenada por id
+para filtros) e cada item passa pelas mesmas regras das rotas individuais. As
+gravacoes vao em WriteBatch de ate BULK_CHUNK_SIZE updates com precondicao
+``last_update_time``, com no maximo BULK_PARALLELISM commits em voo. Se um lote
+for rejeitado por escrita concorrente, os itens dele sao refeitos um a um via
+``apply_update``. ``run_bulk`` gera eventos (item/progress/done) sob demanda, sem
+manter o conjunto inteiro em memoria.
+"""
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from google.api_core import exceptions as gexc
+from google.cloud import firestore
+from google.cloud.firestore_v1.field_path import FieldPath
+
+from . import metrics
+from .core import FS_CONV_COLL, _logger, conv_ref, fs
+from .summaries import with_summary
+from .transitions import TransitionError, apply_update, plan_transition
+
+BULK_ACTIONS = ("resolve", "tag", "assign")
+BULK_TAG_MODES = ("add", "remove", "set")
+BULK_MAX_IDS = int(os.getenv("CONVERSATION_BULK_MAX_IDS", "1000"))
+BULK_CHUNK_SIZE = max(1, min(500, int(os.getenv("CONVERSATION_BULK_CHUNK_SIZE", "200"))))
+BULK_PARALLELISM = max(1, int(os.getenv("CONVERSATION_BULK_PARALLELISM", "4")))
+BULK_READ_PAGE_SIZE = 100
+
+TAG_MAX_LEN = 40
+TAG_MAX_PER_CONVERSATION = 12
+
+_executor = ThreadPoolExecutor(max_workers=BULK_PARALLELISM, thread_name_prefix="fs-bulk")
+
+
+def normalize_tags(tags: list) -> list[str]:
+    """Remove vazios e duplicadas; ValueError se alguma tag passar de TAG_MAX_LEN."""
+    normalized = []
+    seen = set()
+    for raw in tags:
+        tag = str(raw or "").strip()
+        if not tag:
+            continue
+        if len(tag) > TAG_MAX_LEN:
+            raise ValueError(f"Tag muito longa (max {TAG_MAX_LEN} caracteres)")
+        if tag in seen:
+            continue
+        seen.add(tag)
+        normalized.append(tag)
+    return normalized
+
+
+def tag_planner(tags: list[str], mode: str):
+    """plan(data) para adicionar/remover/substituir tags (None quando nada muda)."""
+    def plan(data: dict) -> dict | None:
+        current = [t for t in (data.get("tags") or []) if isinstance(t, str)]
+        if mode == "set":
+            new = list(tags)
+        elif mode == "add":
+            new = current + [t for t in tags if t not in current]
+        else:
+            new = [t for t in current if t not in tags]
+        if new == current:
+            return None
+        if len(new) > TAG_MAX_PER_CONVERSATION:
+            raise TransitionError("INVALID", f"Máximo de {TAG_MAX_PER_CONVERSATION} tags por conversa")
+        return {"tags": new, "updated_at": firestore.SERVER_TIMESTAMP}
+    return plan
+
+
+def transition_planner(action: str, agent_id: str, display_name: str = ""):
+    """plan(data) de resolve (pelo agente) ou assign (takeover para ``agent_id``)."""
+    name = "takeover" if action == "assign" else action
+    return lambda data: plan_transition(name, data, agent_id, display_name)
+
+
+def iter_ids(ids: list[str]):
+    """(conversation_id, snapshot|None) na ordem pedida, lendo BULK_READ_PAGE_SIZE por get_all."""
+    for start in range(0, len(ids), BULK_READ_PAGE_SIZE):
+        chunk = ids[start:start + BULK_READ_PAGE_SIZE]
+        valid = [conv_id for conv_id in chunk if "/" not in conv_id]
+        found = {}
+        if valid:
+            for snap in fs.get_all([conv_ref(conv_id) for conv_id in valid]):
+                if snap.exists:
+                    found[snap.id] = snap
+        for conv_id in chunk:
+            yield conv_id, found.get(conv_id)
+
+
+def iter_filter(status: str = "", tag: str = "", limit: int = 0):
+    """Conversas que casam com status/tag, paginadas por id do documento."""
+    q = fs.collection(FS_CONV_COLL)
+    if status:
+        q = q.where("status", "==", status)
+    if tag:
+        q = q.where("tags", "array_contains", tag)
+    q = q.order_by(FieldPath.document_id())
+
+    seen = 0
+    last = None
+    while True:
+        page_size = BULK_READ_PAGE_SIZE if not limit else min(BULK_READ_PAGE_SIZE, limit - seen)
+        if page_size <= 0:
+            return
+        page = q.limit(page_size)
+        if last is not None:
+            page = page.start_after(last)
+        docs = list(page.stream())
+        for snap in docs:
+            yield snap.id, snap
+        seen += len(docs)
+        if len(docs) < page_size:
+            return
+        last = docs[-1]
+
+
+def _item(conversation_id: str, result: str, code: str = "", message: str = "") -> dict:
+    item = {"event": "item", "conversation_id": conversation_id, "result": result}
+    if code:
+        item["error"] = {"code": code, "message": message}
+    return item
+
+
+def _apply_single(conversation_id: str, plan) -> dict:
+    try:
+        _, updates = apply_update(conversation_id, plan)
+    except TransitionError as e:
+        return _item(conversation_id, "error", e.code, e.message)
+    except gexc.GoogleAPICallError as e:
+        # Erro transitorio (ServiceUnavailable, DeadlineExceeded...) nao pode encerrar o stream
+        _logger().warning("Falha ao gravar %s na acao em massa: %s", conversation_id, e)
+        return _item(conversation_id, "error", "WRITE_FAILED", str(e)[:200])
+    return _item(conversation_id, "ok" if updates is not None else "skipped")
+
+
+def _commit_chunk(chunk: list, plan) -> list[dict]:
+    """Um WriteBatch para o bloco; em conflito refaz item a item sobre o estado atual."""
+    batch = fs.batch()
+    for conv_id, snap, updates in chunk:
+        batch.update(
+            snap.reference,
+            with_summary(conv_id, snap.to_dict() or {}, updates),
+            option=fs.write_option(last_update_time=snap.update_time),
+        )
+    try:
+        batch.commit()
+    except (gexc.FailedPrecondition, gexc.NotFound):
+        metrics.inc("crm_bulk_chunk_retries_total")
+        return [_apply_single(conv_id, plan) for conv_id, _, _ in chunk]
+    except gexc.GoogleAPICallError as e:
+        _logger().warning("Falha no commit em lote (%s itens): %s", len(chunk), e)
+        return [_item(conv_id, "error", "WRITE_FAILED", str(e)[:200]) for conv_id, _, _ in chunk]
+    return [_item(conv_id, "ok") for conv_id, _, _ in chunk]
+
+
+def run_bulk(source, plan):
+    """
+    Aplica ``plan`` as conversas de ``source`` (iterador de (id, snapshot|None)).
+    Gera um evento ``item`` por conversa, ``progress`` a cada bloco gravado e ``done`` no fim.
+    """
+    totals = {"processed": 0, "ok": 0, "skipped": 0, "errors": 0}
+    commit = metrics.bind_request_cost(_commit_chunk)
+    pending = deque()
+    chunk = []
+
+    def count(item: dict) -> dict:
+        totals["processed"] += 1
+        totals["errors" if item["result"] == "error" else item["result"]] += 1
+        return item
+
+    def drain_one():
+        for item in pending.popleft().result():
+            yield count(item)
+        yield {"event": "progress", **totals}
+
+    for conv_id, snap in source:
+        if snap is None:
+            yield count(_item(conv_id, "error", "NOT_FOUND", "Conversa não encontrada"))
+            continue
+        try:
+            updates = plan(snap.to_dict() or {})
+        except TransitionError as e:
+            yield count(_item(conv_id, "error", e.code, e.message))
+            continue
+        if updates is None:
+            yield count(_item(conv_id, "skipped"))
+            continue
+
+        chunk.append((conv_id, snap, updates))
+        if len(chunk) >= BULK_CHUNK_SIZE:
+            pending.append(_executor.submit(commit, chunk, plan))
+            chunk = []
+            while len(pending) >= BULK_PARALLELISM:
+                yield from drain_one()
+
+    if chunk:
+        pending.append(_executor.submit(commit, chunk, plan))
+    while pending:
+        yield from drain_one()
+
+    yield {"event": "done", **totals}
@@ -0,0 +1,429 @@
+"""
+Caches do crm_app.
+
+``MicroCache``: micro-cache em processo para consultas compartilhadas entre
+atendentes. TTL curto (1-2s) com single-flight: requisicoes concorrentes com a
+mesma chave esperam a primeira e reutilizam o resultado, em vez de repetir a
+consulta no Firestore. ``invalidate()`` descarta tudo (inclusive consultas em
+andamento); com ``broadcast_invalidation=True`` tambem avisa os outros processos
+pelo canal de invalidacao.
+
+``shared_cache``: chave/valor compartilhado entre workers e instancias (perfis,
+quick replies, chaves de idempotencia, rate limit). CACHE_BACKEND escolhe:
+- ``memory`` (padrao): LRU com TTL no proprio processo; pub/sub so local;
+- ``redis``: servidor Redis (ou compativel) em CACHE_REDIS_URL via redis-py,
+  dependencia opcional importada so nesse caso.
+Valores sao strings (``get_json``/``set_json`` para dicts). Falhas do Redis nao
+derrubam a requisicao: leitura vira miss, escrita e ignorada e o erro e contado
+em ``crm_shared_cache_errors_total``.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from . import metrics
+
+CACHE_BACKEND = (os.getenv("CACHE_BACKEND", "memory") or "memory").strip().lower()
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://127.0.0.1:6379/0")
+CACHE_KEY_PREFIX = os.getenv("CACHE_KEY_PREFIX", "crm:")
+CACHE_MEMORY_MAX_ENTRIES = int(os.getenv("CACHE_MEMORY_MAX_ENTRIES", "10000"))
+CACHE_REDIS_TIMEOUT_SEC = float(os.getenv("CACHE_REDIS_TIMEOUT_SEC", "0.5"))
+CACHE_REDIS_POOL_SIZE = int(os.getenv("CACHE_REDIS_POOL_SIZE", "8"))
+
+# Canal de pub/sub onde ``MicroCache.invalidate`` avisa os outros processos
+INVALIDATION_CHANNEL = "invalidate"
+# Identifica este processo nas mensagens de invalidacao (ignora o proprio eco)
+_ORIGIN = uuid.uuid4().hex
+
+
+class _Backend:
+    name = ""
+
+    def get_json(self, key: str):
+        raw = self.get(key)
+        if raw is None:
+            return None
+        try:
+            return json.loads(raw)
+        except ValueError:
+            return None
+
+    def set_json(self, key: str, value, ttl_sec: float | None = None, nx: bool = False) -> bool:
+        return self.set(key, json.dumps(value, ensure_ascii=False, separators=(",", ":")), ttl_sec, nx)
+
+
+class MemoryBackend(_Backend):
+    """LRU com TTL no processo. Pub/sub entrega so para assinantes deste processo."""
+
+    name = "memory"
+
+    def __init__(self, max_entries: int = CACHE_MEMORY_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: OrderedDict = OrderedDict()  # key -> (expires_at | None, value)
+        self._subscribers: dict = {}  # canal -> [callback]
+
+    def _live(self, key: str, now: float):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] is not None and entry[0] <= now:
+            del self._entries[key]
+            return None
+        return entry
+
+    def _store(self, key: str, expires_at, value: str):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            entry = self._live(key, time.monotonic())
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: str, value: str, ttl_sec: float | None = None, nx: bool = False) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            if nx and self._live(key, now) is not None:
+                return False
+            self._store(key, now + ttl_sec if ttl_sec else None, value)
+            return True
+
+    def incr(self, key: str, amount: int = 1, ttl_sec: float | None = None) -> int:
+        """Soma ``amount``; ``ttl_sec`` vale so quando a chave e criada (janela fixa)."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._live(key, now)
+            if entry is None:
+                value, expires_at = amount, (now + ttl_sec if ttl_sec else None)
+            else:
+                value, expires_at = int(entry[1]) + amount, entry[0]
+            self._store(key, expires_at, str(value))
+            return value
+
+    def ttl(self, key: str) -> float | None:
+        """Segundos ate expirar (None se a chave nao existe ou nao expira)."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._live(key, now)
+            if entry is None or entry[0] is None:
+                return None
+            return max(0.0, entry[0] - now)
+
+    def expire(self, key: str, ttl_sec: float) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._live(key, now)
+            if entry is None:
+                return False
+            self._entries[key] = (now + ttl_sec, entry[1])
+            return True
+
+    def delete(self, *keys: str) -> int:
+        with self._lock:
+            return sum(1 for key in keys if self._entries.pop(key, None) is not None)
+
+    def publish(self, channel: str, message: str) -> int:
+        with self._lock:
+            callbacks = list(self._subscribers.get(channel, ()))
+        for callback in callbacks:
+            callback(message)
+        return len(callbacks)
+
+    def subscribe(self, channel: str, callback):
+        with self._lock:
+            self._subscribers.setdefault(channel, []).append(callback)
+
+
+class RedisBackend(_Backend):
+    """Backend Redis via redis-py (opcional: requirements-redis.txt), com uma thread de pub/sub."""
+
+    name = "redis"
+
+    def __init__(self, url: str = CACHE_REDIS_URL, prefix: str = CACHE_KEY_PREFIX,
+                 timeout_sec: float = CACHE_REDIS_TIMEOUT_SEC, pool_size: int = CACHE_REDIS_POOL_SIZE):
+        import redis  # so com CACHE_BACKEND=redis
+
+        self._errors = (redis.RedisError, OSError)
+        self.prefix = prefix
+        self.client = redis.Redis.from_url(
+            url, socket_timeout=timeout_sec, socket_connect_timeout=timeout_sec,
+            max_connections=pool_size, decode_responses=True,
+        )
+        # Sem timeout de leitura: a conexao de pub/sub fica parada esperando mensagens
+        self._pubsub_client = redis.Redis.from_url(
+            url, socket_timeout=None, socket_connect_timeout=timeout_sec, decode_responses=True,
+        )
+        self._lock = threading.Lock()
+        self._subscribers: dict = {}
+        self._listener: threading.Thread | None = None
+        self._pubsub = None
+        self._last_warning = 0.0
+
+    def _call(self, default, command: str, fn, *args, **kwargs):
+        try:
+            return fn(*args, **kwargs)
+        except self._errors as e:
+            metrics.inc("crm_shared_cache_errors_total", {"command": command})
+            now = time.monotonic()
+            if now - self._last_warning >= 30:
+                self._last_warning = now
+                _log_warning("Cache compartilhado indisponivel (%s): %s", command, e)
+            return default
+
+    def _key(self, key: str) -> str:
+        return self.prefix + key
+
+    def get(self, key: str) -> str | None:
+        return self._call(None, "get", self.client.get, self._key(key))
+
+    def set(self, key: str, value: str, ttl_sec: float | None = None, nx: bool = False) -> bool:
+        px = max(1, int(ttl_sec * 1000)) if ttl_sec else None
+        return bool(self._call(None, "set", self.client.set, self._key(key), value, px=px, nx=nx))
+
+    def incr(self, key: str, amount: int = 1, ttl_sec: float | None = None) -> int:
+        """Soma ``amount``; ``ttl_sec`` vale so quando a chave e criada (janela fixa). 0 se indisponivel."""
+        value = self._call(0, "incrby", self.client.incrby, self._key(key), amount)
+        if value == amount and ttl_sec:
+            self._call(False, "pexpire", self.client.pexpire, self._key(key), max(1, int(ttl_sec * 1000)))
+        return value
+
+    def ttl(self, key: str) -> float | None:
+        ms = self._call(-2, "pttl", self.client.pttl, self._key(key))
+        return None if ms < 0 else ms / 1000.0
+
+    def expire(self, key: str, ttl_sec: float) -> bool:
+        return bool(self._call(False, "pexpire", self.client.pexpire, self._key(key), max(1, int(ttl_sec * 1000))))
+
+    def delete(self, *keys: str) -> int:
+        if not keys:
+            return 0
+        return self._call(0, "del", self.client.delete, *(self._key(k) for k in keys))
+
+    def publish(self, channel: str, message: str) -> int:
+        return self._call(0, "publish", self.client.publish, self._key(channel), message)
+
+    def subscribe(self, channel: str, callback):
+        channel = self._key(channel)
+        with self._lock:
+            new_channel = channel not in self._subscribers
+            self._subscribers.setdefault(channel, []).append(callback)
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name="cache-pubsub", daemon=True)
+                self._listener.start()
+            elif new_channel and self._pubsub is not None:
+                try:
+                    self._pubsub.subscribe(channel)
+                except self._errors:
+                    pass  # a reconexao assina todos os canais
+
+    def _listen(self):
+        delay = 1.0
+        while True:
+            pubsub = self._pubsub_client.pubsub(ignore_subscribe_messages=True)
+            try:
+                with self._lock:
+                    channels = list(self._subscribers)
+                pubsub.subscribe(*channels)
+                with self._lock:
+                    self._pubsub = pubsub
+                delay = 1.0
+                for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    with self._lock:
+                        callbacks = list(self._subscribers.get(message["channel"], ()))
+                    for callback in callbacks:
+                        try:
+                            callback(message["data"])
+                        except Exception as e:
+                            _log_warning("Falha ao tratar mensagem de %s: %s", message["channel"], e)
+            except self._errors as e:
+                metrics.inc("crm_shared_cache_errors_total", {"command": "subscribe"})
+                _log_warning("Pub/sub do cache desconectado, reconectando em %.0fs: %s", delay, e)
+            finally:
+                with self._lock:
+                    self._pubsub = None
+                pubsub.close()
+            # Invalidacoes perdidas enquanto desconectado: limpa os micro-caches que dependem delas
+            _clear_broadcast_caches()
+            time.sleep(delay)
+            delay = min(delay * 2, 30.0)
+
+
+def _log_warning(msg: str, *args):
+    from .core import _logger
+
+    _logger().warning(msg, *args)
+
+
+def _build_backend() -> _Backend:
+    if CACHE_BACKEND == "redis":
+        try:
+            return RedisBackend()
+        except ImportError:
+            # Chamado no import de core: usa o logger direto (sem _log_warning)
+            logging.getLogger("crm-api").warning(
+                "CACHE_BACKEND=redis sem o pacote redis (requirements-redis.txt); usando memory")
+    return MemoryBackend()
+
+
+shared_cache = _build_backend()
+
+
+class _Flight:
+    __slots__ = ("event", "value", "failed")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.failed = False
+
+
+class MicroCache:
+    def __init__(self, name: str, ttl_sec: float, max_entries: int = 256, wait_timeout_sec: float = 10.0,
+                 broadcast_invalidation: bool = False):
+        self.name = name
+        self.ttl_sec = ttl_sec
+        self.max_entries = max_entries
+        self.wait_timeout_sec = wait_timeout_sec
+        self._lock = threading.Lock()
+        self._entries: OrderedDict = OrderedDict()  # key -> (expires_at, value)
+        self._flights: dict = {}
+        self._generation = 0
+        self.broadcast_invalidation = broadcast_invalidation
+        if broadcast_invalidation:
+            _register(self)
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_sec > 0
+
+    def _record(self, result: str):
+        metrics.inc("crm_cache_requests_total", {"cache": self.name, "result": result})
+
+    def get_or_compute(self, key, compute):
+        """
+        Retorna o valor em cache para ``key`` ou executa ``compute()`` uma unica vez
+        por chave entre as threads concorrentes. O valor nao deve ser alterado.
+        """
+        if not self.enabled:
+            return compute()
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self._record("hit")
+                return entry[1]
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[key] = flight
+            generation = self._generation
+
+        if not leader:
+            if flight.event.wait(self.wait_timeout_sec) and not flight.failed:
+                self._record("shared")
+                return flight.value
+            # A consulta original falhou ou demorou demais: segue sozinho
+            self._record("miss")
+            return compute()
+
+        self._record("miss")
+        try:
+            value = compute()
+        except Exception:
+            flight.failed = True
+            raise
+        else:
+            flight.value = value
+            with self._lock:
+                if generation == self._generation:
+                    self._entries[key] = (time.monotonic() + self.ttl_sec, value)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+            return value
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            flight.event.set()
+
+    def clear_local(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            # Consultas em andamento podem ter lido o estado anterior a escrita
+            self._flights.clear()
+
+    def invalidate(self):
+        """Descarta o cache neste processo e, com ``broadcast_invalidation``, nos demais."""
+        self.clear_local()
+        metrics.inc("crm_cache_invalidations_total", {"cache": self.name})
+        if self.broadcast_invalidation:
+            shared_cache.publish(INVALIDATION_CHANNEL, json.dumps({"cache": self.name, "origin": _ORIGIN}))
+
+
+_registry_lock = threading.Lock()
+_registry: dict = {}  # nome -> [MicroCache] (so os com broadcast_invalidation)
+
+
+def _on_invalidation(message: str):
+    try:
+        payload = json.loads(message)
+    except ValueError:
+        return
+    if payload.get("origin") == _ORIGIN:
+        return
+    with _registry_lock:
+        caches = list(_registry.get(payload.get("cache"), ()))
+    for cache in caches:
+        cache.clear_local()
+    if caches:
+        metrics.inc("crm_cache_remote_invalidations_total", {"cache": payload.get("cache")})
+
+
+def _register(cache: MicroCache):
+    with _registry_lock:
+        first = not _registry
+        _registry.setdefault(cache.name, []).append(cache)
+    if first:
+        shared_cache.subscribe(INVALIDATION_CHANNEL, _on_invalidation)
+
+
+def _clear_broadcast_caches():
+    with _registry_lock:
+        caches = [c for group in _registry.values() for c in group]
+    for cache in caches:
+        cache.clear_local()
+
+
+def rate_limit(key: str, limit: int, window_sec: float) -> float | None:
+    """
+    Janela fixa compartilhada: conta uma chamada em ``key`` e devolve None se
+    ainda cabe em ``limit`` por ``window_sec``, ou os segundos ate a janela abrir.
+    Com o backend indisponivel libera (``incr`` devolve 0).
+    """
+    count = shared_cache.incr(f"rl:{key}", 1, ttl_sec=window_sec)
+    if count <= limit:
+        return None
+    metrics.inc("crm_rate_limited_total", {"limit": key.split(":", 1)[0]})
+    remaining = shared_cache.ttl(f"rl:{key}")
+    if remaining is None:
+        # Contador sem expiracao (PEXPIRE perdido): fecha a janela agora
+        shared_cache.expire(f"rl:{key}", window_sec)
+        return window_sec
+    return max(remaining, 0.001)
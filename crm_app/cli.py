@@ -0,0 +1,99 @@
+"""
+Comandos de manutencao (flask --app app <comando>).
+"""
+from datetime import datetime, timezone
+
+import click
+from google.cloud.firestore_v1.field_path import FieldPath
+
+from .core import FS_CONV_COLL, fs
+from .search_index import FS_SEARCH_INDEX_COLL, MESSAGE_INDEX_META_DOC, index_ref, rebuild_conversation, sync_index
+from .summaries import build_conversation_summary, summary_is_fresh
+
+
+@click.command("backfill-summaries")
+@click.option("--batch-size", default=400, show_default=True, type=click.IntRange(1, 500))
+@click.option("--dry-run", is_flag=True, help="Apenas conta as conversas sem summary atualizado.")
+@click.option("--force", is_flag=True, help="Regrava o summary mesmo quando ja estiver atualizado.")
+def backfill_summaries(batch_size: int, dry_run: bool, force: bool):
+    """Preenche o campo summary das conversas (nao altera updated_at)."""
+    scanned = 0
+    written = 0
+    last = None
+    while True:
+        q = fs.collection(FS_CONV_COLL).order_by(FieldPath.document_id()).limit(batch_size)
+        if last is not None:
+            q = q.start_after(last)
+        docs = list(q.stream())
+        if not docs:
+            break
+
+        batch = fs.batch()
+        pending = 0
+        for doc in docs:
+            scanned += 1
+            data = doc.to_dict() or {}
+            if not force and summary_is_fresh(data):
+                continue
+            if not dry_run:
+                batch.update(doc.reference, {"summary": build_conversation_summary(doc.id, data)})
+            pending += 1
+        if pending and not dry_run:
+            batch.commit()
+        written += pending
+        last = docs[-1]
+        click.echo(f"{scanned} conversas lidas, {written} {'a atualizar' if dry_run else 'atualizadas'}")
+
+    click.echo(f"Concluido: {scanned} lidas, {written} {'a atualizar' if dry_run else 'atualizadas'}.")
+
+
+@click.command("build-message-index")
+@click.option("--batch-size", default=100, show_default=True, type=click.IntRange(1, 500))
+@click.option("--incremental", is_flag=True, help="So indexa mensagens novas desde o ultimo sync (marca d'agua).")
+def build_message_index(batch_size: int, incremental: bool):
+    """Monta o indice de busca por texto das mensagens (historico completo ou incremental)."""
+    if incremental:
+        total = 0
+        while True:
+            result = sync_index()
+            total += result["messages"]
+            click.echo(f"{total} mensagens indexadas (marca d'agua {result['watermark']})")
+            if result["done"]:
+                break
+        return
+
+    started_at = datetime.now(timezone.utc)
+    scanned = 0
+    indexed = 0
+    last = None
+    while True:
+        q = fs.collection(FS_CONV_COLL).order_by(FieldPath.document_id()).select([]).limit(batch_size)
+        if last is not None:
+            q = q.start_after(last)
+        docs = list(q.stream())
+        if not docs:
+            break
+
+        batch = fs.batch()
+        pending = 0
+        for doc in docs:
+            scanned += 1
+            entry = rebuild_conversation(doc.id)
+            if entry is None:
+                continue
+            batch.set(index_ref(doc.id), entry)
+            pending += 1
+        if pending:
+            batch.commit()
+        indexed += pending
+        last = docs[-1]
+        click.echo(f"{scanned} conversas lidas, {indexed} indexadas")
+
+    # Mensagens gravadas durante a montagem entram no proximo sync incremental
+    fs.collection(FS_SEARCH_INDEX_COLL).document(MESSAGE_INDEX_META_DOC).set({"watermark": started_at}, merge=True)
+    click.echo(f"Concluido: {scanned} conversas lidas, {indexed} indexadas.")
+
+
+def init_app(app):
+    app.cli.add_command(backfill_summaries)
+    app.cli.add_command(build_message_index)
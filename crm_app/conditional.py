@@ -0,0 +1,60 @@
+"""
+GET condicional (ETag / If-None-Match) para as rotas de leitura de conversa.
+
+O ETag e forte e derivado so de validadores baratos (``update_time`` do
+documento da conversa, id/ts da mensagem mais recente e os parametros da
+requisicao), entao a verificacao nao precisa montar a resposta: quando o cliente
+manda ``If-None-Match`` a rota le so os validadores e responde ``304`` sem corpo.
+``Cache-Control: private, no-cache`` faz o navegador guardar a resposta e sempre
+revalidar.
+"""
+import hashlib
+
+from flask import Response, request
+
+from . import metrics
+
+# Mude quando o formato das respostas mudar (invalida os ETags antigos)
+ETAG_VERSION = "1"
+CACHE_CONTROL = "private, no-cache"
+
+
+def _token(value) -> str:
+    if value is None:
+        return "-"
+    rfc3339 = getattr(value, "rfc3339", None)  # DatetimeWithNanoseconds (precisao de ns)
+    if rfc3339 is not None:
+        return rfc3339()
+    isoformat = getattr(value, "isoformat", None)
+    return isoformat() if isoformat is not None else str(value)
+
+
+def make_etag(*parts) -> str:
+    raw = "|".join([ETAG_VERSION, *(_token(p) for p in parts)])
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:24]
+
+
+def wants_revalidation() -> bool:
+    return bool(request.if_none_match)
+
+
+def _record(result: str):
+    metrics.inc("crm_conditional_requests_total", {"endpoint": request.endpoint or "unknown", "result": result})
+
+
+def not_modified(etag: str) -> Response | None:
+    """304 se o ``If-None-Match`` da requisicao casa com ``etag``; senao None."""
+    if not request.if_none_match.contains(etag):
+        _record("modified")
+        return None
+    _record("not_modified")
+    resp = Response(status=304)
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = CACHE_CONTROL
+    return resp
+
+
+def with_etag(resp: Response, etag: str) -> Response:
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = CACHE_CONTROL
+    return resp
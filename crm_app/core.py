@@ -12,8 +12,10 @@ from pathlib import Path
 import requests
 from flask import current_app, has_app_context, jsonify, redirect, request, session, url_for
 from google.cloud import firestore
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+
+from . import metrics
+from .cache import shared_cache
+from .twilio_client import TwilioUnavailable, twilio_client
 
 try:
     from zoneinfo import ZoneInfo
@@ -21,29 +23,6 @@ except Exception:
     ZoneInfo = None
 
 
-# ================== RETRY CONFIG (SSLEOFError patch) ==================
-
-def _get_retry_session(retries=3, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504)):
-    """Sessão requests com retry automático para erros de SSL/conexão."""
-    session_obj = requests.Session()
-    retry = Retry(
-        total=retries,
-        read=retries,
-        connect=retries,
-        backoff_factor=backoff_factor,
-        status_forcelist=status_forcelist,
-        allowed_methods=["GET", "POST"],
-        raise_on_status=False,
-    )
-    adapter = HTTPAdapter(max_retries=retry)
-    session_obj.mount("https://", adapter)
-    session_obj.mount("http://", adapter)
-    return session_obj
-
-
-# Sessão global com retry (reutilizada para performance)
-http_session = _get_retry_session()
-
 # ================== Config ==================
 CRM_ADMIN_TOKEN = (os.getenv("CRM_ADMIN_TOKEN", "") or "").strip()
 
@@ -56,6 +35,7 @@ USERS = {
 TWILIO_ACCOUNT_SID = (os.getenv("TWILIO_ACCOUNT_SID", "") or "").strip()
 TWILIO_AUTH_TOKEN_REST = (os.getenv("TWILIO_AUTH_TOKEN_REST", "") or "").strip()
 TWILIO_FROM = (os.getenv("TWILIO_WHATSAPP_FROM", "") or "").strip()
+TWILIO_API_BASE = (os.getenv("TWILIO_API_BASE", "https://api.twilio.com") or "").strip().rstrip("/")
 
 # Templates (WhatsApp Content API)
 REOPEN_TEMPLATE_SID_DEFAULT = (
@@ -75,10 +55,15 @@ TWILIO_AUTH_TOKEN_SIG = (os.getenv("TWILIO_AUTH_TOKEN", "") or "").strip()
 FS_CONV_COLL = os.getenv("FS_CONV_COLL", "conversations").strip()
 FS_MSG_SUBCOLL = os.getenv("FS_MSG_SUBCOLL", "messages").strip()
 FS_USERS_COLL = os.getenv("FS_USERS_COLL", "crm_users").strip()
+metrics.instrument_firestore()
 fs = firestore.Client()
 
 # Rate limit
-RATE_LIMIT_SEND_PER_CONVO_PER_SEC = float(os.getenv("RATE_LIMIT_SEND_PER_CONVO_PER_SEC", "1"))
+RATE_LIMIT_SEND_PER_CONVO_PER_SEC = float(os.getenv("RATE_LIMIT_SEND_PER_CONVO_PER_SEC", "0"))
+# Repeticao do mesmo client_request_id no envio devolve a resposta guardada
+SEND_IDEMPOTENCY_TTL_SEC = float(os.getenv("SEND_IDEMPOTENCY_TTL_SEC", "600"))
+# Perfil do agente (display_name/use_prefix) no cache compartilhado
+PROFILE_CACHE_TTL_SEC = float(os.getenv("PROFILE_CACHE_TTL_SEC", "60"))
 
 
 def _logger():
@@ -93,19 +78,47 @@ def login_required(fn):
     @wraps(fn)
     def wrapper(*args, **kwargs):
         if not session.get("user"):
-            # Se for chamada AJAX/JSON, devolve 401; senão redireciona pro login
-            if request.accept_mimetypes.accept_json and not request.accept_mimetypes.accept_html:
-                return jsonify({"error": "unauthorized"}), 401
-            return redirect(url_for("auth.login", next=request.path))
+            return _login_redirect()
+        return fn(*args, **kwargs)
+
+    return wrapper
+
+
+def admin_login_required(fn):
+    """``login_required`` das rotas admin: aceita tambem o CRM_ADMIN_TOKEN (``_admin_authorized``)."""
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not _admin_authorized(
+            session.get("user"),
+            request.headers.get("X-Admin-Token"),
+            request.args.get("token"),
+        ):
+            return _login_redirect()
         return fn(*args, **kwargs)
 
     return wrapper
 
 
+def _login_redirect():
+    # Se for chamada AJAX/JSON, devolve 401; senão redireciona pro login
+    if request.accept_mimetypes.accept_json and not request.accept_mimetypes.accept_html:
+        return jsonify({"error": "unauthorized"}), 401
+    return redirect(url_for("auth.login", next=request.path))
+
+
+def _profile_cache_key(username: str) -> str:
+    return f"profile:{username}"
+
+
+def invalidate_agent_profile(username: str):
+    shared_cache.delete(_profile_cache_key(username))
+
+
 def _agent_profile():
     """
     Retorna perfil do agente baseado no usuário logado.
-    Busca display_name e use_prefix do Firestore se existir.
+    Busca display_name e use_prefix do Firestore se existir
+    (guardado no cache compartilhado por PROFILE_CACHE_TTL_SEC).
     """
     username = session.get("user") or ""
     if not username:
@@ -113,14 +126,25 @@ def _agent_profile():
 
     display_name = ""
     use_prefix = False
-    try:
-        user_doc = fs.collection(FS_USERS_COLL).document(username).get()
-        if user_doc.exists:
-            data = user_doc.to_dict()
-            display_name = data.get("display_name", "")
-            use_prefix = data.get("use_prefix", False)
-    except Exception as e:
-        _logger().warning("Erro ao buscar display_name: %s", e)
+    cached = shared_cache.get_json(_profile_cache_key(username)) if PROFILE_CACHE_TTL_SEC > 0 else None
+    if cached is not None:
+        display_name = cached.get("display_name", "")
+        use_prefix = cached.get("use_prefix", False)
+    else:
+        try:
+            user_doc = fs.collection(FS_USERS_COLL).document(username).get()
+            if user_doc.exists:
+                data = user_doc.to_dict()
+                display_name = data.get("display_name", "")
+                use_prefix = data.get("use_prefix", False)
+            if PROFILE_CACHE_TTL_SEC > 0:
+                shared_cache.set_json(
+                    _profile_cache_key(username),
+                    {"display_name": display_name, "use_prefix": use_prefix},
+                    ttl_sec=PROFILE_CACHE_TTL_SEC,
+                )
+        except Exception as e:
+            _logger().warning("Erro ao buscar display_name: %s", e)
 
     if not display_name:
         if username == "admin":
@@ -168,6 +192,11 @@ def _extract_user_name(conv_data: dict) -> str:
     return ""
 
 
+def _tag_query_variants(tag_query: str) -> set[str]:
+    """Grafias de uma tag buscada que casam com ``tags`` gravadas (busca no Firestore e na replica)."""
+    return {tag_query, tag_query.lower(), tag_query.upper(), tag_query.capitalize()}
+
+
 def _iso(ts):
     try:
         return ts.astimezone(timezone.utc).isoformat().replace("+00:00", "Z")
@@ -257,19 +286,76 @@ def messages_ref(conversation_id: str):
     return conv_ref(conversation_id).collection(FS_MSG_SUBCOLL)
 
 
-def _require_auth(allow_session: bool = True, allow_query: bool = True):
+def _serialize_message(doc):
+    dd = doc.to_dict() or {}
+    return {
+        "message_id": doc.id,
+        "direction": dd.get("direction"),
+        "by": dd.get("by"),
+        "display_name": dd.get("display_name"),
+        "text": dd.get("text"),
+        "media_url": dd.get("media_url"),
+        "media_type": dd.get("media_type"),
+        "media": dd.get("media"),
+        "media_urls": dd.get("media_urls"),
+        "mime": dd.get("mime"),
+        "content_type": dd.get("content_type"),
+        "url": dd.get("url"),
+        "media_meta": dd.get("media_meta"),
+        "ts": dd.get("ts"),
+        "client_request_id": dd.get("client_request_id"),
+    }
+
+
+def _message_cursor(item: dict) -> str:
+    return _encode_cursor({"ts": _iso(item["ts"]), "id": item["message_id"]})
+
+
+def _parse_message_anchor(value: str):
     """
-    Autoriza se houver sessão (login).
-    Opcionalmente, aceita token via header X-Admin-Token ou ?token=.
+    Aceita ``<ts_iso>,<message_id>`` ou o ``latest_cursor`` devolvido pela API.
+    Retorna (datetime, message_id) ou None.
     """
-    if allow_session and session.get("user"):
+    if "," in value:
+        ts_str, _, msg_id = value.partition(",")
+    else:
+        obj = _decode_cursor(value) or {}
+        ts_str, msg_id = str(obj.get("ts") or ""), str(obj.get("id") or "")
+    dt = _parse_iso(ts_str.replace(" ", "+"))
+    msg_id = msg_id.strip()
+    if not dt or not msg_id or "/" in msg_id:
         return None
+    return dt, msg_id
 
-    tok = (request.headers.get("X-Admin-Token") or "").strip()
+
+def _admin_authorized(session_user, header_token: str | None, query_token: str | None,
+                      allow_session: bool = True, allow_query: bool = True) -> bool:
+    """
+    Regra unica de acesso admin (rotas Flask e rotas nativas do modo ASGI):
+    sessão com ``user`` ou CRM_ADMIN_TOKEN no header X-Admin-Token / ``?token=``.
+    """
+    if allow_session and session_user:
+        return True
+
+    tok = (header_token or "").strip()
     if allow_query and not tok:
-        tok = (request.args.get("token") or "").strip()
+        tok = (query_token or "").strip()
+
+    return bool(tok and CRM_ADMIN_TOKEN and hmac.compare_digest(tok, CRM_ADMIN_TOKEN))
+
 
-    if tok and CRM_ADMIN_TOKEN and hmac.compare_digest(tok, CRM_ADMIN_TOKEN):
+def _require_auth(allow_session: bool = True, allow_query: bool = True):
+    """
+    Autoriza se houver sessão (login).
+    Opcionalmente, aceita token via header X-Admin-Token ou ?token=.
+    """
+    if _admin_authorized(
+        session.get("user"),
+        request.headers.get("X-Admin-Token"),
+        request.args.get("token"),
+        allow_session,
+        allow_query,
+    ):
         return None
 
     return jsonify(error={"code": "UNAUTHORIZED", "message": "Login requerido"}), 401
@@ -299,16 +385,19 @@ def log_event(action, **kw):
     try:
         payload = {"component": "crm-api", "action": action}
         payload.update({k: v for k, v in kw.items() if v is not None})
+        cost = metrics.request_cost()
+        if cost is not None:
+            payload.update(fs_reads=cost["reads"], fs_writes=cost["writes"], fs_rpcs=cost["rpcs"])
         _logger().info(json.dumps(payload, ensure_ascii=False))
     except Exception:
         pass
 
 
 def _twilio_send_whatsapp(to_e164_plus: str, text: str):
-    url = f"https://api.twilio.com/2010-04-01/Accounts/{TWILIO_ACCOUNT_SID}/Messages.json"
+    url = f"{TWILIO_API_BASE}/2010-04-01/Accounts/{TWILIO_ACCOUNT_SID}/Messages.json"
     data = {"From": TWILIO_FROM, "To": f"whatsapp:{to_e164_plus}", "Body": text}
     try:
-        resp = http_session.post(url, data=data, auth=(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN_REST), timeout=20)
+        resp = twilio_client.post("send_whatsapp", url, data, auth=(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN_REST))
         if 200 <= resp.status_code < 300:
             j = resp.json()
             return True, {"sid": j.get("sid"), "status": j.get("status")}
@@ -320,6 +409,8 @@ def _twilio_send_whatsapp(to_e164_plus: str, text: str):
             code = None
             msg = resp.text[:200]
         return False, {"code": f"TWILIO_{resp.status_code}", "message": msg or "Twilio error"}
+    except TwilioUnavailable as e:
+        return False, {"code": "TWILIO_UNAVAILABLE", "message": str(e)}
     except requests.RequestException as e:
         return False, {"code": "TWILIO_REQ", "message": str(e)}
 
@@ -328,7 +419,7 @@ def _twilio_send_template(to_e164_plus: str, template_sid: str, variables: dict
     """
     Envia template aprovado do WhatsApp via Twilio Content API
     """
-    url = f"https://api.twilio.com/2010-04-01/Accounts/{TWILIO_ACCOUNT_SID}/Messages.json"
+    url = f"{TWILIO_API_BASE}/2010-04-01/Accounts/{TWILIO_ACCOUNT_SID}/Messages.json"
 
     data = {
         "From": TWILIO_FROM,
@@ -343,7 +434,7 @@ def _twilio_send_template(to_e164_plus: str, template_sid: str, variables: dict
         _logger().info(" Enviando template %s SEM variáveis - data: %s", template_sid, data)
 
     try:
-        resp = http_session.post(url, data=data, auth=(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN_REST), timeout=20)
+        resp = twilio_client.post("send_template", url, data, auth=(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN_REST))
         if 200 <= resp.status_code < 300:
             j = resp.json()
             return True, {"sid": j.get("sid"), "status": j.get("status"), "template_sid": template_sid}
@@ -363,6 +454,9 @@ def _twilio_send_template(to_e164_plus: str, template_sid: str, variables: dict
             msg = resp.text[:200]
             _logger().error(" Twilio template error %s: response_text=%s", resp.status_code, msg)
         return False, {"code": f"TWILIO_{resp.status_code}", "message": msg or "Twilio template error"}
+    except TwilioUnavailable as e:
+        _logger().warning(" Twilio indisponivel: %s", e)
+        return False, {"code": "TWILIO_UNAVAILABLE", "message": str(e)}
     except requests.RequestException as e:
         _logger().error(" Twilio request error: %s", e)
         return False, {"code": "TWILIO_REQ", "message": str(e)}
@@ -0,0 +1,209 @@
+"""
+Exportacao de conversas (e opcionalmente das mensagens) em NDJSON ou CSV.
+
+Tudo e gerado sob demanda: as conversas vem de uma consulta paginada por
+``updated_at`` + id do documento (cursor direto na query), as mensagens de cada
+conversa tambem em paginas, e a saida e agrupada em blocos de ~64KB (comprimidos
+com gzip incremental quando pedido). A memoria fica constante qualquer que seja o
+tamanho da exportacao.
+
+Cada linha de conversa traz ``cursor``: passado em ``?cursor=`` ele recomeca a
+exportacao nessa conversa (inclusive), para retomar um download interrompido.
+"""
+import csv
+import io
+import os
+import zlib
+
+from google.cloud import firestore
+from google.cloud.firestore_v1.field_path import FieldPath
+
+from .core import FS_CONV_COLL, _encode_cursor, _extract_user_name, _iso, fs, messages_ref
+
+EXPORT_FORMATS = ("ndjson", "csv")
+EXPORT_PAGE_SIZE = max(1, int(os.getenv("EXPORT_PAGE_SIZE", "200")))
+EXPORT_MESSAGES_PAGE_SIZE = max(1, int(os.getenv("EXPORT_MESSAGES_PAGE_SIZE", "500")))
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+CSV_COLUMNS = [
+    "type",
+    "conversation_id",
+    "status",
+    "assignee",
+    "assignee_name",
+    "user_name",
+    "wa_profile_name",
+    "tags",
+    "created_at",
+    "updated_at",
+    "message_id",
+    "direction",
+    "by",
+    "display_name",
+    "text",
+    "media_url",
+    "media_type",
+    "ts",
+    "cursor",
+]
+
+
+def _page_after(q, order_field: str, after: tuple | None):
+    if after is None:
+        return q
+    dt, doc_id = after
+    return q.start_after({order_field: dt, FieldPath.document_id(): doc_id})
+
+
+def iter_conversations(statuses: list, since=None, until=None, after: tuple | None = None, limit: int = 0):
+    """Snapshots das conversas em ordem crescente de updated_at, a partir de ``after`` (dt, id)."""
+    q = fs.collection(FS_CONV_COLL)
+    if statuses:
+        q = q.where("status", "==", statuses[0]) if len(statuses) == 1 else q.where("status", "in", statuses)
+    if since:
+        q = q.where("updated_at", ">=", since)
+    if until:
+        q = q.where("updated_at", "<", until)
+    q = (
+        q.order_by("updated_at", direction=firestore.Query.ASCENDING)
+        .order_by(FieldPath.document_id(), direction=firestore.Query.ASCENDING)
+    )
+
+    sent = 0
+    while True:
+        page_size = EXPORT_PAGE_SIZE if not limit else min(EXPORT_PAGE_SIZE, limit - sent)
+        if page_size <= 0:
+            return
+        docs = list(_page_after(q, "updated_at", after).limit(page_size).stream())
+        for doc in docs:
+            yield doc
+        sent += len(docs)
+        if len(docs) < page_size:
+            return
+        last = docs[-1]
+        after = ((last.to_dict() or {}).get("updated_at"), last.id)
+
+
+def iter_messages(conversation_id: str):
+    q = (
+        messages_ref(conversation_id)
+        .order_by("ts", direction=firestore.Query.ASCENDING)
+        .order_by(FieldPath.document_id(), direction=firestore.Query.ASCENDING)
+    )
+    after = None
+    while True:
+        docs = list(_page_after(q, "ts", after).limit(EXPORT_MESSAGES_PAGE_SIZE).stream())
+        for doc in docs:
+            yield doc
+        if len(docs) < EXPORT_MESSAGES_PAGE_SIZE:
+            return
+        last = docs[-1]
+        after = ((last.to_dict() or {}).get("ts"), last.id)
+
+
+def encode_export_cursor(updated_at, conversation_id: str) -> str:
+    return _encode_cursor({"updated_at": _iso(updated_at), "id": conversation_id})
+
+
+def export_records(statuses: list, since=None, until=None, after: tuple | None = None,
+                   include_messages: bool = False, limit: int = 0):
+    """Registros ``conversation`` / ``message`` e, no fim, ``end`` com os totais."""
+    conversations = 0
+    messages = 0
+    # Recomeca na conversa atual: cursor = posicao da anterior
+    resume = encode_export_cursor(*after) if after else ""
+    for doc in iter_conversations(statuses, since, until, after, limit):
+        d = doc.to_dict() or {}
+        conversations += 1
+        yield {
+            "type": "conversation",
+            "conversation_id": doc.id,
+            "status": d.get("status"),
+            "assignee": d.get("assignee"),
+            "assignee_name": d.get("assignee_name"),
+            "user_name": _extract_user_name(d) or None,
+            "wa_profile_name": d.get("wa_profile_name"),
+            "tags": d.get("tags") or [],
+            "created_at": d.get("created_at"),
+            "updated_at": d.get("updated_at"),
+            "cursor": resume,
+        }
+        resume = encode_export_cursor(d.get("updated_at"), doc.id)
+        if not include_messages:
+            continue
+        for msg in iter_messages(doc.id):
+            m = msg.to_dict() or {}
+            messages += 1
+            yield {
+                "type": "message",
+                "conversation_id": doc.id,
+                "message_id": msg.id,
+                "direction": m.get("direction"),
+                "by": m.get("by"),
+                "display_name": m.get("display_name"),
+                "text": m.get("text"),
+                "media_url": m.get("media_url"),
+                "media_type": m.get("media_type"),
+                "ts": m.get("ts"),
+            }
+    # Com limit atingido, next_cursor continua a partir da proxima conversa
+    next_cursor = resume if limit and conversations >= limit else None
+    yield {"type": "end", "conversations": conversations, "messages": messages, "next_cursor": next_cursor}
+
+
+def ndjson_lines(records, dumps):
+    for record in records:
+        yield dumps(record) + "\n"
+
+
+def _csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, list):
+        return "|".join(str(v) for v in value)
+    if hasattr(value, "astimezone"):
+        return _iso(value) or ""
+    return value
+
+
+def csv_lines(records):
+    """
+    CSV plano: linha ``conversation`` seguida das linhas ``message`` dela e, no fim,
+    uma linha ``end`` com ``next_cursor`` na coluna ``cursor`` (vazia quando acabou).
+    """
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(CSV_COLUMNS)
+    yield buf.getvalue()
+    for record in records:
+        if record["type"] == "end":
+            record = {"type": "end", "cursor": record.get("next_cursor")}
+        buf.seek(0)
+        buf.truncate()
+        writer.writerow([_csv_value(record.get(col)) for col in CSV_COLUMNS])
+        yield buf.getvalue()
+
+
+def buffered(chunks, size: int = EXPORT_CHUNK_BYTES):
+    """Agrupa as linhas em blocos de bytes (menos writes no socket)."""
+    parts = []
+    pending = 0
+    for chunk in chunks:
+        data = chunk.encode("utf-8")
+        parts.append(data)
+        pending += len(data)
+        if pending >= size:
+            yield b"".join(parts)
+            parts = []
+            pending = 0
+    if parts:
+        yield b"".join(parts)
+
+
+def gzip_chunks(chunks, level: int = 6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        out = compressor.compress(chunk)
+        if out:
+            yield out
+    yield compressor.flush()
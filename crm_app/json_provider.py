@@ -0,0 +1,82 @@
+"""
+JSONProvider do Flask com backend orjson (opcional).
+
+Datetimes (inclusive DatetimeWithNanoseconds do Firestore) saem em ISO 8601 UTC
+com sufixo ``Z``, o mesmo formato de ``_iso()``; as rotas podem devolver o valor
+do Firestore direto. Sem orjson instalado (ou com JSON_BACKEND=stdlib) usa o
+``json`` da stdlib. Nos dois caminhos datetimes passam por ``default()`` (orjson
+com OPT_PASSTHROUGH_DATETIME) e texto sai em UTF-8 sem escapes (``ensure_ascii``
+desligado), entao as respostas saem iguais; so a formatacao de alguns floats
+pode diferir.
+"""
+import os
+from datetime import date, datetime, timezone
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depende do ambiente
+    orjson = None
+
+JSON_BACKEND = (os.getenv("JSON_BACKEND", "auto") or "auto").strip().lower()
+
+if orjson is not None:
+    # Datetimes vao para default(): orjson manteria o fuso original (ex.: -03:00)
+    _ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+
+
+def _datetime_to_iso(value: datetime) -> str:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+class CRMJSONProvider(DefaultJSONProvider):
+    """Serializa respostas com orjson quando disponivel; fallback para a stdlib."""
+
+    # orjson sempre emite UTF-8; a stdlib segue o mesmo formato
+    ensure_ascii = False
+
+    def __init__(self, app, backend: str | None = None):
+        super().__init__(app)
+        backend = backend or JSON_BACKEND
+        self.use_orjson = orjson is not None and backend != "stdlib"
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, datetime):
+            return _datetime_to_iso(o)
+        if isinstance(o, date):
+            return o.isoformat()
+        return DefaultJSONProvider.default(o)
+
+    def _orjson_dumps(self, obj) -> bytes | None:
+        try:
+            return orjson.dumps(obj, default=self.default, option=_ORJSON_OPTIONS)
+        except TypeError:
+            # ex.: inteiros acima de 64 bits; a stdlib resolve
+            return None
+
+    def dumps(self, obj, **kwargs) -> str:
+        if self.use_orjson and not kwargs.get("indent"):
+            out = self._orjson_dumps(obj)
+            if out is not None:
+                return out.decode()
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if self.use_orjson and not kwargs:
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        pretty = (self.compact is None and self._app.debug) or self.compact is False
+        if not self.use_orjson or pretty:
+            return super().response(*args, **kwargs)
+
+        obj = self._prepare_response_obj(args, kwargs)
+        out = self._orjson_dumps(obj)
+        if out is None:
+            return super().response(*args, **kwargs)
+        return self._app.response_class(out + b"\n", mimetype=self.mimetype)
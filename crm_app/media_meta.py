@@ -0,0 +1,251 @@
+"""
+Prefetch de metadados de midia (tamanho, dimensoes, duracao).
+
+As mensagens chegam com a midia em campos variados e sem tamanho; a UI so
+descobria largura/altura baixando o arquivo inteiro. Quando ``list_messages``
+devolve uma mensagem com ``media_url`` (Twilio) e sem ``media_meta``, o
+prefetcher baixa a midia em segundo plano e grava na mensagem:
+
+    media_meta = {size, content_type, width, height, duration_sec, probed_at}
+    (ou {size, too_large: true} / {error} quando nao da para medir)
+
+Os mesmos bytes aquecem o cache de miniaturas (``thumbnails.warm``), entao a
+primeira abertura do chat ja encontra a miniatura pronta.
+
+Limites: MEDIA_PREFETCH_WORKERS downloads simultaneos, fila curta (excedente e
+descartado e tentado na proxima listagem), MEDIA_PREFETCH_MAX_BYTES por arquivo
+(acima disso so o tamanho e gravado) e MEDIA_PREFETCH_BYTES_PER_MIN por processo.
+Dimensoes de imagem usam Pillow; video/audio usam ``ffprobe`` (opcionais).
+"""
+import io
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from . import metrics, thumbnails
+from .core import TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN_REST, _logger, messages_ref
+from .twilio_client import twilio_media_client
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover - depende do ambiente
+    Image = None
+
+MEDIA_PREFETCH_ENABLED = (os.getenv("MEDIA_PREFETCH_ENABLED", "true") or "").strip().lower() in ("1", "true", "yes", "on")
+MEDIA_PREFETCH_WORKERS = int(os.getenv("MEDIA_PREFETCH_WORKERS", "2"))
+MEDIA_PREFETCH_QUEUE_MAX = int(os.getenv("MEDIA_PREFETCH_QUEUE_MAX", "32"))
+MEDIA_PREFETCH_MAX_BYTES = int(os.getenv("MEDIA_PREFETCH_MAX_BYTES", str(8 * 1024 * 1024)))
+MEDIA_PREFETCH_BYTES_PER_MIN = int(os.getenv("MEDIA_PREFETCH_BYTES_PER_MIN", str(64 * 1024 * 1024)))
+# Mensagens ja agendadas neste processo (evita repetir enquanto o documento nao foi atualizado)
+MEDIA_PREFETCH_RECENT_MAX = 4096
+MEDIA_PREFETCH_RECENT_TTL_SEC = 600.0
+
+FFPROBE_BIN = shutil.which("ffprobe")
+
+# Orientacoes EXIF que giram 90 graus (largura e altura trocam na exibicao)
+_EXIF_ORIENTATION = 0x0112
+_EXIF_ROTATED = (5, 6, 7, 8)
+
+_executor = ThreadPoolExecutor(max_workers=MEDIA_PREFETCH_WORKERS, thread_name_prefix="media-prefetch")
+_slots = threading.BoundedSemaphore(MEDIA_PREFETCH_WORKERS + MEDIA_PREFETCH_QUEUE_MAX)
+_recent_lock = threading.Lock()
+_recent: OrderedDict = OrderedDict()  # (conversation_id, message_id) -> monotonic
+
+
+class ByteBudget:
+    """Orcamento de bytes por janela de 60s (por processo)."""
+
+    def __init__(self, per_minute: int):
+        self.per_minute = per_minute
+        self._lock = threading.Lock()
+        self._window_started = time.monotonic()
+        self._used = 0
+
+    def reserve(self, n: int) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            if now - self._window_started >= 60:
+                self._window_started = now
+                self._used = 0
+            if self._used + n > self.per_minute:
+                return False
+            self._used += n
+            return True
+
+    def refund(self, n: int):
+        with self._lock:
+            self._used = max(0, self._used - n)
+
+
+byte_budget = ByteBudget(MEDIA_PREFETCH_BYTES_PER_MIN)
+
+
+def _record(result: str):
+    metrics.inc("crm_media_prefetch_total", {"result": result})
+
+
+def _mark_recent(key: tuple) -> bool:
+    """True se ``key`` nao foi agendada recentemente (e a marca)."""
+    now = time.monotonic()
+    with _recent_lock:
+        seen = _recent.get(key)
+        if seen is not None and now - seen < MEDIA_PREFETCH_RECENT_TTL_SEC:
+            return False
+        _recent[key] = now
+        _recent.move_to_end(key)
+        while len(_recent) > MEDIA_PREFETCH_RECENT_MAX:
+            _recent.popitem(last=False)
+        return True
+
+
+def _forget(key: tuple):
+    with _recent_lock:
+        _recent.pop(key, None)
+
+
+def _image_dimensions(data: bytes) -> dict:
+    if Image is None:
+        return {}
+    with Image.open(io.BytesIO(data)) as img:
+        width, height = img.size
+        if img.getexif().get(_EXIF_ORIENTATION) in _EXIF_ROTATED:
+            width, height = height, width
+    return {"width": width, "height": height}
+
+
+def _probe_av(data: bytes) -> dict:
+    if FFPROBE_BIN is None:
+        return {}
+    with tempfile.NamedTemporaryFile(suffix=".media") as src:
+        src.write(data)
+        src.flush()
+        proc = subprocess.run(
+            [
+                FFPROBE_BIN, "-v", "error", "-print_format", "json",
+                "-show_entries", "format=duration:stream=codec_type,width,height", src.name,
+            ],
+            capture_output=True,
+            timeout=30,
+        )
+    if proc.returncode != 0:
+        return {}
+    info = json.loads(proc.stdout or b"{}")
+    out = {}
+    duration = (info.get("format") or {}).get("duration")
+    if duration:
+        out["duration_sec"] = round(float(duration), 2)
+    for stream in info.get("streams") or ():
+        if stream.get("codec_type") == "video" and stream.get("width"):
+            out["width"] = int(stream["width"])
+            out["height"] = int(stream["height"])
+            break
+    return out
+
+
+def probe(media_url: str, media_type: str) -> tuple[dict | None, bytes | None]:
+    """
+    Baixa (dentro dos limites) e mede a midia. Retorna (media_meta, bytes) ou
+    (None, None) quando deve ser tentado de novo depois (orcamento, 5xx, rede).
+    """
+    resp = twilio_media_client.get(
+        "media",
+        media_url,
+        auth=(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN_REST),
+        stream=True,
+    )
+    try:
+        if resp.status_code >= 500:
+            return None, None
+        if resp.status_code != 200:
+            return {"error": f"status_{resp.status_code}"}, None
+
+        content_type = (resp.headers.get("Content-Type") or media_type or "").split(";")[0].strip()
+        length = int(resp.headers.get("Content-Length") or 0) or None
+        if length and length > MEDIA_PREFETCH_MAX_BYTES:
+            return {"size": length, "content_type": content_type, "too_large": True}, None
+
+        reserved = length or MEDIA_PREFETCH_MAX_BYTES
+        if not byte_budget.reserve(reserved):
+            _record("budget")
+            return None, None
+        buf = io.BytesIO()
+        try:
+            for chunk in resp.iter_content(chunk_size=64 * 1024):
+                buf.write(chunk)
+                if buf.tell() > MEDIA_PREFETCH_MAX_BYTES:
+                    return {"content_type": content_type, "too_large": True}, None
+        finally:
+            byte_budget.refund(max(0, reserved - buf.tell()))
+        metrics.inc("crm_media_prefetch_bytes_total", value=buf.tell())
+    finally:
+        resp.close()
+
+    data = buf.getvalue()
+    meta = {"size": len(data), "content_type": content_type}
+    kind = content_type.split("/")[0]
+    try:
+        if kind == "image":
+            meta.update(_image_dimensions(data))
+        elif kind in ("video", "audio"):
+            meta.update(_probe_av(data))
+    except Exception as e:
+        _logger().info("Midia sem dimensoes (%s): %s", media_url, e)
+    return meta, data
+
+
+def _prefetch(conversation_id: str, message_id: str, media_url: str, media_type: str):
+    key = (conversation_id, message_id)
+    try:
+        meta, data = probe(media_url, media_type)
+        if meta is None:
+            _forget(key)
+            return
+        if data is not None:
+            thumbnails.warm(conversation_id, message_id, meta.get("content_type") or media_type, data)
+        meta["probed_at"] = datetime.now(timezone.utc)
+        messages_ref(conversation_id).document(message_id).update({"media_meta": meta})
+        _record("too_large" if meta.get("too_large") else "error" if meta.get("error") else "recorded")
+    except Exception as e:
+        _forget(key)
+        _record("failed")
+        _logger().warning("Falha no prefetch de midia %s/%s: %s", conversation_id, message_id, e)
+    finally:
+        _slots.release()
+
+
+def _needs_probe(item: dict) -> bool:
+    return bool(item.get("media_url")) and not item.get("media_meta")
+
+
+def pending(items: list[dict]) -> bool:
+    """
+    True se o prefetch ainda vai gravar ``media_meta`` em alguma mensagem de ``items``.
+    A gravacao nao muda os validadores do ETag da pagina, entao ela sai sem ETag.
+    """
+    return MEDIA_PREFETCH_ENABLED and any(_needs_probe(item) for item in items)
+
+
+def schedule(conversation_id: str, items: list[dict]):
+    """Agenda o prefetch das mensagens de ``items`` com midia do Twilio e sem ``media_meta``."""
+    if not MEDIA_PREFETCH_ENABLED:
+        return
+    for item in items:
+        if not _needs_probe(item):
+            continue
+        key = (conversation_id, item["message_id"])
+        if not _mark_recent(key):
+            continue
+        if not _slots.acquire(blocking=False):
+            _forget(key)
+            _record("busy")
+            return
+        _executor.submit(
+            _prefetch, conversation_id, item["message_id"], item["media_url"], item.get("media_type") or ""
+        )
@@ -0,0 +1,105 @@
+"""
+Formato compacto das mensagens (``list_messages?format=v2``).
+
+v1 (padrao) devolve os 15 campos de ``_serialize_message``, quase todos nulos, e
+a midia espalhada em ``media``/``media_urls``/``media_url``/``mime``/``url``.
+v2:
+- omite campos nulos;
+- ``ts`` em epoch ms (inteiro);
+- midia em uma lista ``attachments`` ja normalizada no servidor
+  ``[{url, content_type, size, width, height, duration_sec}]``; ``url`` ja e a URL
+  segura (link direto do GCS ou o proxy ``/api/admin/media/...`` para o Twilio),
+  mesma regra de ``getSafeMediaUrl`` no front;
+- ``layout=columns``: ``{"columns": {campo: [valores...]}, "count": n}`` em vez de
+  ``items`` (nomes de campo uma vez so; util em paginas longas).
+Cursores (``next_cursor``/``latest_cursor``/``has_more``) nao mudam.
+"""
+import re
+from urllib.parse import quote
+
+from .core import _coerce_ts_to_dt
+
+MESSAGE_FORMATS = ("v1", "v2")
+MESSAGE_LAYOUTS = ("items", "columns")
+
+_TWILIO_API_RE = re.compile(r"api\.twilio\.com/2010-04-01/")
+_META_FIELDS = ("size", "width", "height", "duration_sec")
+_SCALAR_FIELDS = ("message_id", "direction", "by", "display_name", "text", "client_request_id")
+# Mesmo conjunto de caracteres preservados por encodeURIComponent
+_URI_COMPONENT_SAFE = "-_.!~*'()"
+
+
+def _proxy_url(conversation_id: str, message_id: str) -> str:
+    return (
+        f"/api/admin/media/{quote(conversation_id, safe=_URI_COMPONENT_SAFE)}"
+        f"/{quote(message_id, safe=_URI_COMPONENT_SAFE)}"
+    )
+
+
+def _safe_url(conversation_id: str, message_id: str, direct: str) -> str:
+    if direct and not _TWILIO_API_RE.search(direct):
+        return direct
+    if conversation_id and message_id:
+        return _proxy_url(conversation_id, message_id)
+    return direct
+
+
+def attachments(conversation_id: str, item: dict) -> list[dict]:
+    """Midias da mensagem (v1) normalizadas, na mesma ordem de ``normalizeAttachments`` no front."""
+    raw = []
+    for entry in item.get("media") or ():
+        if isinstance(entry, dict):
+            direct = entry.get("gcs_url") or entry.get("signed_url") or entry.get("url") or ""
+            raw.append((direct, entry.get("content_type") or entry.get("mime"), None))
+    for url in item.get("media_urls") or ():
+        raw.append((url, None, None))
+    if item.get("media_url"):
+        raw.append((item["media_url"], item.get("media_type") or item.get("mime"), item.get("media_meta")))
+    if item.get("url") and (item.get("mime") or item.get("content_type")):
+        raw.append((item["url"], item.get("mime") or item.get("content_type"), None))
+
+    out = []
+    message_id = item.get("message_id") or ""
+    for direct, content_type, meta in raw:
+        url = _safe_url(conversation_id, message_id, direct or "")
+        if not url:
+            continue
+        att = {"url": url}
+        if content_type:
+            att["content_type"] = content_type
+        for field in _META_FIELDS:
+            if meta and meta.get(field) is not None:
+                att[field] = meta[field]
+        out.append(att)
+    return out
+
+
+def compact_message(conversation_id: str, item: dict) -> dict:
+    out = {k: item[k] for k in _SCALAR_FIELDS if item.get(k) is not None}
+    dt = _coerce_ts_to_dt(item.get("ts"))
+    if dt is not None:
+        out["ts"] = int(dt.timestamp() * 1000)
+    atts = attachments(conversation_id, item)
+    if atts:
+        out["attachments"] = atts
+    return out
+
+
+def to_columns(items: list[dict]) -> dict:
+    fields = list(dict.fromkeys(k for item in items for k in item))
+    return {field: [item.get(field) for item in items] for field in fields}
+
+
+def render(conversation_id: str, payload: dict, fmt: str, layout: str = "items") -> dict:
+    """Converte a resposta v1 de ``list_messages`` (``items`` + cursores) para ``fmt``."""
+    if fmt != "v2":
+        return payload
+    items = [compact_message(conversation_id, item) for item in payload.get("items") or ()]
+    out = {k: v for k, v in payload.items() if k != "items"}
+    out["format"] = "v2"
+    if layout == "columns":
+        out["columns"] = to_columns(items)
+        out["count"] = len(items)
+    else:
+        out["items"] = items
+    return out
@@ -0,0 +1,565 @@
+"""
+Metricas no formato texto do Prometheus.
+
+Cada thread escreve no proprio shard (sem lock no caminho quente); o scrape
+soma os shards. Com varios workers do Gunicorn, defina METRICS_MULTIPROC_DIR
+para que cada processo publique um snapshot em disco e o /metrics agregue todos.
+"""
+import functools
+import json
+import logging
+import os
+import threading
+import time
+
+from flask import g, has_app_context
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+DOC_COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+METRICS_MULTIPROC_DIR = (os.getenv("METRICS_MULTIPROC_DIR", "") or "").strip()
+METRICS_FLUSH_INTERVAL_SEC = float(os.getenv("METRICS_FLUSH_INTERVAL_SEC", "5"))
+
+# Orcamento de leituras do Firestore por requisicao (0 = desligado).
+FIRESTORE_READ_BUDGET = int(os.getenv("FIRESTORE_READ_BUDGET", "200"))
+
+# name -> (type, help, buckets)
+_DESCRIPTIONS: dict[str, tuple[str, str, tuple | None]] = {}
+
+_shards: list["_Shard"] = []
+_shards_lock = threading.Lock()
+_local = threading.local()
+
+_last_flush = 0.0
+
+
+class _Shard:
+    __slots__ = ("counters", "histograms")
+
+    def __init__(self):
+        self.counters: dict[tuple, float] = {}
+        # (name, labels) -> [bucket_0, ..., bucket_n, +Inf, sum]
+        self.histograms: dict[tuple, list] = {}
+
+
+def _shard() -> _Shard:
+    shard = getattr(_local, "shard", None)
+    if shard is None:
+        shard = _Shard()
+        with _shards_lock:
+            _shards.append(shard)
+        _local.shard = shard
+    return shard
+
+
+def describe(name: str, kind: str, help_text: str, buckets: tuple | None = None):
+    _DESCRIPTIONS[name] = (kind, help_text, buckets if kind == "histogram" else None)
+
+
+def _labels_key(labels: dict | None) -> tuple:
+    if not labels:
+        return ()
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name: str, labels: dict | None = None, value: float = 1):
+    counters = _shard().counters
+    key = (name, _labels_key(labels))
+    counters[key] = counters.get(key, 0) + value
+
+
+def observe(name: str, value: float, labels: dict | None = None):
+    buckets = (_DESCRIPTIONS.get(name) or (None, None, None))[2] or LATENCY_BUCKETS
+    histograms = _shard().histograms
+    key = (name, _labels_key(labels))
+    row = histograms.get(key)
+    if row is None:
+        row = [0] * (len(buckets) + 2)
+        histograms[key] = row
+    for i, bound in enumerate(buckets):
+        if value <= bound:
+            row[i] += 1
+            break
+    else:
+        row[len(buckets)] += 1
+    row[-1] += value
+
+
+def snapshot() -> dict:
+    """Soma os shards deste processo (contadores e histogramas nao cumulativos)."""
+    counters: dict[tuple, float] = {}
+    histograms: dict[tuple, list] = {}
+    with _shards_lock:
+        shards = list(_shards)
+    for shard in shards:
+        for key, value in shard.counters.copy().items():
+            counters[key] = counters.get(key, 0) + value
+        for key, row in shard.histograms.copy().items():
+            row = list(row)
+            acc = histograms.get(key)
+            if acc is None or len(acc) != len(row):
+                histograms[key] = row
+            else:
+                histograms[key] = [a + b for a, b in zip(acc, row)]
+    return {"counters": counters, "histograms": histograms}
+
+
+def _snapshot_to_json(snap: dict) -> dict:
+    return {
+        "counters": [[name, list(map(list, labels)), value] for (name, labels), value in snap["counters"].items()],
+        "histograms": [[name, list(map(list, labels)), row] for (name, labels), row in snap["histograms"].items()],
+    }
+
+
+def _merge_json_snapshot(target: dict, raw: dict):
+    for name, labels, value in raw.get("counters") or []:
+        key = (name, tuple(tuple(item) for item in labels))
+        target["counters"][key] = target["counters"].get(key, 0) + value
+    for name, labels, row in raw.get("histograms") or []:
+        key = (name, tuple(tuple(item) for item in labels))
+        acc = target["histograms"].get(key)
+        if acc is None or len(acc) != len(row):
+            target["histograms"][key] = list(row)
+        else:
+            target["histograms"][key] = [a + b for a, b in zip(acc, row)]
+
+
+def _own_snapshot_path() -> str:
+    return os.path.join(METRICS_MULTIPROC_DIR, f"metrics-{os.getpid()}.json")
+
+
+def flush(force: bool = False):
+    """Publica o snapshot deste processo em METRICS_MULTIPROC_DIR (se configurado)."""
+    global _last_flush
+    if not METRICS_MULTIPROC_DIR:
+        return
+    now = time.monotonic()
+    if not force and now - _last_flush < METRICS_FLUSH_INTERVAL_SEC:
+        return
+    _last_flush = now
+    try:
+        os.makedirs(METRICS_MULTIPROC_DIR, exist_ok=True)
+        path = _own_snapshot_path()
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(_snapshot_to_json(snapshot()), f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logging.getLogger("crm-api").warning("Falha ao publicar metricas: %s", e)
+
+
+def collect() -> dict:
+    """Snapshot agregado: este processo + demais workers (modo multiprocesso)."""
+    if not METRICS_MULTIPROC_DIR:
+        return snapshot()
+
+    flush(force=True)
+    merged = {"counters": {}, "histograms": {}}
+    try:
+        names = sorted(os.listdir(METRICS_MULTIPROC_DIR))
+    except OSError:
+        names = []
+    for fname in names:
+        if not (fname.startswith("metrics-") and fname.endswith(".json")):
+            continue
+        try:
+            with open(os.path.join(METRICS_MULTIPROC_DIR, fname), "r", encoding="utf-8") as f:
+                _merge_json_snapshot(merged, json.load(f))
+        except Exception:
+            continue
+    return merged
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape_label(v)}"' for k, v in items) + "}"
+
+
+def _format_value(value: float) -> str:
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def render(snap: dict | None = None) -> str:
+    snap = snap if snap is not None else collect()
+    by_name: dict[str, list] = {}
+    for (name, labels), value in snap["counters"].items():
+        by_name.setdefault(name, []).append(("counter", labels, value))
+    for (name, labels), row in snap["histograms"].items():
+        by_name.setdefault(name, []).append(("histogram", labels, row))
+
+    lines = []
+    for name in sorted(by_name):
+        kind, help_text, buckets = _DESCRIPTIONS.get(name, (by_name[name][0][0], "", None))
+        buckets = buckets or LATENCY_BUCKETS
+        if help_text:
+            lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for series_kind, labels, value in sorted(by_name[name], key=lambda item: item[1]):
+            if series_kind == "counter":
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets, value):
+                cumulative += count
+                le = (("le", _format_value(bound)),)
+                lines.append(f"{name}_bucket{_format_labels(labels, le)} {cumulative}")
+            cumulative += value[len(buckets)]
+            lines.append(f"{name}_bucket{_format_labels(labels, (('le', '+Inf'),))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(value[-1])}")
+            lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+describe("crm_http_requests_total", "counter", "Requisicoes HTTP por endpoint, metodo e status.")
+describe(
+    "crm_http_request_duration_seconds",
+    "histogram",
+    "Latencia das requisicoes HTTP por endpoint do blueprint.",
+    LATENCY_BUCKETS,
+)
+describe("crm_firestore_calls_total", "counter", "Chamadas ao Firestore por operacao e colecao.")
+describe(
+    "crm_firestore_call_duration_seconds",
+    "histogram",
+    "Latencia das chamadas ao Firestore por operacao e colecao.",
+    LATENCY_BUCKETS,
+)
+describe("crm_firestore_documents_total", "counter", "Documentos lidos/escritos no Firestore.")
+describe("crm_twilio_requests_total", "counter", "Chamadas a API do Twilio por operacao e status HTTP.")
+describe(
+    "crm_twilio_client_outcomes_total",
+    "counter",
+    "Resultado final das chamadas ao Twilio (ok, client_error, rate_limited, server_error, network_error, circuit_open, throttled) e retries.",
+)
+describe("crm_twilio_circuit_transitions_total", "counter", "Mudancas de estado dos circuit breakers do Twilio (envio e midia).")
+describe(
+    "crm_twilio_request_duration_seconds",
+    "histogram",
+    "Latencia das chamadas a API do Twilio.",
+    LATENCY_BUCKETS,
+)
+describe("crm_media_proxy_bytes_total", "counter", "Bytes de midia repassados pelo proxy.")
+describe(
+    "crm_media_thumbnails_total",
+    "counter",
+    "Miniaturas de midia geradas (generated, prefetched) ou recusadas (busy, timeout, error), por tipo.",
+)
+describe(
+    "crm_media_prefetch_total",
+    "counter",
+    "Prefetch de metadados de midia (recorded, too_large, error, busy, budget, failed).",
+)
+describe("crm_media_prefetch_bytes_total", "counter", "Bytes baixados pelo prefetch de metadados de midia.")
+describe(
+    "crm_conditional_requests_total",
+    "counter",
+    "GETs com If-None-Match por rota: not_modified (304) ou modified (corpo completo).",
+)
+describe(
+    "crm_firestore_reads_per_request",
+    "histogram",
+    "Documentos lidos no Firestore por requisicao HTTP.",
+    DOC_COUNT_BUCKETS,
+)
+describe(
+    "crm_firestore_read_budget_exceeded_total",
+    "counter",
+    "Requisicoes que passaram do orcamento de leituras do Firestore.",
+)
+describe("crm_cache_requests_total", "counter", "Consultas ao micro-cache por resultado (hit, shared, miss).")
+describe("crm_cache_invalidations_total", "counter", "Invalidacoes do micro-cache por escrita local.")
+describe("crm_cache_remote_invalidations_total", "counter", "Micro-caches limpos por invalidacao vinda de outro processo.")
+describe("crm_shared_cache_errors_total", "counter", "Falhas de comunicacao com o cache compartilhado (Redis) por comando.")
+describe("crm_rate_limited_total", "counter", "Requisicoes recusadas pelo rate limit compartilhado.")
+describe("crm_idempotent_replays_total", "counter", "Respostas repetidas por client_request_id ja processado.")
+describe("crm_message_index_write_errors_total", "counter", "Documentos do indice de mensagens que falharam ao gravar no sync.")
+describe("crm_bulk_chunk_retries_total", "counter", "Lotes de acao em massa refeitos item a item apos conflito.")
+describe("crm_replica_requests_total", "counter", "Consultas respondidas pela replica em memoria (hit) ou pelo Firestore (fallback).")
+describe("crm_replica_events_total", "counter", "Mudancas de conversas recebidas pelo listener da replica.")
+
+
+def _parse_budget_overrides(raw: str) -> dict[str, int]:
+    out = {}
+    for item in (raw or "").split(","):
+        endpoint, sep, value = item.partition("=")
+        if not sep:
+            continue
+        try:
+            out[endpoint.strip()] = int(value.strip())
+        except ValueError:
+            continue
+    return out
+
+
+# Ex: "admin.search_conversations=300,admin.reopen_outdated_conversations=0"
+FIRESTORE_READ_BUDGET_OVERRIDES = _parse_budget_overrides(os.getenv("FIRESTORE_READ_BUDGET_OVERRIDES", ""))
+
+
+# ================== Custo por requisicao ==================
+
+def request_cost() -> dict | None:
+    """Contadores de Firestore da requisicao atual (reads, writes, rpcs, ms)."""
+    if not has_app_context():
+        return getattr(_local, "bound_cost", None)
+    cost = g.get("_fs_cost")
+    if cost is None:
+        cost = {"reads": 0, "writes": 0, "rpcs": 0, "ms": 0.0}
+        g._fs_cost = cost
+    return cost
+
+
+def bind_request_cost(fn):
+    """
+    Envolve ``fn`` para rodar em outra thread (ex.: ThreadPoolExecutor) somando o
+    custo de Firestore na requisicao que o criou.
+    """
+    cost = request_cost()
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        previous = getattr(_local, "bound_cost", None)
+        _local.bound_cost = cost
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _local.bound_cost = previous
+
+    return wrapper
+
+
+def _read_budget_for(endpoint: str) -> int:
+    return FIRESTORE_READ_BUDGET_OVERRIDES.get(endpoint, FIRESTORE_READ_BUDGET)
+
+
+def _server_timing(cost: dict, total_ms: float) -> str:
+    return (
+        f'fs;dur={cost["ms"]:.1f};desc="reads={cost["reads"]} writes={cost["writes"]} rpcs={cost["rpcs"]}", '
+        f"app;dur={total_ms:.1f}"
+    )
+
+
+# ================== Flask ==================
+
+def init_app(app):
+    from flask import request
+
+    @app.before_request
+    def _metrics_start_timer():
+        g._metrics_started_at = time.perf_counter()
+
+    @app.after_request
+    def _metrics_observe_request(resp):
+        started = g.pop("_metrics_started_at", None)
+        if started is None:
+            return resp
+        try:
+            elapsed = time.perf_counter() - started
+            endpoint = request.endpoint or "unmatched"
+            labels = {
+                "endpoint": endpoint,
+                "method": request.method,
+                "status": resp.status_code,
+            }
+            inc("crm_http_requests_total", labels)
+            observe(
+                "crm_http_request_duration_seconds",
+                elapsed,
+                {"endpoint": endpoint, "method": labels["method"]},
+            )
+
+            cost = request_cost()
+            observe("crm_firestore_reads_per_request", cost["reads"], {"endpoint": endpoint})
+            resp.headers["Server-Timing"] = _server_timing(cost, elapsed * 1000)
+
+            budget = _read_budget_for(endpoint)
+            if budget and cost["reads"] > budget:
+                inc("crm_firestore_read_budget_exceeded_total", {"endpoint": endpoint})
+                logging.getLogger("crm-api").warning(
+                    "Orcamento de leituras excedido: endpoint=%s reads=%s budget=%s writes=%s rpcs=%s",
+                    endpoint,
+                    cost["reads"],
+                    budget,
+                    cost["writes"],
+                    cost["rpcs"],
+                )
+            flush()
+        except Exception:
+            pass
+        return resp
+
+
+# ================== Twilio / midia ==================
+
+def observe_twilio(op: str, started: float, status):
+    labels = {"op": op, "status": status}
+    inc("crm_twilio_requests_total", labels)
+    observe("crm_twilio_request_duration_seconds", time.perf_counter() - started, labels)
+
+
+def count_media_bytes(chunks):
+    """Repassa os chunks do proxy de midia contando os bytes enviados."""
+    total = 0
+    try:
+        for chunk in chunks:
+            total += len(chunk)
+            yield chunk
+    finally:
+        inc("crm_media_proxy_bytes_total", value=total)
+
+
+# ================== Firestore ==================
+
+_firestore_instrumented = False
+
+
+def _observe_firestore(op: str, collection: str, started: float, reads: int = 0, writes: int = 0):
+    elapsed = time.perf_counter() - started
+    labels = {"op": op, "collection": collection or "?"}
+    inc("crm_firestore_calls_total", labels)
+    observe("crm_firestore_call_duration_seconds", elapsed, labels)
+    cost = request_cost()
+    if cost is not None:
+        cost["rpcs"] += 1
+        cost["reads"] += reads
+        cost["writes"] += writes
+        cost["ms"] += elapsed * 1000
+    if reads:
+        inc("crm_firestore_documents_total", {"kind": "read", "collection": labels["collection"]}, reads)
+    if writes:
+        inc("crm_firestore_documents_total", {"kind": "write", "collection": labels["collection"]}, writes)
+
+
+def _doc_collection(doc_ref) -> str:
+    try:
+        return doc_ref._path[-2]
+    except Exception:
+        return "?"
+
+
+def _query_collection(query) -> str:
+    try:
+        return query._parent.id
+    except Exception:
+        return "?"
+
+
+def _wrap_doc_op(method, op: str, reads: int = 0, writes: int = 0):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            _observe_firestore(op, _doc_collection(self), started, reads=reads, writes=writes)
+
+    return wrapper
+
+
+def _wrap_query_stream(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        started = time.perf_counter()
+        collection = _query_collection(self)
+
+        def gen():
+            count = 0
+            try:
+                for snap in method(self, *args, **kwargs):
+                    count += 1
+                    yield snap
+            finally:
+                # Consulta vazia ainda cobra uma leitura.
+                _observe_firestore("stream", collection, started, reads=max(count, 1))
+
+        return gen()
+
+    return wrapper
+
+
+def _wrap_get_all(method):
+    @functools.wraps(method)
+    def wrapper(self, references, *args, **kwargs):
+        started = time.perf_counter()
+        references = list(references)
+        collection = _doc_collection(references[0]) if references else "?"
+
+        def gen():
+            count = 0
+            try:
+                for snap in method(self, references, *args, **kwargs):
+                    count += 1
+                    yield snap
+            finally:
+                _observe_firestore("get_all", collection, started, reads=count)
+
+        return gen()
+
+    return wrapper
+
+
+def _wrap_aggregation_get(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        started = time.perf_counter()
+        reads = 1
+        try:
+            results = method(self, *args, **kwargs)
+            total = sum(r.value or 0 for row in results for r in row)
+            # count() cobra 1 leitura a cada 1000 entradas de indice (minimo 1)
+            reads = max(1, -(-int(total) // 1000))
+            return results
+        finally:
+            _observe_firestore("aggregate", _query_collection(getattr(self, "_nested_query", None)), started, reads=reads)
+
+    return wrapper
+
+
+def _wrap_batch_commit(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        started = time.perf_counter()
+        writes = len(getattr(self, "_write_pbs", None) or [])
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            _observe_firestore("commit", "batch", started, writes=writes)
+
+    return wrapper
+
+
+def instrument_firestore_classes(document_cls, query_cls, client_cls, batch_cls, aggregation_cls=None):
+    """Envolve get/set/update/stream/get_all/commit/count das classes informadas com metricas."""
+    document_cls.get = _wrap_doc_op(document_cls.get, "get", reads=1)
+    document_cls.set = _wrap_doc_op(document_cls.set, "set", writes=1)
+    document_cls.update = _wrap_doc_op(document_cls.update, "update", writes=1)
+    document_cls.create = _wrap_doc_op(document_cls.create, "create", writes=1)
+    document_cls.delete = _wrap_doc_op(document_cls.delete, "delete", writes=1)
+    query_cls.stream = _wrap_query_stream(query_cls.stream)
+    client_cls.get_all = _wrap_get_all(client_cls.get_all)
+    batch_cls.commit = _wrap_batch_commit(batch_cls.commit)
+    if aggregation_cls is not None:
+        aggregation_cls.get = _wrap_aggregation_get(aggregation_cls.get)
+
+
+def instrument_firestore():
+    """Instrumenta o cliente sincrono do Firestore (idempotente)."""
+    global _firestore_instrumented
+    if _firestore_instrumented:
+        return
+    _firestore_instrumented = True
+
+    from google.cloud.firestore_v1.aggregation import AggregationQuery
+    from google.cloud.firestore_v1.batch import WriteBatch
+    from google.cloud.firestore_v1.client import Client
+    from google.cloud.firestore_v1.document import DocumentReference
+    from google.cloud.firestore_v1.query import Query
+
+    instrument_firestore_classes(DocumentReference, Query, Client, WriteBatch, AggregationQuery)
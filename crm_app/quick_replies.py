@@ -0,0 +1,168 @@
+"""
+Respostas rapidas por usuario (``crm_users.quick_replies``) com cache e indice de atalhos.
+
+A lista fica no cache compartilhado (``quick_replies:<usuario>``) por
+QUICK_REPLIES_CACHE_TTL_SEC; gravacoes leem o documento do Firestore (fonte da
+verdade), gravam e atualizam o cache. O ETag e o hash do conteudo, entao o
+``GET`` responde ``304`` sem tocar no Firestore quando o cache esta quente.
+
+Cada versao da lista vira um ``QuickReplySet`` (montado uma vez por processo):
+mapa de atalho exato (unicidade e expansao no envio) e uma trie de prefixos em
+minusculas para o autocomplete (``/api/user/quick-replies/suggest``).
+
+A expansao no envio (``expand_fresh``) le sempre o Firestore: o front ja expande
+os atalhos que conhece, entao o servidor so ve os que a lista local nao tinha
+(criados em outra aba/worker), justamente os que o cache pode nao ter ainda.
+"""
+import json
+import os
+
+from google.cloud import firestore
+
+from .cache import MicroCache, shared_cache
+from .conditional import make_etag
+from .core import FS_USERS_COLL, _logger, fs
+
+QUICK_REPLIES_CACHE_TTL_SEC = float(os.getenv("QUICK_REPLIES_CACHE_TTL_SEC", "60"))
+QUICK_REPLIES_SUGGEST_MAX = 20
+
+# Indices montados por (usuario, etag); a versao nao muda, o limite real e o numero de entradas
+_index_cache = MicroCache("quick_replies_index", 3600.0, max_entries=512)
+
+
+class ShortcutTrie:
+    """Trie de atalhos (chaves em minusculas) -> ids das respostas, em ordem de insercao."""
+
+    __slots__ = ("_root",)
+
+    def __init__(self):
+        self._root = {}
+
+    def insert(self, shortcut: str, reply_id: str):
+        node = self._root
+        for ch in shortcut.casefold():
+            node = node.setdefault(ch, {})
+        node.setdefault("", []).append(reply_id)
+
+    def find(self, prefix: str, limit: int) -> list[str]:
+        """Ids dos atalhos que comecam com ``prefix``, em ordem alfabetica do atalho."""
+        node = self._root
+        for ch in prefix.casefold():
+            node = node.get(ch)
+            if node is None:
+                return []
+        out: list[str] = []
+        stack = [node]
+        while stack and len(out) < limit:
+            node = stack.pop()
+            out.extend(node.get("", ()))
+            # Filhos em ordem reversa na pilha => visita em ordem alfabetica
+            stack.extend(node[ch] for ch in sorted((k for k in node if k), reverse=True))
+        return out[:limit]
+
+
+class QuickReplySet:
+    """Uma versao imutavel da lista de respostas rapidas de um usuario."""
+
+    __slots__ = ("items", "etag", "by_id", "by_shortcut", "trie")
+
+    def __init__(self, items: list[dict], etag: str):
+        self.items = items
+        self.etag = etag
+        self.by_id = {}
+        self.by_shortcut = {}
+        self.trie = ShortcutTrie()
+        for reply in items:
+            reply_id = reply.get("id")
+            if reply_id:
+                self.by_id[reply_id] = reply
+            shortcut = (reply.get("shortcut") or "").strip()
+            if shortcut and shortcut not in self.by_shortcut:
+                self.by_shortcut[shortcut] = reply
+                self.trie.insert(shortcut, reply_id)
+
+    def shortcut_taken(self, shortcut: str, exclude_id: str | None = None) -> bool:
+        reply = self.by_shortcut.get(shortcut)
+        return reply is not None and reply.get("id") != exclude_id
+
+    def suggest(self, prefix: str, limit: int = 10) -> list[dict]:
+        return [self.by_id[i] for i in self.trie.find(prefix, limit) if i in self.by_id]
+
+    def expand(self, text: str) -> dict | None:
+        """Resposta cujo atalho e exatamente ``text`` (mesma regra do front), ou None."""
+        return self.by_shortcut.get(text.strip())
+
+
+def _cache_key(username: str) -> str:
+    return f"quick_replies:{username}"
+
+
+def _etag(items: list[dict]) -> str:
+    return make_etag("quick_replies", json.dumps(items, sort_keys=True, ensure_ascii=False))
+
+
+def _index(username: str, items: list[dict]) -> QuickReplySet:
+    etag = _etag(items)
+    return _index_cache.get_or_compute((username, etag), lambda: QuickReplySet(items, etag))
+
+
+def _read(username: str) -> list[dict]:
+    snap = fs.collection(FS_USERS_COLL).document(username).get()
+    if not snap.exists:
+        return []
+    replies = (snap.to_dict() or {}).get("quick_replies")
+    return replies if isinstance(replies, list) else []
+
+
+def _refresh(username: str) -> list[dict]:
+    """Le a lista do Firestore (erros propagam) e atualiza o cache."""
+    items = _read(username)
+    if QUICK_REPLIES_CACHE_TTL_SEC > 0:
+        shared_cache.set_json(_cache_key(username), items, ttl_sec=QUICK_REPLIES_CACHE_TTL_SEC)
+    return items
+
+
+def load(username: str, fresh: bool = False) -> QuickReplySet:
+    """
+    Respostas rapidas de ``username``. ``fresh=True`` ignora o cache (use antes de
+    gravar, para nao sobrescrever alteracoes feitas em outro worker).
+    """
+    if not username:
+        return _index("", [])
+    if not fresh and QUICK_REPLIES_CACHE_TTL_SEC > 0:
+        cached = shared_cache.get_json(_cache_key(username))
+        if isinstance(cached, list):
+            return _index(username, cached)
+    try:
+        items = _refresh(username)
+    except Exception as e:
+        _logger().warning("Erro ao carregar quick replies: %s", e)
+        return _index(username, [])
+    return _index(username, items)
+
+
+def looks_like_shortcut(text: str) -> bool:
+    """Mesmo formato aceito no cadastro: comeca com ``/``, sem espacos, max 40."""
+    text = text.strip()
+    return text.startswith("/") and len(text) <= 40 and not any(ch.isspace() for ch in text)
+
+
+def expand_fresh(username: str, text: str) -> dict | None:
+    """
+    Resposta cujo atalho e exatamente ``text``, lida do Firestore. Textos fora do
+    formato de atalho nao custam leitura; erro de leitura propaga (o chamador nao
+    deve enviar o atalho literal).
+    """
+    if not username or not looks_like_shortcut(text):
+        return None
+    return _index(username, _refresh(username)).expand(text)
+
+
+def save(username: str, replies: list) -> QuickReplySet:
+    fs.collection(FS_USERS_COLL).document(username).set({
+        "quick_replies": replies,
+        "updated_at": firestore.SERVER_TIMESTAMP,
+    }, merge=True)
+    if QUICK_REPLIES_CACHE_TTL_SEC > 0:
+        shared_cache.set_json(_cache_key(username), replies, ttl_sec=QUICK_REPLIES_CACHE_TTL_SEC)
+    return _index(username, replies)
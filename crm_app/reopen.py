@@ -0,0 +1,386 @@
+"""
+Reabertura em lote de conversas fora da janela de 24h.
+
+A pre-visualizacao grava um snapshot de elegibilidade em FS_REOPEN_PREVIEWS_COLL:
+um documento com escopo, contagens e validade (``expires_at``) e a subcolecao
+``chunks`` com os itens elegiveis (id, status, template escolhido) em blocos de
+REOPEN_PREVIEW_CHUNK_SIZE. A execucao com ``preview_id`` nao varre o escopo de
+novo: reserva o snapshot (uma unica execucao por preview), rele so as conversas
+selecionadas via ``get_all`` e revalida cada uma antes de enviar o template, de
+modo que o conjunto executado e o que o admin viu (menos o que mudou no meio).
+
+O mesmo snapshot serve a revisao paginada: as contagens sao calculadas uma vez,
+na pre-visualizacao, e cada pagina le so os blocos que cobre. O cursor e a
+posicao (bloco, deslocamento) dentro do snapshot.
+
+Documento e blocos levam o mesmo ``expires_at``; a TTL do Firestore nao apaga
+subcolecoes em cascata, entao a politica precisa existir nos dois grupos
+(``reopen_previews`` e ``chunks``).
+"""
+import os
+import uuid
+from datetime import datetime, timedelta
+
+from google.api_core import exceptions as gexc
+from google.cloud import firestore
+
+from .cache import MicroCache
+from .core import (
+    FS_CONV_COLL,
+    REOPEN_TEMPLATE_SID_BOT,
+    REOPEN_TEMPLATE_SID_DEFAULT,
+    REOPEN_TEMPLATE_SID_PENDING_HANDOFF,
+    _coerce_ts_to_dt,
+    _conversation_created_date,
+    _decode_cursor,
+    _encode_cursor,
+    _extract_user_name,
+    _format_date_br,
+    _is_outside_24h_window,
+    _logger,
+    _twilio_send_template,
+    conv_ref,
+    fs,
+    log_event,
+    messages_ref,
+)
+from .summaries import update_with_summary
+
+FS_REOPEN_PREVIEWS_COLL = os.getenv("FS_REOPEN_PREVIEWS_COLL", "reopen_previews").strip()
+REOPEN_PREVIEW_TTL_SEC = int(os.getenv("REOPEN_PREVIEW_TTL_SEC", "900"))
+REOPEN_PREVIEW_CHUNK_SIZE = 400
+REOPEN_READ_PAGE_SIZE = 100
+REOPEN_PREVIEW_PAGE_MAX = 500
+REOPEN_RECENT_TEMPLATE_WINDOW = timedelta(hours=24)
+
+# Resultados de evaluate(); os "skipped_*" viram contadores na resposta
+ELIGIBLE = "eligible"
+SKIPPED_NOT_ALLOWED = "skipped_not_allowed"
+SKIPPED_RECENT = "skipped_recent"
+SKIPPED_WINDOW_OPEN = "skipped_window_open"
+SKIPPED_CHANGED = "skipped_changed"
+
+
+# Documento do snapshot (escopo, contagens, validade) por processo: so executed_at muda depois
+reopen_preview_cache = MicroCache("reopen_preview", 60.0)
+
+
+class ReopenPreviewError(Exception):
+    def __init__(self, code: str, message: str, http_status: int = 400):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.http_status = http_status
+
+
+def normalize_status(status: str) -> str:
+    return "pending_handoff" if status == "pending" else status
+
+
+def template_for(normalized_status: str) -> tuple[str, str]:
+    """(template_sid, template_name) usado para reabrir conversas nesse status."""
+    if normalized_status == "pending_handoff":
+        return REOPEN_TEMPLATE_SID_PENDING_HANDOFF, "handoff_request"
+    if normalized_status == "bot":
+        return REOPEN_TEMPLATE_SID_BOT, "retomada_bot"
+    return REOPEN_TEMPLATE_SID_DEFAULT, "br_varizemed_reabertura_de_atendimento_utility"
+
+
+def evaluate(conv_id: str, conv_data: dict, ref, now: datetime, allowed_phones: set | None = None,
+             cache_last_inbound_at: bool = True) -> str:
+    """ELIGIBLE ou o motivo (SKIPPED_*) para nao reabrir a conversa agora."""
+    if allowed_phones is not None and "".join(ch for ch in conv_id if ch.isdigit()) not in allowed_phones:
+        return SKIPPED_NOT_ALLOWED
+
+    last_sent_dt = _coerce_ts_to_dt(conv_data.get("last_reopen_template_at"))
+    if last_sent_dt and (now - last_sent_dt) < REOPEN_RECENT_TEMPLATE_WINDOW:
+        return SKIPPED_RECENT
+
+    if not _is_outside_24h_window(conv_id, conv_data, ref, cache_last_inbound_at=cache_last_inbound_at):
+        return SKIPPED_WINDOW_OPEN
+    return ELIGIBLE
+
+
+def reopen_one(snap, conv_data: dict, normalized_status: str, template_sid: str, template_name: str,
+               agent_id: str, actor_name: str, scope: str, now: datetime) -> tuple[bool, dict]:
+    """Envia o template e grava a mensagem de sistema + o update da conversa. (ok, info do Twilio)."""
+    conv_id = snap.id
+    current_status = conv_data.get("status") or normalized_status
+
+    user_name = _extract_user_name(conv_data).strip() or "Sr(a)"
+    created_date = _conversation_created_date(conv_data)
+    if not created_date:
+        _logger().warning("conversation %s missing created_at; using current date for template", conv_id)
+        created_date = _format_date_br(now)
+
+    variables = {
+        "1": user_name,
+        "2": created_date,
+    }
+
+    ok, info = _twilio_send_template(conv_id, template_sid, variables)
+    if not ok:
+        log_event(
+            "reopen_batch_error",
+            conversation_id=conv_id,
+            agent_id=agent_id,
+            error_code=info.get("code"),
+            error_message=info.get("message"),
+            template_sid=template_sid,
+            old_status=current_status,
+            scope=scope,
+        )
+        return False, info
+
+    message_id = str(uuid.uuid4())
+    by = "system:template"
+    system_text = f"🔓 Conversa reaberta automaticamente por {actor_name}"
+    msg_doc = {
+        "message_id": message_id,
+        "direction": "out",
+        "by": by,
+        "display_name": actor_name,
+        "text": system_text,
+        "ts": firestore.SERVER_TIMESTAMP,
+        "twilio_sid": info.get("sid"),
+        "template_sid": template_sid,
+        "template_name": template_name,
+    }
+
+    messages_ref(conv_id).document(message_id).set(msg_doc)
+
+    update_data = {
+        "updated_at": firestore.SERVER_TIMESTAMP,
+        "last_message_text": system_text[:200],
+        "last_message_by": by,
+        "reopened_at": firestore.SERVER_TIMESTAMP,
+        "reopened_by": agent_id,
+        "last_reopen_template_at": firestore.SERVER_TIMESTAMP,
+        "last_reopen_template_sid": template_sid,
+        "last_reopen_template_by": agent_id,
+        "last_reopen_template_by_name": actor_name,
+        "handoff_active": False,
+    }
+
+    if normalized_status != current_status:
+        update_data["status"] = normalized_status
+
+    if normalized_status not in ("claimed", "active"):
+        update_data["assignee"] = firestore.DELETE_FIELD
+        update_data["assignee_name"] = firestore.DELETE_FIELD
+
+        if normalized_status == "pending_handoff":
+            update_data["status"] = "pending_handoff"
+    else:
+        if normalized_status == "claimed" and conv_data.get("assignee"):
+            update_data["assignee_name"] = conv_data.get("assignee")
+
+    if "claimed_by" in conv_data:
+        update_data["claimed_by"] = firestore.DELETE_FIELD
+
+    update_with_summary(conv_id, update_data, snap)
+    log_event(
+        "conversation_reopened_batch",
+        conversation_id=conv_id,
+        old_status=current_status,
+        new_status=update_data.get("status", normalized_status),
+        template_sid=template_sid,
+        twilio_sid=info.get("sid"),
+        actor=agent_id,
+        scope=scope,
+    )
+    return True, info
+
+
+# ---------- snapshot da pre-visualizacao ----------
+
+def preview_ref(preview_id: str):
+    return fs.collection(FS_REOPEN_PREVIEWS_COLL).document(preview_id)
+
+
+def preview_item(conv_id: str, conv_data: dict, normalized_status: str) -> dict:
+    template_sid, template_name = template_for(normalized_status)
+    return {
+        "conversation_id": conv_id,
+        "status": normalized_status,
+        "template_sid": template_sid,
+        "template_name": template_name,
+        "updated_at": conv_data.get("updated_at"),
+        "last_message_text": (conv_data.get("last_message_text") or "")[:120],
+    }
+
+
+class PreviewWriter:
+    """Grava os itens elegiveis em blocos conforme a varredura avanca (memoria constante)."""
+
+    def __init__(self, scope: str, agent_id: str, now: datetime):
+        self.preview_id = uuid.uuid4().hex
+        self.scope = scope
+        self.agent_id = agent_id
+        self.now = now
+        self.expires_at = now + timedelta(seconds=REOPEN_PREVIEW_TTL_SEC)
+        self.ref = preview_ref(self.preview_id)
+        self._items = []
+        self._chunks = 0
+
+    def add(self, item: dict):
+        self._items.append(item)
+        if len(self._items) >= REOPEN_PREVIEW_CHUNK_SIZE:
+            self._flush()
+
+    def _flush(self):
+        if not self._items:
+            return
+        chunk_ref(self.preview_id, self._chunks).set({
+            "index": self._chunks,
+            "items": self._items,
+            "expires_at": self.expires_at,
+        })
+        self._chunks += 1
+        self._items = []
+
+    def finish(self, counts: dict) -> datetime:
+        """Grava o ultimo bloco e o documento do snapshot; retorna expires_at."""
+        self._flush()
+        self.ref.set({
+            "scope": self.scope,
+            "created_by": self.agent_id,
+            "created_at": self.now,
+            "expires_at": self.expires_at,
+            "chunk_count": self._chunks,
+            "counts": counts,
+            "executed_at": None,
+        })
+        return self.expires_at
+
+
+def chunk_ref(preview_id: str, index: int):
+    return preview_ref(preview_id).collection("chunks").document(f"{index:06d}")
+
+
+def encode_preview_cursor(position: tuple[int, int] | None) -> str | None:
+    return _encode_cursor({"chunk": position[0], "offset": position[1]}) if position else None
+
+
+def decode_preview_cursor(value: str) -> tuple[int, int] | None:
+    """(bloco, deslocamento); None se o cursor for invalido."""
+    if not value:
+        return 0, 0
+    obj = _decode_cursor(value)
+    try:
+        position = int(obj["chunk"]), int(obj["offset"])
+    except (TypeError, KeyError, ValueError):
+        return None
+    return position if min(position) >= 0 else None
+
+
+def load_preview(preview_id: str, now: datetime) -> dict:
+    """Documento do snapshot (cacheado) ou ReopenPreviewError se inexistente/expirado."""
+    if not preview_id or "/" in preview_id:
+        raise ReopenPreviewError("PREVIEW_NOT_FOUND", "preview_id inválido", 404)
+
+    def read():
+        snap = preview_ref(preview_id).get()
+        return snap.to_dict() if snap.exists else None
+
+    data = reopen_preview_cache.get_or_compute(preview_id, read)
+    if data is None:
+        raise ReopenPreviewError("PREVIEW_NOT_FOUND", "Pré-visualização não encontrada", 404)
+    expires_at = _coerce_ts_to_dt(data.get("expires_at"))
+    if not expires_at or expires_at <= now:
+        raise ReopenPreviewError("PREVIEW_EXPIRED", "Pré-visualização expirada; gere outra", 410)
+    return data
+
+
+def preview_page(preview_id: str, chunk_count: int, position: tuple[int, int], limit: int):
+    """
+    Ate ``limit`` itens a partir de ``position``, lendo via get_all so os blocos que a
+    pagina cobre. Retorna (itens, proxima posicao|None).
+    """
+    chunk, offset = position
+    last = min(chunk_count, chunk + (offset + limit - 1) // REOPEN_PREVIEW_CHUNK_SIZE + 1)
+    if chunk >= last:
+        return [], None
+    found = {}
+    for snap in fs.get_all([chunk_ref(preview_id, i) for i in range(chunk, last)]):
+        if snap.exists:
+            found[snap.id] = (snap.to_dict() or {}).get("items") or []
+
+    items = []
+    for i in range(chunk, last):
+        chunk_items = found.get(f"{i:06d}", [])
+        start = offset if i == chunk else 0
+        taken = chunk_items[start:start + limit - len(items)]
+        items.extend(taken)
+        if len(items) >= limit:
+            end = start + len(taken)
+            if end < len(chunk_items):
+                return items, (i, end)
+            return items, ((i + 1, 0) if i + 1 < chunk_count else None)
+    return items, None
+
+
+def claim_preview(preview_id: str, scope: str, agent_id: str, now: datetime) -> dict:
+    """
+    Reserva o snapshot para execucao (uma unica vez, precondicao de update_time).
+    Retorna os dados do snapshot ou levanta ReopenPreviewError.
+    """
+    if not preview_id or "/" in preview_id:
+        raise ReopenPreviewError("PREVIEW_NOT_FOUND", "preview_id inválido", 404)
+    ref = preview_ref(preview_id)
+    snap = ref.get()
+    if not snap.exists:
+        raise ReopenPreviewError("PREVIEW_NOT_FOUND", "Pré-visualização não encontrada", 404)
+    data = snap.to_dict() or {}
+    if data.get("scope") != scope:
+        raise ReopenPreviewError("PREVIEW_SCOPE_MISMATCH", "scope difere do usado na pré-visualização")
+    if data.get("executed_at"):
+        raise ReopenPreviewError("PREVIEW_ALREADY_EXECUTED", "Pré-visualização já executada", 409)
+    expires_at = _coerce_ts_to_dt(data.get("expires_at"))
+    if not expires_at or expires_at <= now:
+        raise ReopenPreviewError("PREVIEW_EXPIRED", "Pré-visualização expirada; gere outra", 410)
+    try:
+        ref.update(
+            {"executed_at": firestore.SERVER_TIMESTAMP, "executed_by": agent_id},
+            option=fs.write_option(last_update_time=snap.update_time),
+        )
+    except gexc.FailedPrecondition:
+        raise ReopenPreviewError("PREVIEW_ALREADY_EXECUTED", "Pré-visualização já executada", 409)
+    return data
+
+
+def iter_preview_items(preview_id: str, chunk_count: int, position: tuple[int, int] = (0, 0)):
+    """Itens do snapshot na ordem em que foram avaliados, um bloco em memoria por vez."""
+    chunk, offset = position
+    for i in range(chunk, chunk_count):
+        snap = chunk_ref(preview_id, i).get()
+        items = (snap.to_dict() or {}).get("items") or [] if snap.exists else []
+        yield from (items[offset:] if i == chunk else items)
+
+
+def iter_revalidated(items):
+    """(item, snapshot|None) relendo as conversas em paginas de REOPEN_READ_PAGE_SIZE via get_all."""
+    page = []
+    for item in items:
+        page.append(item)
+        if len(page) >= REOPEN_READ_PAGE_SIZE:
+            yield from _read_page(page)
+            page = []
+    if page:
+        yield from _read_page(page)
+
+
+def _read_page(page: list):
+    found = {}
+    for snap in fs.get_all([conv_ref(item["conversation_id"]) for item in page]):
+        if snap.exists:
+            found[snap.id] = snap
+    for item in page:
+        yield item, found.get(item["conversation_id"])
+
+
+def candidates(statuses):
+    """Conversas dos status do escopo (varredura completa, usada so na pre-visualizacao)."""
+    for st in statuses:
+        for conv_doc in fs.collection(FS_CONV_COLL).where("status", "==", st).stream():
+            yield st, conv_doc
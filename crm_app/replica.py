@@ -0,0 +1,333 @@
+"""
+Replica em memoria das conversas (por worker) para lista e busca.
+
+Um listener ``on_snapshot`` do Firestore alimenta registros compactos
+(``__slots__``) com status, assignee, tags, telefone, ``updated_at`` e nome. O
+primeiro snapshot do listener e a carga inicial; depois chegam so as mudancas.
+
+Indices mantidos a cada mudanca:
+- por status: lista ordenada de (updated_at_us, id) -> pagina via bisect;
+- por telefone: lista ordenada de (digitos, id) -> prefixo via bisect (equivale a
+  uma trie de digitos, mas em dois arrays);
+- por tag (grafia gravada): conjunto de ids; a busca usa as mesmas variantes de
+  maiusculas/minusculas da consulta ao Firestore (``_tag_query_variants``), entao
+  o resultado nao depende de a replica estar pronta.
+
+Desligada por padrao (CONVERSATION_REPLICA_ENABLED): cada worker abre um listener
+sobre todas as conversas do escopo, com leituras cobradas a cada boot.
+
+As rotas so usam a replica quando ela esta pronta e o listener ativo; caso
+contrario caem no Firestore (e o listener e reiniciado). Escritas feitas por este
+processo chamam ``refresh()`` (1 leitura) para que quem gravou veja o resultado
+na hora, sem esperar o evento do listener.
+"""
+import bisect
+import heapq
+import os
+import threading
+import time
+
+from google.cloud.firestore_v1.watch import ChangeType
+
+from . import metrics
+from .core import (
+    FS_CONV_COLL,
+    _coerce_ts_to_dt,
+    _decode_cursor,
+    _encode_cursor,
+    _iso,
+    _logger,
+    _parse_iso,
+    _tag_query_variants,
+    conv_ref,
+    fs,
+)
+from .summaries import build_conversation_summary
+
+CONVERSATION_REPLICA_ENABLED = (os.getenv("CONVERSATION_REPLICA_ENABLED", "false") or "").strip().lower() in (
+    "1",
+    "true",
+    "yes",
+    "on",
+)
+# "all" replica a colecao inteira (necessario para a busca sair da memoria)
+_REPLICA_STATUSES_RAW = (os.getenv("CONVERSATION_REPLICA_STATUSES", "bot,pending_handoff,pending,claimed,active") or "").strip()
+CONVERSATION_REPLICA_STATUSES = (
+    None if _REPLICA_STATUSES_RAW.lower() == "all"
+    else tuple(s.strip() for s in _REPLICA_STATUSES_RAW.split(",") if s.strip())
+)
+CONVERSATION_REPLICA_RESTART_BACKOFF_SEC = 30.0
+
+
+def _ts_us(value) -> int:
+    dt = _coerce_ts_to_dt(value)
+    return int(dt.timestamp() * 1_000_000) if dt else 0
+
+
+class ConversationRecord:
+    __slots__ = (
+        "conversation_id",
+        "status",
+        "assignee",
+        "assignee_name",
+        "user_name",
+        "wa_profile_name",
+        "tags",
+        "tag_keys",
+        "last_message_text",
+        "last_message_by",
+        "updated_at",
+        "updated_us",
+        "digits",
+        "update_time",
+    )
+
+    @classmethod
+    def from_snapshot(cls, snap):
+        data = snap.to_dict() or {}
+        summary = build_conversation_summary(snap.id, data)
+        rec = cls()
+        rec.conversation_id = snap.id
+        rec.status = summary["status"]
+        rec.assignee = summary["assignee"]
+        rec.assignee_name = summary["assignee_name"]
+        rec.user_name = summary["display_name"] or ""
+        rec.wa_profile_name = summary["wa_profile_name"]
+        rec.tags = tuple(summary["tags"])
+        rec.tag_keys = frozenset(rec.tags)
+        rec.last_message_text = summary["last_message_preview"]
+        rec.last_message_by = summary["last_message_by"]
+        rec.updated_at = data.get("updated_at")
+        rec.updated_us = _ts_us(rec.updated_at)
+        rec.digits = "".join(ch for ch in snap.id if ch.isdigit())
+        rec.update_time = snap.update_time
+        return rec
+
+    def to_item(self) -> dict:
+        """Mesmo formato de ``summary_to_item``."""
+        return {
+            "conversation_id": self.conversation_id,
+            "status": self.status,
+            "assignee": self.assignee,
+            "assignee_name": self.assignee_name,
+            "user_name": self.user_name,
+            "wa_profile_name": self.wa_profile_name,
+            "tags": list(self.tags),
+            "last_message_text": self.last_message_text,
+            "last_message_by": self.last_message_by,
+            "updated_at": self.updated_at,
+        }
+
+
+class ConversationReplica:
+    def __init__(self, statuses: tuple | None):
+        self.statuses = statuses
+        self._lock = threading.RLock()
+        self._watch = None
+        self._ready = False
+        self._started_at = 0.0
+        self._generation = 0
+        self._reset()
+
+    def _reset(self):
+        self._records: dict[str, ConversationRecord] = {}
+        self._by_status: dict[str, list] = {}
+        self._by_phone: list = []
+        self._by_tag: dict[str, set] = {}
+
+    # ---------- ciclo de vida ----------
+
+    def covers(self, statuses) -> bool:
+        """True se todas as conversas desses status (vazio = todos) estao na replica."""
+        if self.statuses is None:
+            return True
+        return bool(statuses) and set(statuses) <= set(self.statuses)
+
+    @property
+    def covers_all(self) -> bool:
+        return self.statuses is None
+
+    def usable(self) -> bool:
+        """Pronta e com listener ativo; (re)inicia o listener quando preciso."""
+        if not CONVERSATION_REPLICA_ENABLED:
+            return False
+        with self._lock:
+            watch = self._watch
+            if watch is not None and self._ready and getattr(watch, "is_active", True):
+                return True
+            if time.monotonic() - self._started_at >= CONVERSATION_REPLICA_RESTART_BACKOFF_SEC or watch is None:
+                self._start()
+            return False
+
+    def _start(self):
+        if self._watch is not None:
+            try:
+                self._watch.unsubscribe()
+            except Exception:
+                pass
+        self._ready = False
+        self._reset()
+        self._started_at = time.monotonic()
+        self._generation += 1
+        generation = self._generation
+        q = fs.collection(FS_CONV_COLL)
+        if self.statuses is not None:
+            q = q.where("status", "in", list(self.statuses))
+        try:
+            self._watch = q.on_snapshot(
+                lambda docs, changes, read_time: self._on_snapshot(generation, changes)
+            )
+        except Exception as e:
+            self._watch = None
+            _logger().warning("Falha ao iniciar replica de conversas: %s", e)
+
+    def stop(self):
+        with self._lock:
+            if self._watch is not None:
+                self._watch.unsubscribe()
+            self._watch = None
+            self._ready = False
+            self._generation += 1
+            self._reset()
+
+    def _on_snapshot(self, generation: int, changes):
+        with self._lock:
+            if generation != self._generation:
+                return  # listener antigo (reiniciado)
+            for change in changes:
+                if change.type == ChangeType.REMOVED:
+                    self._remove(change.document.id)
+                else:
+                    self._upsert(ConversationRecord.from_snapshot(change.document))
+            if not self._ready:
+                self._ready = True
+                _logger().info("Replica de conversas carregada: %s conversas", len(self._records))
+        metrics.inc("crm_replica_events_total", value=len(changes))
+
+    # ---------- indices ----------
+
+    def _remove(self, conversation_id: str):
+        rec = self._records.pop(conversation_id, None)
+        if rec is None:
+            return
+        keys = self._by_status.get(rec.status)
+        if keys is not None:
+            i = bisect.bisect_left(keys, (rec.updated_us, rec.conversation_id))
+            if i < len(keys) and keys[i] == (rec.updated_us, rec.conversation_id):
+                del keys[i]
+        i = bisect.bisect_left(self._by_phone, (rec.digits, rec.conversation_id))
+        if i < len(self._by_phone) and self._by_phone[i] == (rec.digits, rec.conversation_id):
+            del self._by_phone[i]
+        for key in rec.tag_keys:
+            ids = self._by_tag.get(key)
+            if ids is not None:
+                ids.discard(rec.conversation_id)
+                if not ids:
+                    del self._by_tag[key]
+
+    def _upsert(self, rec: ConversationRecord):
+        current = self._records.get(rec.conversation_id)
+        if current is not None:
+            if current.update_time and rec.update_time and rec.update_time < current.update_time:
+                return  # evento antigo depois de um refresh local
+            self._remove(rec.conversation_id)
+        self._records[rec.conversation_id] = rec
+        bisect.insort(self._by_status.setdefault(rec.status, []), (rec.updated_us, rec.conversation_id))
+        bisect.insort(self._by_phone, (rec.digits, rec.conversation_id))
+        for key in rec.tag_keys:
+            self._by_tag.setdefault(key, set()).add(rec.conversation_id)
+
+    def refresh(self, conversation_id: str):
+        """Rele uma conversa gravada por este processo (read-your-writes)."""
+        if not CONVERSATION_REPLICA_ENABLED or self._watch is None or "/" in (conversation_id or ""):
+            return
+        try:
+            snap = conv_ref(conversation_id).get()
+        except Exception as e:
+            _logger().warning("Falha ao atualizar replica de %s: %s", conversation_id, e)
+            return
+        with self._lock:
+            if not snap.exists:
+                self._remove(conversation_id)
+                return
+            rec = ConversationRecord.from_snapshot(snap)
+            if self.statuses is not None and rec.status not in self.statuses:
+                self._remove(conversation_id)
+            else:
+                self._upsert(rec)
+
+    # ---------- consultas ----------
+
+    def list_conversations(self, statuses: list, assignee: str, limit: int, cursor_str: str) -> dict:
+        """Mesmo contrato de ``_query_conversation_list`` (cursor compativel)."""
+        upper = None
+        cursor_obj = _decode_cursor(cursor_str)
+        if cursor_obj:
+            dt = _parse_iso(cursor_obj.get("updated_at") or "")
+            if dt and cursor_obj.get("id"):
+                upper = (_ts_us(dt), cursor_obj["id"])
+
+        with self._lock:
+            if statuses:
+                lists = [self._by_status.get(s, []) for s in dict.fromkeys(statuses)]
+            else:
+                lists = list(self._by_status.values())
+
+            def newest_first(keys):
+                end = bisect.bisect_left(keys, upper) if upper else len(keys)
+                return (keys[i] for i in range(end - 1, -1, -1))
+
+            items = []
+            for _, conv_id in heapq.merge(*(newest_first(k) for k in lists), reverse=True):
+                rec = self._records[conv_id]
+                if assignee and rec.assignee != assignee:
+                    continue
+                items.append(rec.to_item())
+                if len(items) >= limit:
+                    break
+
+        out = {"items": items}
+        if len(items) == limit and items:
+            last_item = items[-1]
+            out["next_cursor"] = _encode_cursor({"updated_at": _iso(last_item["updated_at"]), "id": last_item["conversation_id"]})
+        return out
+
+    def counts(self, statuses, assignee: str = "") -> dict:
+        with self._lock:
+            if not assignee:
+                return {s: len(self._by_status.get(s, ())) for s in statuses}
+            return {
+                s: sum(1 for _, c in self._by_status.get(s, ()) if self._records[c].assignee == assignee)
+                for s in statuses
+            }
+
+    def _newest(self, conv_ids, limit: int) -> list[dict]:
+        recs = [self._records[c] for c in conv_ids if c in self._records]
+        top = heapq.nlargest(limit, recs, key=lambda r: (r.updated_us, r.conversation_id))
+        return [rec.to_item() for rec in top]
+
+    def search_phone(self, digits: str, limit: int) -> list[dict]:
+        """Conversas cujo telefone comeca com ``digits``: exatas primeiro, depois por recencia."""
+        with self._lock:
+            start = bisect.bisect_left(self._by_phone, (digits, ""))
+            end = bisect.bisect_left(self._by_phone, (digits + "\uffff", ""))
+            ids = [conv_id for _, conv_id in self._by_phone[start:end]]
+            exact = [c for c in ids if self._records[c].digits == digits]
+            items = self._newest(exact, limit)
+            if len(items) < limit:
+                rest = [c for c in ids if self._records[c].digits != digits]
+                items += self._newest(rest, limit - len(items))
+            return items
+
+    def search_tag(self, tag: str, limit: int) -> list[dict]:
+        with self._lock:
+            ids = set()
+            for variant in _tag_query_variants(tag):
+                ids.update(self._by_tag.get(variant, ()))
+            return self._newest(ids, limit)
+
+    def __len__(self):
+        return len(self._records)
+
+
+conversation_replica = ConversationReplica(CONVERSATION_REPLICA_STATUSES)
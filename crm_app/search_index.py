@@ -0,0 +1,317 @@
+"""
+Busca por texto nas mensagens.
+
+Indice invertido no Firestore: um documento por conversa em FS_SEARCH_INDEX_COLL
+com ``terms`` (termos normalizados das mensagens) e ``updated_at`` (ts da
+mensagem mais recente indexada). O indice de array do Firestore faz o papel de
+termo -> conversas; ``array_contains`` ordenado por ``updated_at`` devolve as
+conversas mais recentes primeiro.
+
+Atualizacao incremental:
+- mensagens enviadas pelo CRM sao indexadas no envio (leitura projetada de
+  ``terms``/``updated_at`` + 1 escrita);
+- mensagens de entrada sao gravadas pelo bot, fora deste app: ``sync_index`` le
+  (collection group) as mensagens com ts >= marca d'agua e indexa em lote. Roda
+  via ``flask build-message-index --incremental`` e em segundo plano quando a
+  busca e usada e o ultimo sync local tem mais de MESSAGE_INDEX_SYNC_INTERVAL_SEC.
+
+Toda escrita incremental le antes ``terms`` e ``updated_at`` do documento: so os
+termos novos entram (``ArrayUnion``), ate MESSAGE_INDEX_MAX_TERMS_PER_CONVERSATION,
+e ``updated_at`` so avanca (o sync grava o ts da mensagem, que pode ser mais
+antigo que o de um envio ja indexado). Falha ao gravar um documento nao impede o
+sync dos demais.
+"""
+import os
+import re
+import threading
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from google.api_core import exceptions as gexc
+from google.cloud import firestore
+
+from . import metrics
+from .core import FS_CONV_COLL, FS_MSG_SUBCOLL, _logger, fs
+from .export import iter_messages
+
+FS_SEARCH_INDEX_COLL = os.getenv("FS_SEARCH_INDEX_COLL", "message_search").strip()
+MESSAGE_INDEX_ENABLED = (os.getenv("MESSAGE_INDEX_ENABLED", "true") or "").strip().lower() in ("1", "true", "yes", "on")
+MESSAGE_INDEX_SYNC_INTERVAL_SEC = float(os.getenv("MESSAGE_INDEX_SYNC_INTERVAL_SEC", "60"))
+MESSAGE_INDEX_SYNC_MAX_MESSAGES = int(os.getenv("MESSAGE_INDEX_SYNC_MAX_MESSAGES", "5000"))
+MESSAGE_INDEX_SYNC_OVERLAP = timedelta(seconds=5)
+MESSAGE_INDEX_META_DOC = "_sync"
+MESSAGE_INDEX_MAX_TERMS_PER_MESSAGE = 64
+MESSAGE_INDEX_MAX_TERMS_PER_CONVERSATION = 5000
+MESSAGE_SEARCH_MAX_SCAN = int(os.getenv("MESSAGE_SEARCH_MAX_SCAN", "500"))
+
+MIN_TERM_LEN = 2
+MAX_TERM_LEN = 40
+STOPWORDS = frozenset(
+    "a o e de da do das dos em no na nos nas um uma uns umas que para pra pro por com se ao aos "
+    "as os me eu ou mas ja la ai isso esse essa este esta ele ela voce voces sim nao tem ta to "
+    "the and".split()
+)
+
+_SPLIT_RE = re.compile(r"[^\w]+")
+_PAGE_SIZE = 500
+
+_sync_lock = threading.Lock()
+_sync_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="msg-index")
+_last_sync_started = 0.0
+
+
+def fold_text(value: str) -> str:
+    """casefold + NFKD sem acentos ("Conceição" -> "conceicao")."""
+    folded = unicodedata.normalize("NFKD", (value or "").casefold())
+    return "".join(ch for ch in folded if not unicodedata.combining(ch))
+
+
+def tokenize(text: str, limit: int = MESSAGE_INDEX_MAX_TERMS_PER_MESSAGE) -> list[str]:
+    """Termos unicos (na ordem do texto), sem stopwords e sem tokens muito curtos/longos."""
+    terms = []
+    seen = set()
+    for token in _SPLIT_RE.split(fold_text(text).replace("_", " ")):
+        if len(token) < MIN_TERM_LEN or len(token) > MAX_TERM_LEN or token in STOPWORDS or token in seen:
+            continue
+        seen.add(token)
+        terms.append(token)
+        if len(terms) >= limit:
+            break
+    return terms
+
+
+def _should_index(message: dict) -> bool:
+    # Mensagens de sistema (templates de reabertura) so poluiriam a busca
+    return bool(message.get("text")) and not str(message.get("by") or "").startswith("system:")
+
+
+def index_ref(conversation_id: str):
+    return fs.collection(FS_SEARCH_INDEX_COLL).document(conversation_id)
+
+
+def _meta_ref():
+    return fs.collection(FS_SEARCH_INDEX_COLL).document(MESSAGE_INDEX_META_DOC)
+
+
+def _postings_update(conversation_id: str, terms, updated_at, current) -> dict | None:
+    """
+    Campos do ``set(merge=True)`` que acrescenta ``terms`` ao indice, dado ``current``
+    (snapshot com ``terms``/``updated_at``). None quando nao ha nada a gravar.
+    """
+    data = (current.to_dict() or {}) if current.exists else {}
+    existing = set(data.get("terms") or [])
+    room = max(0, MESSAGE_INDEX_MAX_TERMS_PER_CONVERSATION - len(existing))
+    new_terms = sorted(set(terms) - existing)[:room]
+
+    fields = {}
+    if new_terms:
+        fields["terms"] = firestore.ArrayUnion(new_terms)
+    previous = data.get("updated_at")
+    if updated_at is firestore.SERVER_TIMESTAMP or (updated_at and (previous is None or updated_at > previous)):
+        fields["updated_at"] = updated_at
+    if not fields:
+        return None
+    fields["conversation_id"] = conversation_id
+    return fields
+
+
+def index_message(conversation_id: str, text: str):
+    """Acrescenta os termos de uma mensagem recem-gravada (falha so gera log)."""
+    if not MESSAGE_INDEX_ENABLED:
+        return
+    terms = tokenize(text)
+    if not terms:
+        return
+    try:
+        ref = index_ref(conversation_id)
+        current = ref.get(field_paths=["terms", "updated_at"])
+        fields = _postings_update(conversation_id, terms, firestore.SERVER_TIMESTAMP, current)
+        if fields:
+            ref.set(fields, merge=True)
+    except Exception as e:
+        _logger().warning("Falha ao indexar mensagem de %s: %s", conversation_id, e)
+
+
+def _conversation_id_of(message_snapshot) -> str | None:
+    conv = message_snapshot.reference.parent.parent
+    if conv is None or conv.parent.id != FS_CONV_COLL:
+        return None
+    return conv.id
+
+
+def _write_postings(postings: dict):
+    """
+    postings: conversation_id -> [set de termos, ts mais recente]. Um lote por 400
+    conversas; se o lote falhar, grava uma a uma e so registra as que falharem.
+    """
+    items = list(postings.items())
+    for start in range(0, len(items), 400):
+        chunk = items[start:start + 400]
+        current = {
+            snap.id: snap
+            for snap in fs.get_all([index_ref(conv_id) for conv_id, _ in chunk], field_paths=["terms", "updated_at"])
+        }
+        writes = []
+        for conv_id, (terms, latest) in chunk:
+            fields = _postings_update(conv_id, terms, latest, current[conv_id])
+            if fields:
+                writes.append((conv_id, fields))
+        if not writes:
+            continue
+        batch = fs.batch()
+        for conv_id, fields in writes:
+            batch.set(index_ref(conv_id), fields, merge=True)
+        try:
+            batch.commit()
+        except gexc.GoogleAPICallError as e:
+            _logger().warning("Falha no lote do indice (%s conversas), gravando uma a uma: %s", len(writes), e)
+            for conv_id, fields in writes:
+                try:
+                    index_ref(conv_id).set(fields, merge=True)
+                except gexc.GoogleAPICallError as e:
+                    metrics.inc("crm_message_index_write_errors_total")
+                    _logger().warning("Indice da conversa %s nao gravado: %s", conv_id, e)
+
+
+def sync_index(max_messages: int = MESSAGE_INDEX_SYNC_MAX_MESSAGES) -> dict:
+    """
+    Indexa as mensagens com ts >= marca d'agua (com folga de alguns segundos; reindexar
+    e idempotente). Retorna {"messages", "conversations", "watermark", "done"}.
+    """
+    meta = _meta_ref().get()
+    watermark = (meta.to_dict() or {}).get("watermark") if meta.exists else None
+
+    q = fs.collection_group(FS_MSG_SUBCOLL)
+    if watermark:
+        q = q.where("ts", ">=", watermark - MESSAGE_INDEX_SYNC_OVERLAP)
+    q = q.order_by("ts", direction=firestore.Query.ASCENDING)
+
+    scanned = 0
+    indexed = 0
+    conversations = set()
+    last = None
+    done = False
+    while scanned < max_messages:
+        page_size = min(_PAGE_SIZE, max_messages - scanned)
+        page = q.limit(page_size)
+        if last is not None:
+            page = page.start_after(last)
+        docs = list(page.stream())
+        if not docs:
+            done = True
+            break
+
+        postings = {}
+        for doc in docs:
+            m = doc.to_dict() or {}
+            conv_id = _conversation_id_of(doc)
+            if not conv_id or not _should_index(m):
+                continue
+            terms = tokenize(m.get("text") or "")
+            if not terms:
+                continue
+            entry = postings.setdefault(conv_id, [set(), m.get("ts")])
+            entry[0].update(terms)
+            if m.get("ts") and (entry[1] is None or m["ts"] > entry[1]):
+                entry[1] = m["ts"]
+            indexed += 1
+        if postings:
+            _write_postings(postings)
+            conversations.update(postings)
+
+        scanned += len(docs)
+        last = docs[-1]
+        new_watermark = (last.to_dict() or {}).get("ts")
+        if new_watermark:
+            _meta_ref().set({"watermark": new_watermark, "synced_at": firestore.SERVER_TIMESTAMP}, merge=True)
+            watermark = new_watermark
+        if len(docs) < page_size:
+            done = True
+            break
+
+    return {"messages": indexed, "conversations": len(conversations), "watermark": watermark, "done": done}
+
+
+def maybe_sync_in_background():
+    """Dispara sync_index em segundo plano no maximo uma vez por intervalo neste processo."""
+    global _last_sync_started
+    if not MESSAGE_INDEX_ENABLED or MESSAGE_INDEX_SYNC_INTERVAL_SEC <= 0:
+        return
+    now = time.monotonic()
+    if now - _last_sync_started < MESSAGE_INDEX_SYNC_INTERVAL_SEC or not _sync_lock.acquire(blocking=False):
+        return
+    _last_sync_started = now
+
+    def run():
+        try:
+            result = sync_index()
+            _logger().info("Indice de mensagens sincronizado: %s", result)
+        except Exception as e:
+            _logger().warning("Falha no sync do indice de mensagens: %s", e)
+        finally:
+            _sync_lock.release()
+
+    _sync_executor.submit(run)
+
+
+def rebuild_conversation(conversation_id: str) -> dict | None:
+    """Documento de indice completo de uma conversa (None se nao houver texto indexavel)."""
+    terms = set()
+    latest = None
+    for msg in iter_messages(conversation_id):
+        m = msg.to_dict() or {}
+        if not _should_index(m):
+            continue
+        for term in tokenize(m.get("text") or ""):
+            if len(terms) >= MESSAGE_INDEX_MAX_TERMS_PER_CONVERSATION:
+                break
+            terms.add(term)
+        if m.get("ts") and (latest is None or m["ts"] > latest):
+            latest = m["ts"]
+    if not terms:
+        return None
+    return {"conversation_id": conversation_id, "terms": sorted(terms), "updated_at": latest}
+
+
+def search(query: str, limit: int, max_scan: int = MESSAGE_SEARCH_MAX_SCAN) -> tuple[list, list[str]]:
+    """
+    Conversas cujas mensagens contem todos os termos de ``query``, mais recentes primeiro.
+    Retorna ([(conversation_id, updated_at)], termos usados).
+    """
+    terms = tokenize(query)
+    if not terms:
+        return [], []
+
+    # O termo mais longo tende a ser o mais seletivo; os demais sao conferidos em memoria
+    pivot = max(terms, key=len)
+    rest = set(terms) - {pivot}
+    q = (
+        fs.collection(FS_SEARCH_INDEX_COLL)
+        .where("terms", "array_contains", pivot)
+        .order_by("updated_at", direction=firestore.Query.DESCENDING)
+        .select(["updated_at", "terms"] if rest else ["updated_at"])
+    )
+
+    matches = []
+    scanned = 0
+    last = None
+    page_size = 50 if rest else limit
+    while len(matches) < limit and scanned < max_scan:
+        page = q.limit(page_size)
+        if last is not None:
+            page = page.start_after(last)
+        docs = list(page.stream())
+        for doc in docs:
+            d = doc.to_dict() or {}
+            if rest and not rest.issubset(d.get("terms") or ()):
+                continue
+            matches.append((doc.id, d.get("updated_at")))
+            if len(matches) >= limit:
+                break
+        scanned += len(docs)
+        if len(docs) < page_size:
+            break
+        last = docs[-1]
+    return matches, terms
@@ -0,0 +1,124 @@
+"""
+Read model compacto das conversas (campo ``summary``) usado pela lista/busca.
+
+O ``summary`` e recalculado em toda escrita feita pelo CRM. Como outros servicos
+(webhook/bot) tambem escrevem nas conversas, ele guarda uma copia de
+``updated_at`` gravada na mesma escrita (``SERVER_TIMESTAMP`` nos dois campos
+resolve para o mesmo instante do commit): se o ``updated_at`` atual for
+diferente, o summary esta desatualizado e a conversa e lida por completo (e
+reparada) na proxima listagem.
+
+As escritas usam ``update()`` com precondicao ``last_update_time`` sobre o
+snapshot usado para montar o summary; em conflito o documento e relido.
+"""
+import os
+
+from google.api_core import exceptions as gexc
+from google.cloud import firestore
+
+from .core import _extract_user_name, conv_ref, fs
+
+SUMMARY_VERSION = 2
+SUMMARY_WRITE_MAX_ATTEMPTS = 3
+
+# Campos projetados pela lista/busca
+SUMMARY_FIELD_PATHS = ["summary", "updated_at"]
+
+SUMMARY_READ_REPAIR = (os.getenv("CONVERSATION_SUMMARY_READ_REPAIR", "true") or "").strip().lower() in (
+    "1",
+    "true",
+    "yes",
+    "on",
+)
+
+
+def build_conversation_summary(conversation_id: str, data: dict) -> dict:
+    tags = data.get("tags") if isinstance(data.get("tags"), list) else []
+    return {
+        "v": SUMMARY_VERSION,
+        "display_name": _extract_user_name(data),
+        "wa_profile_name": data.get("wa_profile_name"),
+        "phone": data.get("conversation_id") or conversation_id,
+        "status": data.get("status"),
+        "assignee": data.get("assignee"),
+        "assignee_name": data.get("assignee_name"),
+        "tags": [str(t) for t in tags],
+        "last_message_preview": data.get("last_message_text", "") or "",
+        "last_message_by": data.get("last_message_by"),
+        # Copia exata (ou o mesmo SERVER_TIMESTAMP) do updated_at do documento
+        "updated_at": data.get("updated_at"),
+    }
+
+
+def summary_is_fresh(data: dict) -> bool:
+    summary = data.get("summary")
+    if not isinstance(summary, dict) or summary.get("v") != SUMMARY_VERSION:
+        return False
+    return summary.get("updated_at") == data.get("updated_at")
+
+
+def summary_to_item(conversation_id: str, summary: dict, updated_at) -> dict:
+    """Mesmo formato de ``_serialize_conversation`` a partir do summary."""
+    return {
+        "conversation_id": conversation_id,
+        "status": summary.get("status"),
+        "assignee": summary.get("assignee"),
+        "assignee_name": summary.get("assignee_name"),
+        "user_name": summary.get("display_name") or "",
+        "wa_profile_name": summary.get("wa_profile_name"),
+        "tags": summary.get("tags") or [],
+        "last_message_text": summary.get("last_message_preview", ""),
+        "last_message_by": summary.get("last_message_by"),
+        "updated_at": updated_at,
+    }
+
+
+def _merge_path(merged: dict, dotted: str, value):
+    parts = dotted.split(".")
+    cur = merged
+    for part in parts[:-1]:
+        nxt = cur.get(part)
+        nxt = dict(nxt) if isinstance(nxt, dict) else {}
+        cur[part] = nxt
+        cur = nxt
+    if value is firestore.DELETE_FIELD:
+        cur.pop(parts[-1], None)
+    else:
+        cur[parts[-1]] = value
+
+
+def with_summary(conversation_id: str, current: dict | None, updates: dict) -> dict:
+    """
+    Completa um payload de ``update()`` (chaves podem ser caminhos com ponto, ex.
+    ``session_parameters.user_name``) com o ``summary`` recalculado sobre
+    ``current``. ``updated_at`` = SERVER_TIMESTAMP vai igual para o summary.
+    """
+    merged = dict(current or {})
+    for key, value in updates.items():
+        _merge_path(merged, key, value)
+
+    updates["summary"] = build_conversation_summary(conversation_id, merged)
+    return updates
+
+
+def update_with_summary(conversation_id: str, updates: dict, snap=None):
+    """
+    Grava ``updates`` + summary com precondicao sobre ``snap`` (lido de novo quando
+    None ou em conflito). Esgotadas as tentativas grava sem precondicao e remove o
+    summary, que e reconstruido na proxima leitura. Retorna o WriteResult.
+    """
+    ref = conv_ref(conversation_id)
+    for _ in range(SUMMARY_WRITE_MAX_ATTEMPTS):
+        if snap is None:
+            snap = ref.get()
+            if not snap.exists:
+                raise gexc.NotFound(f"Conversa {conversation_id} nao encontrada")
+        try:
+            return ref.update(
+                with_summary(conversation_id, snap.to_dict() or {}, dict(updates)),
+                option=fs.write_option(last_update_time=snap.update_time),
+            )
+        except gexc.FailedPrecondition:
+            # Outra escrita (bot/webhook) entre a leitura e o update
+            snap = None
+    return ref.update({**updates, "summary": firestore.DELETE_FIELD})
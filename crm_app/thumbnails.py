@@ -0,0 +1,207 @@
+"""
+Miniaturas de midia para o chat (``/api/admin/media/...?variant=thumb``).
+
+Imagens viram WebP (ou JPEG) com no maximo MEDIA_THUMB_MAX_PX no maior lado;
+videos viram o primeiro frame em JPEG (poster). Geracao sob demanda, em um pool
+limitado de MEDIA_THUMB_WORKERS threads; com a fila cheia a rota responde sem
+miniatura em vez de acumular downloads. O resultado fica no cache de midia do
+processo (LRU com single-flight): varios atendentes abrindo a mesma conversa
+geram uma unica miniatura.
+
+Dependencias opcionais: Pillow (imagens) e o binario ``ffmpeg`` (posters de
+video). Sem elas ``available()`` devolve False e a rota cai no original.
+"""
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from . import metrics
+from .cache import MicroCache
+from .core import TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN_REST
+from .twilio_client import twilio_media_client
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover - depende do ambiente
+    Image = None
+
+MEDIA_THUMB_MAX_PX = int(os.getenv("MEDIA_THUMB_MAX_PX", "320"))
+MEDIA_THUMB_FORMAT = (os.getenv("MEDIA_THUMB_FORMAT", "webp") or "webp").strip().lower()
+MEDIA_THUMB_QUALITY = int(os.getenv("MEDIA_THUMB_QUALITY", "70"))
+MEDIA_THUMB_WORKERS = int(os.getenv("MEDIA_THUMB_WORKERS", "2"))
+MEDIA_THUMB_QUEUE_MAX = int(os.getenv("MEDIA_THUMB_QUEUE_MAX", "16"))
+MEDIA_THUMB_TIMEOUT_SEC = float(os.getenv("MEDIA_THUMB_TIMEOUT_SEC", "20"))
+MEDIA_THUMB_MAX_SOURCE_BYTES = int(os.getenv("MEDIA_THUMB_MAX_SOURCE_BYTES", str(25 * 1024 * 1024)))
+MEDIA_THUMB_CACHE_ENTRIES = int(os.getenv("MEDIA_THUMB_CACHE_ENTRIES", "1024"))
+# Midia de mensagem nao muda; o limite real e o numero de entradas
+MEDIA_THUMB_CACHE_TTL_SEC = 24 * 3600.0
+
+FFMPEG_BIN = shutil.which("ffmpeg")
+
+media_cache = MicroCache(
+    "media_thumb",
+    MEDIA_THUMB_CACHE_TTL_SEC,
+    max_entries=MEDIA_THUMB_CACHE_ENTRIES,
+    wait_timeout_sec=MEDIA_THUMB_TIMEOUT_SEC,
+)
+
+_executor = ThreadPoolExecutor(max_workers=MEDIA_THUMB_WORKERS, thread_name_prefix="media-thumb")
+_slots = threading.BoundedSemaphore(MEDIA_THUMB_WORKERS + MEDIA_THUMB_QUEUE_MAX)
+
+
+class ThumbnailUnavailable(Exception):
+    """Nao ha miniatura para esta midia (tipo sem suporte, dependencia ausente, origem com erro)."""
+
+
+class ThumbnailBusy(ThumbnailUnavailable):
+    """Pool de geracao cheio."""
+
+
+def _cache_key(conversation_id: str, message_id: str) -> tuple:
+    return (conversation_id, message_id, MEDIA_THUMB_MAX_PX, MEDIA_THUMB_FORMAT)
+
+
+def _kind(media_type: str) -> str | None:
+    media_type = (media_type or "").split(";")[0].strip().lower()
+    if media_type.startswith("image/"):
+        return "image"
+    if media_type.startswith("video/"):
+        return "video"
+    return None
+
+
+def available(media_type: str) -> bool:
+    kind = _kind(media_type)
+    return (kind == "image" and Image is not None) or (kind == "video" and FFMPEG_BIN is not None)
+
+
+def _download(media_url: str) -> bytes:
+    resp = twilio_media_client.get(
+        "media",
+        media_url,
+        auth=(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN_REST),
+        stream=True,
+    )
+    try:
+        if resp.status_code != 200:
+            raise ThumbnailUnavailable(f"origem respondeu {resp.status_code}")
+        buf = io.BytesIO()
+        for chunk in resp.iter_content(chunk_size=64 * 1024):
+            buf.write(chunk)
+            if buf.tell() > MEDIA_THUMB_MAX_SOURCE_BYTES:
+                raise ThumbnailUnavailable("midia grande demais para miniatura")
+        metrics.inc("crm_media_proxy_bytes_total", value=buf.tell())
+        return buf.getvalue()
+    finally:
+        resp.close()
+
+
+def _image_thumbnail(data: bytes) -> tuple[bytes, str]:
+    with Image.open(io.BytesIO(data)) as img:
+        # JPEG decodifica direto em escala reduzida
+        img.draft("RGB", (MEDIA_THUMB_MAX_PX, MEDIA_THUMB_MAX_PX))
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((MEDIA_THUMB_MAX_PX, MEDIA_THUMB_MAX_PX))
+        out = io.BytesIO()
+        if MEDIA_THUMB_FORMAT == "webp":
+            if img.mode not in ("RGB", "RGBA"):
+                img = img.convert("RGBA" if "A" in img.getbands() or "transparency" in img.info else "RGB")
+            img.save(out, "WEBP", quality=MEDIA_THUMB_QUALITY, method=4)
+            return out.getvalue(), "image/webp"
+        img.convert("RGB").save(out, "JPEG", quality=MEDIA_THUMB_QUALITY, optimize=True, progressive=True)
+        return out.getvalue(), "image/jpeg"
+
+
+def _video_poster(data: bytes) -> tuple[bytes, str]:
+    # MP4 com o indice no fim nao e legivel por pipe; o ffmpeg precisa de arquivo
+    with tempfile.NamedTemporaryFile(suffix=".media") as src:
+        src.write(data)
+        src.flush()
+        scale = f"scale='min({MEDIA_THUMB_MAX_PX},iw)':'min({MEDIA_THUMB_MAX_PX},ih)':force_original_aspect_ratio=decrease"
+        proc = subprocess.run(
+            [
+                FFMPEG_BIN, "-hide_banner", "-loglevel", "error",
+                "-i", src.name, "-frames:v", "1", "-vf", scale,
+                "-f", "image2pipe", "-vcodec", "mjpeg", "-q:v", "5", "pipe:1",
+            ],
+            capture_output=True,
+            timeout=MEDIA_THUMB_TIMEOUT_SEC,
+        )
+    if proc.returncode != 0 or not proc.stdout:
+        raise ThumbnailUnavailable("ffmpeg nao extraiu o primeiro frame")
+    return proc.stdout, "image/jpeg"
+
+
+def _render(data: bytes, kind: str) -> tuple[bytes, str]:
+    try:
+        if kind == "image":
+            return _image_thumbnail(data)
+        return _video_poster(data)
+    except ThumbnailUnavailable:
+        raise
+    except Exception as e:
+        raise ThumbnailUnavailable(f"falha ao gerar miniatura: {e}") from e
+
+
+def _generate(media_url: str, kind: str) -> tuple[bytes, str]:
+    try:
+        data = _download(media_url)
+    except ThumbnailUnavailable:
+        raise
+    except Exception as e:
+        raise ThumbnailUnavailable(f"falha ao baixar midia: {e}") from e
+    return _render(data, kind)
+
+
+def _generate_in_pool(media_url: str, kind: str) -> tuple[bytes, str]:
+    if not _slots.acquire(blocking=False):
+        metrics.inc("crm_media_thumbnails_total", {"kind": kind, "result": "busy"})
+        raise ThumbnailBusy("fila de miniaturas cheia")
+
+    def run():
+        try:
+            return _generate(media_url, kind)
+        finally:
+            _slots.release()
+
+    future = _executor.submit(run)
+    try:
+        result = future.result(timeout=MEDIA_THUMB_TIMEOUT_SEC)
+    except FutureTimeout:
+        metrics.inc("crm_media_thumbnails_total", {"kind": kind, "result": "timeout"})
+        raise ThumbnailBusy("miniatura demorou demais")
+    except ThumbnailUnavailable:
+        metrics.inc("crm_media_thumbnails_total", {"kind": kind, "result": "error"})
+        raise
+    metrics.inc("crm_media_thumbnails_total", {"kind": kind, "result": "generated"})
+    return result
+
+
+def get_thumbnail(conversation_id: str, message_id: str, media_url: str, media_type: str) -> tuple[bytes, str]:
+    """
+    Retorna (bytes, content_type) da miniatura, do cache quando possivel.
+    Levanta ThumbnailUnavailable (ou ThumbnailBusy) quando nao ha miniatura agora.
+    """
+    kind = _kind(media_type)
+    if not available(media_type):
+        raise ThumbnailUnavailable("tipo de midia sem miniatura")
+    key = _cache_key(conversation_id, message_id)
+    return media_cache.get_or_compute(key, lambda: _generate_in_pool(media_url, kind))
+
+
+def warm(conversation_id: str, message_id: str, media_type: str, data: bytes) -> bool:
+    """Gera e guarda a miniatura a partir de bytes ja baixados (prefetch). True se ficou no cache."""
+    if not available(media_type):
+        return False
+    kind = _kind(media_type)
+    try:
+        media_cache.get_or_compute(_cache_key(conversation_id, message_id), lambda: _render(data, kind))
+    except ThumbnailUnavailable:
+        return False
+    metrics.inc("crm_media_thumbnails_total", {"kind": kind, "result": "prefetched"})
+    return True
@@ -0,0 +1,137 @@
+"""
+Maquina de estados das conversas (claim, takeover, handoff, resolve).
+
+Cada acao custa uma leitura e uma escrita: le o documento, valida o status e
+grava tudo em um unico ``update()`` com precondicao ``last_update_time``
+(inclusive a remocao de ``session_parameters.handoff_requested``). Se outra
+escrita acontecer entre a leitura e o update, o Firestore rejeita a gravacao e
+a transicao e reavaliada sobre o estado novo; assim, de dois claims
+simultaneos exatamente um vence e o outro recebe INVALID.
+"""
+from google.api_core import exceptions as gexc
+from google.cloud import firestore
+
+from .core import conv_ref, fs
+from .summaries import with_summary
+
+TRANSITION_MAX_ATTEMPTS = 3
+
+
+class TransitionError(Exception):
+    def __init__(self, code: str, message: str, http_status: int = 400):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.http_status = http_status
+
+
+# action -> status padrao quando ausente, status de origem aceitos, status final (None = mantem)
+TRANSITIONS = {
+    "claim": {
+        "default_status": "pending_handoff",
+        "from": ("pending_handoff",),
+        "to": "claimed",
+        "invalid_message": "status atual={st} não é pending_handoff",
+        "clear_handoff_requested": True,
+    },
+    "takeover": {
+        "default_status": "",
+        "from": ("claimed", "active"),
+        "to": None,
+        "invalid_message": "status atual={st} não permite takeover",
+        "clear_handoff_requested": False,
+    },
+    "handoff": {
+        "default_status": "bot",
+        "from": ("bot",),
+        "to": "claimed",
+        "invalid_message": "status atual={st} não é bot",
+        "clear_handoff_requested": False,
+    },
+    "resolve": {
+        "default_status": "",
+        "from": ("claimed", "active", "bot"),
+        "to": "resolved",
+        "invalid_message": "status atual={st} não permite encerramento",
+        "clear_handoff_requested": True,
+    },
+}
+
+
+def _build_updates(action: str, spec: dict, agent_id: str, display_name: str) -> dict:
+    updates = {}
+    if spec["to"]:
+        updates["status"] = spec["to"]
+    if action == "resolve":
+        updates["assignee"] = firestore.DELETE_FIELD
+        updates["assignee_name"] = firestore.DELETE_FIELD
+    else:
+        updates["assignee"] = agent_id
+        updates["assignee_name"] = display_name or agent_id
+    updates["updated_at"] = firestore.SERVER_TIMESTAMP
+    updates["handoff_active"] = False
+    if spec["clear_handoff_requested"]:
+        updates["session_parameters.handoff_requested"] = firestore.DELETE_FIELD
+    return updates
+
+
+def plan_transition(action: str, data: dict, agent_id: str, display_name: str = "") -> dict | None:
+    """
+    Valida ``action`` sobre o estado ``data`` e devolve os campos do ``update()``.
+    None quando nao ha nada a fazer (takeover para o proprio assignee).
+    """
+    spec = TRANSITIONS[action]
+    st = data.get("status", spec["default_status"])
+    if st not in spec["from"]:
+        raise TransitionError("INVALID", spec["invalid_message"].format(st=st))
+    if action == "takeover" and data.get("assignee") == agent_id:
+        return None
+    return _build_updates(action, spec, agent_id, display_name)
+
+
+def apply_update(conversation_id: str, plan) -> tuple[dict, dict | None]:
+    """
+    Le a conversa, calcula ``plan(data)`` e grava com precondicao de update_time.
+    Em conflito, rele e recalcula (ate TRANSITION_MAX_ATTEMPTS). Retorna (data lido, updates).
+    """
+    ref = conv_ref(conversation_id)
+
+    for _ in range(TRANSITION_MAX_ATTEMPTS):
+        snap = ref.get()
+        if not snap.exists:
+            raise TransitionError("NOT_FOUND", "Conversa não encontrada", 404)
+
+        d = snap.to_dict() or {}
+        updates = plan(d)
+        if updates is None:
+            return d, None
+        try:
+            ref.update(
+                with_summary(conversation_id, d, updates),
+                option=fs.write_option(last_update_time=snap.update_time),
+            )
+        except gexc.FailedPrecondition:
+            # Outra escrita entre a leitura e o update: reavalia sobre o estado atual
+            continue
+        return d, updates
+
+    raise TransitionError("CONFLICT", "Conversa alterada simultaneamente; tente novamente", 409)
+
+
+def apply_transition(conversation_id: str, action: str, agent_id: str, display_name: str = "") -> dict:
+    """
+    Executa ``action`` na conversa. Retorna
+    ``{"old_status", "new_status", "old_assignee", "already"}`` ou levanta TransitionError.
+    """
+    spec = TRANSITIONS[action]
+    d, updates = apply_update(
+        conversation_id,
+        lambda data: plan_transition(action, data, agent_id, display_name),
+    )
+    st = d.get("status", spec["default_status"])
+    return {
+        "old_status": st,
+        "new_status": (updates or {}).get("status", st),
+        "old_assignee": d.get("assignee"),
+        "already": updates is None,
+    }
@@ -0,0 +1,244 @@
+"""
+Clientes HTTP do Twilio: ``twilio_client`` (envio de mensagens/templates) e
+``twilio_media_client`` (proxy, miniaturas e pre-busca de midia). Cada um tem sessao,
+limite de concorrencia e circuit breaker proprios, para que uma rajada de GETs de
+midia lentos ou com erro nao abra o circuito nem consuma as vagas dos envios.
+
+Regras de retry (um envio repetido vira WhatsApp duplicado):
+- POST so e repetido quando o Twilio certamente nao processou: falha de conexao
+  (nada foi enviado) ou 429 (rejeitado por limite). 5xx e timeout de leitura nao
+  sao repetidos.
+- GET (midia) e idempotente: repete tambem em 5xx e timeouts.
+- ``Retry-After`` e respeitado (ate TWILIO_RETRY_AFTER_MAX_SEC); sem ele, backoff
+  exponencial com jitter.
+
+Concorrencia adaptativa (AIMD): no maximo ``limit`` requisicoes em voo por
+processo; cada sucesso soma 1/limit, cada 429 corta o limite pela metade.
+
+Circuit breaker: TWILIO_BREAKER_FAILURES falhas seguidas (5xx, conexao, timeout)
+abrem o circuito por TWILIO_BREAKER_COOLDOWN_SEC; nesse periodo as chamadas
+falham na hora com TwilioUnavailable. Depois, uma chamada de teste decide se fecha.
+"""
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+from . import metrics
+
+TWILIO_CONNECT_TIMEOUT_SEC = float(os.getenv("TWILIO_CONNECT_TIMEOUT_SEC", "3.05"))
+TWILIO_READ_TIMEOUT_SEC = float(os.getenv("TWILIO_READ_TIMEOUT_SEC", "20"))
+TWILIO_MAX_RETRIES = int(os.getenv("TWILIO_MAX_RETRIES", "3"))
+TWILIO_RETRY_AFTER_MAX_SEC = float(os.getenv("TWILIO_RETRY_AFTER_MAX_SEC", "10"))
+TWILIO_BACKOFF_BASE_SEC = 0.5
+TWILIO_CONCURRENCY_INITIAL = float(os.getenv("TWILIO_CONCURRENCY_INITIAL", "8"))
+TWILIO_CONCURRENCY_MAX = float(os.getenv("TWILIO_CONCURRENCY_MAX", "32"))
+TWILIO_CONCURRENCY_MIN = 1.0
+TWILIO_BREAKER_FAILURES = int(os.getenv("TWILIO_BREAKER_FAILURES", "5"))
+TWILIO_BREAKER_COOLDOWN_SEC = float(os.getenv("TWILIO_BREAKER_COOLDOWN_SEC", "30"))
+
+RETRYABLE_GET_STATUSES = (429, 500, 502, 503, 504)
+
+
+class TwilioUnavailable(requests.RequestException):
+    """Circuito aberto ou sem vaga de concorrencia: a chamada nem foi feita."""
+
+
+def _request_not_sent(exc: requests.RequestException) -> bool:
+    """True quando a conexao nem foi aberta (connect timeout, DNS, recusa)."""
+    if isinstance(exc, requests.ConnectTimeout):
+        return True
+    reason = getattr(exc.args[0], "reason", None) if exc.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def _retry_after_seconds(value: str | None) -> float | None:
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        dt = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return max(0.0, (dt - datetime.now(timezone.utc)).total_seconds())
+
+
+class AdaptiveLimiter:
+    """Limite de requisicoes em voo com aumento aditivo e reducao multiplicativa."""
+
+    def __init__(self, initial: float, minimum: float, maximum: float):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def on_success(self):
+        with self._cond:
+            self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self._cond.notify()
+
+    def on_throttled(self):
+        with self._cond:
+            self.limit = max(self.minimum, self.limit / 2)
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, cooldown_sec: float, name: str = "send"):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown_sec = cooldown_sec
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            self.state = state
+            metrics.inc("crm_twilio_circuit_transitions_total", {"client": self.name, "state": state})
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            now = time.monotonic()
+            if now - self._opened_at >= self.cooldown_sec:
+                # Uma chamada de teste por periodo (se a anterior se perdeu, libera outra)
+                self._opened_at = now
+                self._set_state(self.HALF_OPEN)
+                return True
+            return False
+
+    def on_success(self):
+        with self._lock:
+            self.failures = 0
+            self._set_state(self.CLOSED)
+
+    def on_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                self._set_state(self.OPEN)
+
+
+class TwilioClient:
+    def __init__(self, name: str = "send"):
+        self.name = name
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=int(TWILIO_CONCURRENCY_MAX))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.limiter = AdaptiveLimiter(TWILIO_CONCURRENCY_INITIAL, TWILIO_CONCURRENCY_MIN, TWILIO_CONCURRENCY_MAX)
+        self.breaker = CircuitBreaker(TWILIO_BREAKER_FAILURES, TWILIO_BREAKER_COOLDOWN_SEC, name)
+
+    @staticmethod
+    def _outcome(op: str, outcome: str):
+        metrics.inc("crm_twilio_client_outcomes_total", {"op": op, "outcome": outcome})
+
+    @staticmethod
+    def _backoff(attempt: int, retry_after: float | None) -> float:
+        if retry_after is not None:
+            return min(retry_after, TWILIO_RETRY_AFTER_MAX_SEC)
+        return random.uniform(0, TWILIO_BACKOFF_BASE_SEC * (2 ** attempt))
+
+    def request(self, op: str, method: str, url: str, auth=None, **kwargs) -> requests.Response:
+        """
+        Executa a chamada com as regras de retry/limite/circuito. Retorna a resposta final
+        (inclusive 4xx/5xx) ou levanta TwilioUnavailable / requests.RequestException.
+        """
+        idempotent = method.upper() == "GET"
+        kwargs.setdefault("timeout", (TWILIO_CONNECT_TIMEOUT_SEC, TWILIO_READ_TIMEOUT_SEC))
+
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                self._outcome(op, "circuit_open")
+                raise TwilioUnavailable("Twilio indisponivel (circuito aberto)")
+            if not self.limiter.acquire(timeout=TWILIO_READ_TIMEOUT_SEC):
+                self._outcome(op, "throttled")
+                raise TwilioUnavailable("Twilio sobrecarregado (sem vaga de concorrencia)")
+
+            started = time.perf_counter()
+            retry_after = None
+            try:
+                resp = self.session.request(method, url, auth=auth, **kwargs)
+            except requests.RequestException as e:
+                metrics.observe_twilio(op, started, "error")
+                self.breaker.on_failure()
+                # Sem conexao nada foi enviado; timeout de leitura em POST pode ter sido entregue
+                retryable = idempotent or _request_not_sent(e)
+                if not retryable or attempt >= TWILIO_MAX_RETRIES:
+                    self._outcome(op, "network_error")
+                    raise
+            else:
+                metrics.observe_twilio(op, started, resp.status_code)
+                status = resp.status_code
+                if status == 429:
+                    # Twilio respondeu: nao conta como queda, mas reduz a concorrencia
+                    self.breaker.on_success()
+                    self.limiter.on_throttled()
+                    retry_after = _retry_after_seconds(resp.headers.get("Retry-After"))
+                    retryable = retry_after is None or retry_after <= TWILIO_RETRY_AFTER_MAX_SEC
+                    outcome = "rate_limited"
+                elif status >= 500:
+                    self.breaker.on_failure()
+                    retryable = idempotent and status in RETRYABLE_GET_STATUSES
+                    outcome = "server_error"
+                else:
+                    self.breaker.on_success()
+                    self.limiter.on_success()
+                    retryable = False
+                    outcome = "ok" if status < 400 else "client_error"
+                if not retryable or attempt >= TWILIO_MAX_RETRIES:
+                    self._outcome(op, outcome)
+                    return resp
+                resp.close()
+            finally:
+                self.limiter.release()
+
+            self._outcome(op, "retry")
+            time.sleep(self._backoff(attempt, retry_after))
+            attempt += 1
+
+    def post(self, op: str, url: str, data: dict, auth=None) -> requests.Response:
+        return self.request(op, "POST", url, auth=auth, data=data)
+
+    def get(self, op: str, url: str, auth=None, **kwargs) -> requests.Response:
+        return self.request(op, "GET", url, auth=auth, **kwargs)
+
+
+twilio_client = TwilioClient("send")
+twilio_media_client = TwilioClient("media")
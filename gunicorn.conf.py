@@ -0,0 +1,12 @@
+# Configuracao unica do Gunicorn (usada pelo Procfile e pelo Dockerfile).
+# Ajuste por env sem rebuild; use scripts/bench/loadtest.py para medir a capacidade.
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+# ASGI (requirements-asgi.txt): GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker e app asgi:app
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+workers = int(os.getenv("WEB_CONCURRENCY", "3"))
+threads = int(os.getenv("GUNICORN_THREADS", "6"))
+# Mesmo valor do Dockerfile antigo; exports/acoes em massa longas sobem via env
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "180"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
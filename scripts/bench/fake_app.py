@@ -0,0 +1,56 @@
+"""
+Entry point para testes de carga locais: WSGI (gunicorn fake_app:app) ou, com
+BENCH_ASGI=1, ASGI (gunicorn -k uvicorn.workers.UvicornWorker fake_app:asgi_app).
+
+Cada worker sobe o proprio stub do Twilio e, no backend ``fake``, popula a
+propria massa deterministica (mesmos ids em todos os workers). Com
+FIRESTORE_EMULATOR_HOST definido usa o emulador e nao popula nada: o driver de
+carga faz o seed uma unica vez antes de subir o Gunicorn.
+
+Variaveis: BENCH_ASGI, BENCH_CONVERSATIONS, BENCH_MESSAGES, BENCH_PASSWORD, BENCH_TWILIO_LATENCY_MS.
+"""
+import os
+import sys
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR.parents[1]))
+sys.path.insert(0, str(BENCH_DIR))
+
+from werkzeug.security import generate_password_hash  # noqa: E402
+
+from run_bench import boot_app, configure_env  # noqa: E402
+from twilio_stub import TwilioStub  # noqa: E402
+
+_password_hash = generate_password_hash(os.getenv("BENCH_PASSWORD", "bench"))
+os.environ.setdefault("USER_ADMIN_PASSWORD_HASH", _password_hash)
+os.environ.setdefault("USER_SECRETARIA_PASSWORD_HASH", _password_hash)
+
+backend = "emulator" if os.getenv("FIRESTORE_EMULATOR_HOST") else "fake"
+twilio_stub = TwilioStub(latency_ms=float(os.getenv("BENCH_TWILIO_LATENCY_MS", "80"))).start()
+configure_env(twilio_stub.base_url, backend)
+
+app, fs = boot_app(backend)
+
+if backend == "fake":
+    from crm_app.core import FS_CONV_COLL, FS_MSG_SUBCOLL
+    from seed import seed_data
+
+    seed_data(
+        fs,
+        int(os.getenv("BENCH_CONVERSATIONS", "300")),
+        int(os.getenv("BENCH_MESSAGES", "30")),
+        conv_coll=FS_CONV_COLL,
+        msg_subcoll=FS_MSG_SUBCOLL,
+        media_base_url=twilio_stub.base_url,
+    )
+
+if os.getenv("BENCH_ASGI"):
+    from crm_app.asgi import create_asgi_app
+
+    if backend == "fake":
+        from fake_firestore import FakeAsyncClient
+
+        asgi_app = create_asgi_app(app, async_fs=FakeAsyncClient(fs))
+    else:
+        asgi_app = create_asgi_app(app)
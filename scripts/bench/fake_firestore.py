@@ -0,0 +1,795 @@
+"""
+Firestore em memoria para benchmarks locais.
+
+Implementa o subconjunto da API sincrona do google-cloud-firestore que o
+crm_app usa: colecoes/subcolecoes, get/set(merge)/update/delete, consultas com
+where/order_by/limit/start_after, collection_group, count(), get_all, WriteBatch
+e on_snapshot (eventos entregues por uma thread, como no servidor). Os sentinelas reais
+(SERVER_TIMESTAMP, DELETE_FIELD, Increment, ArrayUnion/ArrayRemove) sao
+aplicados como no servidor.
+
+Uso: chame ``install()`` ANTES de importar ``crm_app``.
+"""
+import copy
+import queue
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from google.api_core import exceptions as gexc
+from google.cloud import firestore
+from google.cloud.firestore_v1 import transforms
+from google.cloud.firestore_v1.base_aggregation import AggregationResult
+from google.cloud.firestore_v1.base_client import BaseClient
+from google.cloud.firestore_v1.watch import ChangeType, DocumentChange
+
+DOCUMENT_ID = "__name__"
+_MISSING = object()
+
+
+# ================== Valores ==================
+
+def _type_rank(value):
+    if value is None:
+        return 0
+    if isinstance(value, bool):
+        return 1
+    if isinstance(value, (int, float)):
+        return 2
+    if isinstance(value, datetime):
+        return 3
+    if isinstance(value, str):
+        return 4
+    if isinstance(value, bytes):
+        return 5
+    if isinstance(value, (list, tuple)):
+        return 8
+    if isinstance(value, dict):
+        return 9
+    return 10
+
+
+def _sort_key(value):
+    rank = _type_rank(value)
+    if rank == 3 and value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    if rank in (0, 10):
+        return (rank, 0)
+    if rank == 8:
+        return (rank, tuple(_sort_key(v) for v in value))
+    if rank == 9:
+        return (rank, tuple(sorted((k, _sort_key(v)) for k, v in value.items())))
+    return (rank, value)
+
+
+def _get_path(data: dict, dotted: str):
+    cur = data
+    for part in dotted.split("."):
+        if not isinstance(cur, dict) or part not in cur:
+            return _MISSING
+        cur = cur[part]
+    return cur
+
+
+def _set_path(data: dict, dotted: str, value):
+    parts = dotted.split(".")
+    cur = data
+    for part in parts[:-1]:
+        nxt = cur.get(part)
+        if not isinstance(nxt, dict):
+            nxt = {}
+            cur[part] = nxt
+        cur = nxt
+    cur[parts[-1]] = value
+
+
+def _delete_path(data: dict, dotted: str):
+    parts = dotted.split(".")
+    cur = data
+    for part in parts[:-1]:
+        cur = cur.get(part)
+        if not isinstance(cur, dict):
+            return
+    cur.pop(parts[-1], None)
+
+
+def _apply_value(data: dict, dotted: str, value, now: datetime):
+    if value is firestore.SERVER_TIMESTAMP:
+        _set_path(data, dotted, now)
+    elif value is firestore.DELETE_FIELD:
+        _delete_path(data, dotted)
+    elif isinstance(value, transforms.Increment):
+        current = _get_path(data, dotted)
+        base = current if isinstance(current, (int, float)) and not isinstance(current, bool) else 0
+        _set_path(data, dotted, base + value.value)
+    elif isinstance(value, transforms.ArrayUnion):
+        current = _get_path(data, dotted)
+        items = list(current) if isinstance(current, list) else []
+        for item in value.values:
+            if item not in items:
+                items.append(item)
+        _set_path(data, dotted, items)
+    elif isinstance(value, transforms.ArrayRemove):
+        current = _get_path(data, dotted)
+        items = list(current) if isinstance(current, list) else []
+        _set_path(data, dotted, [item for item in items if item not in value.values])
+    elif isinstance(value, dict):
+        # update() com mapa inteiro: sentinelas aninhadas viram transforms do subcampo
+        _set_path(data, dotted, {})
+        for key, sub in value.items():
+            _apply_value(data, f"{dotted}.{key}", sub, now)
+    else:
+        _set_path(data, dotted, copy.deepcopy(value))
+
+
+def _flatten_merge(prefix: str, value, out: list):
+    """set(merge=True) mescla mapas aninhados campo a campo."""
+    if isinstance(value, dict) and value:
+        for key, sub in value.items():
+            _flatten_merge(f"{prefix}.{key}" if prefix else key, sub, out)
+    else:
+        out.append((prefix, value))
+
+
+def _build_document(document_data: dict, now: datetime, base: dict | None = None) -> dict:
+    data = copy.deepcopy(base) if base is not None else {}
+    fields: list = []
+    _flatten_merge("", document_data, fields)
+    for dotted, value in fields:
+        _apply_value(data, dotted, value, now)
+    return data
+
+
+# ================== Snapshots / referencias ==================
+
+class FakeDocumentSnapshot:
+    def __init__(self, reference, data, exists, create_time=None, update_time=None, read_time=None):
+        self.reference = reference
+        self._data = data
+        self.exists = exists
+        self.create_time = create_time
+        self.update_time = update_time
+        self.read_time = read_time
+
+    @property
+    def id(self):
+        return self.reference.id
+
+    def to_dict(self):
+        if not self.exists:
+            return None
+        return copy.deepcopy(self._data)
+
+    def get(self, field_path):
+        if not self.exists:
+            return None
+        value = _get_path(self._data, field_path)
+        if value is _MISSING:
+            raise KeyError(field_path)
+        return copy.deepcopy(value)
+
+
+class FakeDocumentReference:
+    def __init__(self, client, path: tuple):
+        self._client = client
+        self._path = path
+
+    @property
+    def id(self):
+        return self._path[-1]
+
+    @property
+    def path(self):
+        return "/".join(self._path)
+
+    @property
+    def parent(self):
+        return FakeCollectionReference(self._client, self._path[:-1])
+
+    def __eq__(self, other):
+        return isinstance(other, FakeDocumentReference) and other._path == self._path
+
+    def __hash__(self):
+        return hash(self._path)
+
+    def collection(self, name: str):
+        return FakeCollectionReference(self._client, self._path + (name,))
+
+    def get(self, field_paths=None, transaction=None, **kwargs):
+        return self._client._store.snapshot(self, field_paths)
+
+    def set(self, document_data: dict, merge=False, **kwargs):
+        return self._client._store.set(self._path, document_data, merge=merge)
+
+    def create(self, document_data: dict, **kwargs):
+        return self._client._store.create(self._path, document_data)
+
+    def update(self, field_updates: dict, option=None, **kwargs):
+        return self._client._store.update(self._path, field_updates, option=option)
+
+    def delete(self, option=None, **kwargs):
+        return self._client._store.delete(self._path, option=option)
+
+
+class FakeWriteResult:
+    def __init__(self, update_time):
+        self.update_time = update_time
+
+
+# ================== Consultas ==================
+
+class FakeQuery:
+    ASCENDING = firestore.Query.ASCENDING
+    DESCENDING = firestore.Query.DESCENDING
+
+    def __init__(self, parent, filters=(), orders=(), limit=None, start_after=None, field_paths=None):
+        self._parent = parent
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._start_after = start_after
+        self._field_paths = field_paths
+
+    def _copy(self, **changes):
+        params = {
+            "filters": self._filters,
+            "orders": self._orders,
+            "limit": self._limit,
+            "start_after": self._start_after,
+            "field_paths": self._field_paths,
+        }
+        params.update(changes)
+        return FakeQuery(self._parent, **params)
+
+    def where(self, field_path=None, op_string=None, value=None, *, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path, direction=ASCENDING):
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count: int):
+        return self._copy(limit=count)
+
+    def start_after(self, document_fields_or_snapshot):
+        return self._copy(start_after=document_fields_or_snapshot)
+
+    def select(self, field_paths):
+        return self._copy(field_paths=list(field_paths))
+
+    def count(self, alias=None):
+        return FakeAggregationQuery(self, alias or "field_1")
+
+    def on_snapshot(self, callback):
+        return self._client._store.watch(self, callback)
+
+    def _effective_orders(self):
+        orders = list(self._orders)
+        if not orders:
+            for field, op, _ in self._filters:
+                if op in ("<", "<=", ">", ">=", "!=", "not-in"):
+                    orders.append((field, self.ASCENDING))
+                    break
+        last_direction = orders[-1][1] if orders else self.ASCENDING
+        if not any(field == DOCUMENT_ID for field, _ in orders):
+            orders.append((DOCUMENT_ID, last_direction))
+        return orders
+
+    def stream(self, transaction=None, **kwargs):
+        return iter(self._client._store.run_query(self))
+
+    def get(self, transaction=None, **kwargs):
+        return list(self.stream(transaction=transaction))
+
+    @property
+    def _client(self):
+        return self._parent._client
+
+
+class FakeAggregationQuery:
+    def __init__(self, nested_query: FakeQuery, alias: str):
+        self._nested_query = nested_query
+        self._alias = alias
+
+    def get(self, transaction=None, **kwargs):
+        total = len(self._nested_query._client._store.run_query(self._nested_query._copy(field_paths=[])))
+        return [[AggregationResult(self._alias, total, read_time=datetime.now(timezone.utc))]]
+
+
+class FakeCollectionReference:
+    def __init__(self, client, path: tuple):
+        self._client = client
+        self._path = path
+
+    @property
+    def id(self):
+        return self._path[-1]
+
+    @property
+    def _parent(self):
+        return self
+
+    @property
+    def parent(self):
+        return FakeDocumentReference(self._client, self._path[:-1]) if len(self._path) > 1 else None
+
+    def _query(self):
+        return FakeQuery(self)
+
+    def document(self, document_id=None):
+        return FakeDocumentReference(self._client, self._path + (document_id or uuid.uuid4().hex[:20],))
+
+    def where(self, *args, **kwargs):
+        return self._query().where(*args, **kwargs)
+
+    def order_by(self, *args, **kwargs):
+        return self._query().order_by(*args, **kwargs)
+
+    def limit(self, count):
+        return self._query().limit(count)
+
+    def start_after(self, value):
+        return self._query().start_after(value)
+
+    def select(self, field_paths):
+        return self._query().select(field_paths)
+
+    def count(self, alias=None):
+        return self._query().count(alias=alias)
+
+    def on_snapshot(self, callback):
+        return self._query().on_snapshot(callback)
+
+    def stream(self, transaction=None, **kwargs):
+        return self._query().stream(transaction=transaction)
+
+    def get(self, transaction=None, **kwargs):
+        return self._query().get(transaction=transaction)
+
+    def list_documents(self):
+        return [self.document(doc_id) for doc_id in self._client._store.collection_ids(self._path)]
+
+
+class FakeCollectionGroup(FakeCollectionReference):
+    """collection_group(): consulta todas as (sub)colecoes com o mesmo id."""
+
+    _group = True
+
+
+class FakeWatch:
+    def __init__(self, store, query, callback):
+        self._store = store
+        self.query = query
+        self.callback = callback
+        self.ids: set = set()
+        self.is_active = True
+
+    def unsubscribe(self):
+        self.is_active = False
+        self._store.unwatch(self)
+
+    close = unsubscribe
+
+
+# ================== Armazenamento ==================
+
+class _Doc:
+    __slots__ = ("data", "create_time", "update_time")
+
+    def __init__(self, data, create_time, update_time):
+        self.data = data
+        self.create_time = create_time
+        self.update_time = update_time
+
+
+class _Store:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._collections: dict[tuple, dict[str, _Doc]] = {}
+        self._last_time = datetime.now(timezone.utc)
+        self._watches: list = []
+        self._events = None
+
+    def _now(self):
+        now = datetime.now(timezone.utc)
+        if now <= self._last_time:
+            now = self._last_time + timedelta(microseconds=1)
+        self._last_time = now
+        return now
+
+    def _doc(self, path: tuple):
+        return self._collections.get(path[:-1], {}).get(path[-1])
+
+    def collection_ids(self, coll_path: tuple):
+        with self._lock:
+            return list(self._collections.get(coll_path, {}).keys())
+
+    def snapshot(self, ref, field_paths=None):
+        with self._lock:
+            doc = self._doc(ref._path)
+            if doc is None:
+                return FakeDocumentSnapshot(ref, None, False, read_time=self._now())
+            data = doc.data
+            if field_paths is not None:
+                data = {}
+                for field in field_paths:
+                    value = _get_path(doc.data, field)
+                    if value is not _MISSING:
+                        _set_path(data, field, value)
+            return FakeDocumentSnapshot(
+                ref,
+                copy.deepcopy(data),
+                True,
+                create_time=doc.create_time,
+                update_time=doc.update_time,
+                read_time=self._now(),
+            )
+
+    def _check_option(self, doc, option):
+        if option is None:
+            return
+        last_update_time = getattr(option, "_last_update_time", None)
+        if last_update_time is not None:
+            if doc is None or doc.update_time != last_update_time:
+                raise gexc.FailedPrecondition("last_update_time precondition failed")
+        exists = getattr(option, "_exists", None)
+        if exists is True and doc is None:
+            raise gexc.NotFound("document not found")
+        if exists is False and doc is not None:
+            raise gexc.Conflict("document already exists")
+
+    def set(self, path: tuple, document_data: dict, merge=False):
+        with self._lock:
+            now = self._now()
+            doc = self._doc(path)
+            if merge and doc is not None:
+                doc.data = _build_document(document_data, now, base=doc.data)
+                doc.update_time = now
+            else:
+                create_time = doc.create_time if doc is not None else now
+                self._collections.setdefault(path[:-1], {})[path[-1]] = _Doc(
+                    _build_document(document_data, now), create_time, now
+                )
+            self._notify(path)
+            return FakeWriteResult(now)
+
+    def create(self, path: tuple, document_data: dict):
+        with self._lock:
+            if self._doc(path) is not None:
+                raise gexc.Conflict("document already exists")
+            return self.set(path, document_data)
+
+    def update(self, path: tuple, field_updates: dict, option=None):
+        with self._lock:
+            doc = self._doc(path)
+            if doc is None:
+                raise gexc.NotFound("No document to update: " + "/".join(path))
+            self._check_option(doc, option)
+            now = self._now()
+            data = copy.deepcopy(doc.data)
+            for dotted, value in field_updates.items():
+                _apply_value(data, dotted, value, now)
+            doc.data = data
+            doc.update_time = now
+            self._notify(path)
+            return FakeWriteResult(now)
+
+    def delete(self, path: tuple, option=None):
+        with self._lock:
+            doc = self._doc(path)
+            self._check_option(doc, option)
+            self._collections.get(path[:-1], {}).pop(path[-1], None)
+            self._notify(path)
+            return self._now()
+
+    # ---------- listeners ----------
+
+    def watch(self, query, callback):
+        with self._lock:
+            w = FakeWatch(self, query, callback)
+            self._watches.append(w)
+            if self._events is None:
+                self._events = queue.Queue()
+                threading.Thread(target=self._dispatch, name="fake-watch", daemon=True).start()
+            changes = []
+            for snap in self.run_query(query._copy(limit=None, start_after=None, field_paths=None)):
+                w.ids.add(snap.id)
+                changes.append(DocumentChange(ChangeType.ADDED, snap, -1, len(changes)))
+            self._events.put((w, changes))
+            return w
+
+    def unwatch(self, w):
+        with self._lock:
+            if w in self._watches:
+                self._watches.remove(w)
+
+    def _notify(self, path: tuple):
+        """Enfileira a mudanca de ``path`` para os listeners cuja consulta ela afeta."""
+        for w in self._watches:
+            if w.query._parent._path != path[:-1] or getattr(w.query._parent, "_group", False):
+                continue
+            doc = self._doc(path)
+            doc_id = path[-1]
+            matches = doc is not None and self._matches(doc_id, doc.data, w.query._filters)
+            if matches:
+                kind = ChangeType.MODIFIED if doc_id in w.ids else ChangeType.ADDED
+                w.ids.add(doc_id)
+            elif doc_id in w.ids:
+                kind = ChangeType.REMOVED
+                w.ids.discard(doc_id)
+            else:
+                continue
+            snap = FakeDocumentSnapshot(
+                FakeDocumentReference(w.query._client, path),
+                copy.deepcopy(doc.data) if doc is not None else {},
+                doc is not None,
+                create_time=doc.create_time if doc is not None else None,
+                update_time=doc.update_time if doc is not None else None,
+                read_time=self._last_time,
+            )
+            self._events.put((w, [DocumentChange(kind, snap, -1, -1)]))
+
+    def _dispatch(self):
+        while True:
+            w, changes = self._events.get()
+            if w.is_active:
+                try:
+                    w.callback([], changes, self._last_time)
+                except Exception:
+                    pass
+
+    def _matches(self, doc_id: str, data: dict, filters) -> bool:
+        for field, op, expected in filters:
+            value = doc_id if field == DOCUMENT_ID else _get_path(data, field)
+            if value is _MISSING:
+                return False
+            if op == "==":
+                ok = value == expected
+            elif op == "!=":
+                ok = value != expected and value is not None
+            elif op == "in":
+                ok = value in expected
+            elif op == "not-in":
+                ok = value not in expected and value is not None
+            elif op == "array_contains":
+                ok = isinstance(value, list) and expected in value
+            elif op == "array_contains_any":
+                ok = isinstance(value, list) and any(item in value for item in expected)
+            elif _type_rank(value) != _type_rank(expected):
+                ok = False
+            elif op == "<":
+                ok = _sort_key(value) < _sort_key(expected)
+            elif op == "<=":
+                ok = _sort_key(value) <= _sort_key(expected)
+            elif op == ">":
+                ok = _sort_key(value) > _sort_key(expected)
+            elif op == ">=":
+                ok = _sort_key(value) >= _sort_key(expected)
+            else:
+                raise ValueError(f"operador nao suportado: {op}")
+            if not ok:
+                return False
+        return True
+
+    def run_query(self, query: FakeQuery) -> list:
+        coll_path = query._parent._path
+        orders = query._effective_orders()
+        with self._lock:
+            if getattr(query._parent, "_group", False):
+                sources = [(path, docs) for path, docs in self._collections.items() if path[-1] == coll_path[-1]]
+            else:
+                sources = [(coll_path, self._collections.get(coll_path, {}))]
+            rows = []
+            for path, docs in sources:
+                for doc_id, doc in docs.items():
+                    if not self._matches(doc_id, doc.data, query._filters):
+                        continue
+                    values = []
+                    for field, _ in orders:
+                        value = doc_id if field == DOCUMENT_ID else _get_path(doc.data, field)
+                        if value is _MISSING:
+                            break
+                        values.append(value)
+                    else:
+                        rows.append((values, doc_id, doc, path))
+
+            for idx in range(len(orders) - 1, -1, -1):
+                reverse = orders[idx][1] == FakeQuery.DESCENDING
+                rows.sort(key=lambda row: _sort_key(row[0][idx]), reverse=reverse)
+
+            if query._start_after is not None:
+                rows = self._after_cursor(rows, orders, query._start_after)
+
+            if query._limit is not None:
+                rows = rows[: query._limit]
+
+            client = query._client
+            read_time = self._now()
+            out = []
+            for _, doc_id, doc, path in rows:
+                data = doc.data
+                if query._field_paths is not None:
+                    data = {}
+                    for field in query._field_paths:
+                        value = _get_path(doc.data, field)
+                        if value is not _MISSING:
+                            _set_path(data, field, value)
+                out.append(
+                    FakeDocumentSnapshot(
+                        FakeDocumentReference(client, path + (doc_id,)),
+                        copy.deepcopy(data),
+                        True,
+                        create_time=doc.create_time,
+                        update_time=doc.update_time,
+                        read_time=read_time,
+                    )
+                )
+            return out
+
+    def _after_cursor(self, rows, orders, cursor):
+        if isinstance(cursor, FakeDocumentSnapshot):
+            if not cursor.exists:
+                return rows
+            cursor_values = []
+            for field, _ in orders:
+                if field == DOCUMENT_ID:
+                    cursor_values.append(cursor.id)
+                else:
+                    value = _get_path(cursor._data, field)
+                    cursor_values.append(None if value is _MISSING else value)
+        else:
+            cursor_values = [cursor.get(field) for field, _ in orders if field in cursor]
+
+        def is_after(values):
+            for (field, direction), value, anchor in zip(orders, values, cursor_values):
+                a, b = _sort_key(value), _sort_key(anchor)
+                if a == b:
+                    continue
+                return a < b if direction == FakeQuery.DESCENDING else a > b
+            return False
+
+        return [row for row in rows if is_after(row[0])]
+
+
+# ================== Cliente ==================
+
+class FakeWriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._write_pbs: list = []
+
+    def set(self, reference, document_data, merge=False):
+        self._write_pbs.append(("set", reference, document_data, merge))
+        return self
+
+    def create(self, reference, document_data):
+        self._write_pbs.append(("create", reference, document_data, None))
+        return self
+
+    def update(self, reference, field_updates, option=None):
+        self._write_pbs.append(("update", reference, field_updates, option))
+        return self
+
+    def delete(self, reference, option=None):
+        self._write_pbs.append(("delete", reference, None, option))
+        return self
+
+    def commit(self, **kwargs):
+        store = self._client._store
+        results = []
+        with store._lock:
+            # Commit atomico: precondicoes validadas antes de aplicar qualquer escrita
+            for kind, ref, payload, extra in self._write_pbs:
+                if kind == "update":
+                    doc = store._doc(ref._path)
+                    if doc is None:
+                        raise gexc.NotFound("No document to update: " + "/".join(ref._path))
+                    store._check_option(doc, extra)
+                elif kind == "delete":
+                    store._check_option(store._doc(ref._path), extra)
+            for kind, ref, payload, extra in self._write_pbs:
+                if kind == "set":
+                    results.append(store.set(ref._path, payload, merge=bool(extra)))
+                elif kind == "create":
+                    results.append(store.create(ref._path, payload))
+                elif kind == "update":
+                    results.append(store.update(ref._path, payload, option=extra))
+                else:
+                    results.append(FakeWriteResult(store.delete(ref._path, option=extra)))
+        self._write_pbs = []
+        return results
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+
+
+class FakeClient:
+    def __init__(self, *args, **kwargs):
+        self._store = _Store()
+        self.project = kwargs.get("project") or "fake-project"
+
+    def collection(self, name: str):
+        return FakeCollectionReference(self, tuple(name.split("/")))
+
+    def document(self, path: str):
+        return FakeDocumentReference(self, tuple(path.split("/")))
+
+    def collection_group(self, collection_id: str):
+        return FakeCollectionGroup(self, (collection_id,))
+
+    def get_all(self, references, field_paths=None, transaction=None, **kwargs):
+        for ref in references:
+            yield self._store.snapshot(ref, field_paths)
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    @staticmethod
+    def write_option(**kwargs):
+        return BaseClient.write_option(**kwargs)
+
+
+class _AsyncDocumentReference:
+    def __init__(self, ref: FakeDocumentReference):
+        self._ref = ref
+
+    def collection(self, name: str):
+        return _AsyncQuery(self._ref.collection(name))
+
+    async def get(self, field_paths=None, transaction=None, **kwargs):
+        return self._ref.get(field_paths=field_paths)
+
+
+class _AsyncQuery:
+    """Consultas encadeaveis como no AsyncClient: ``stream()`` vira gerador assincrono."""
+
+    def __init__(self, query):
+        self._query = query
+
+    def document(self, document_id=None):
+        return _AsyncDocumentReference(self._query.document(document_id))
+
+    def __getattr__(self, name):
+        method = getattr(self._query, name)
+
+        def chain(*args, **kwargs):
+            return _AsyncQuery(method(*args, **kwargs))
+
+        return chain
+
+    async def stream(self, transaction=None, **kwargs):
+        for snap in self._query.stream():
+            yield snap
+
+
+class FakeAsyncClient:
+    """Visao assincrona (modo ASGI) sobre o mesmo armazenamento de um FakeClient."""
+
+    def __init__(self, sync_client: FakeClient):
+        self._sync = sync_client
+
+    def collection(self, name: str):
+        return _AsyncQuery(self._sync.collection(name))
+
+
+_installed = False
+
+
+def install():
+    """Substitui firestore.Client pelo fake e o instrumenta com as metricas do app."""
+    global _installed
+    if _installed:
+        return
+    _installed = True
+    firestore.Client = FakeClient
+
+    from crm_app import metrics
+
+    metrics.instrument_firestore_classes(
+        FakeDocumentReference, FakeQuery, FakeClient, FakeWriteBatch, FakeAggregationQuery
+    )
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Benchmark de serializacao JSON das respostas da API.
+
+Compara, para uma pagina de 100 mensagens e uma de 100 conversas:
+- ``flask_iso``: DefaultJSONProvider do Flask com datas ja convertidas por _iso()
+  (comportamento anterior das rotas, conversao incluida na medicao)
+- ``stdlib``: CRMJSONProvider com JSON_BACKEND=stdlib (datas cruas)
+- ``orjson``: CRMJSONProvider com orjson (datas cruas)
+
+Mede tempo por resposta (p50/p95) e alocacoes (tracemalloc: blocos e pico).
+
+Uso:
+    python scripts/bench/json_bench.py --iterations 2000 --out json-bench.json
+"""
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from datetime import timedelta, timezone
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR.parents[1]))
+sys.path.insert(0, str(BENCH_DIR))
+
+from run_bench import boot_app, configure_env  # noqa: E402
+
+# crm_app.core cria o firestore.Client no import
+configure_env("http://127.0.0.1:9", "fake")
+boot_app("fake")
+
+from flask import Flask  # noqa: E402
+from flask.json.provider import DefaultJSONProvider  # noqa: E402
+from google.api_core.datetime_helpers import DatetimeWithNanoseconds  # noqa: E402
+
+from crm_app.core import _iso  # noqa: E402
+from crm_app.json_provider import CRMJSONProvider, orjson  # noqa: E402
+
+BASE_TS = DatetimeWithNanoseconds(2026, 2, 10, 13, 45, 12, 345678, tzinfo=timezone.utc)
+
+
+def build_messages_page(n: int = 100) -> dict:
+    items = []
+    for i in range(n):
+        media = i % 7 == 0
+        items.append({
+            "message_id": f"SM{i:032x}",
+            "direction": "in" if i % 2 else "out",
+            "by": "user" if i % 2 else "agent",
+            "display_name": None if i % 2 else "Secretaria",
+            "text": f"Mensagem {i}: ola, gostaria de confirmar a consulta de amanha as {8 + i % 10}h." * (1 + i % 3),
+            "media_url": f"https://api.twilio.com/2010-04-01/Accounts/AC/Messages/MM{i:030x}/Media/ME{i:030x}" if media else None,
+            "media_type": "image/jpeg" if media else None,
+            "media": None,
+            "media_urls": None,
+            "mime": None,
+            "content_type": None,
+            "url": None,
+            "ts": BASE_TS - timedelta(minutes=i),
+            "client_request_id": f"{i:08x}-0000-4000-8000-000000000000" if i % 2 == 0 else None,
+        })
+    return {"items": items, "next_cursor": "eyJ0cyI6IjIwMjYtMDItMTBUMTM6NDU6MTJaIiwiaWQiOiJTTTAwIn0"}
+
+
+def build_conversations_page(n: int = 100) -> dict:
+    items = []
+    for i in range(n):
+        items.append({
+            "conversation_id": f"+55319{i:08d}",
+            "status": ("claimed", "active", "pending_handoff", "bot")[i % 4],
+            "assignee": "admin" if i % 4 < 2 else None,
+            "assignee_name": "Admin" if i % 4 < 2 else None,
+            "user_name": "Jose da Silva",
+            "wa_profile_name": "Conceicao",
+            "tags": ["urgente", "exames"][: i % 3],
+            "last_message_text": "Voces atendem pelo convenio? Preciso remarcar o exame de sangue.",
+            "last_message_by": "user",
+            "updated_at": BASE_TS - timedelta(seconds=i * 37),
+        })
+    return {"items": items, "next_cursor": "eyJ1cGRhdGVkX2F0IjoiMjAyNi0wMi0xMFQxMzo0NToxMloiLCJpZCI6IiJ9"}
+
+
+def _build_page(payload: dict, field: str, convert) -> dict:
+    """Remonta os itens como a rota faz (com ou sem _iso no campo de data)."""
+    return {**payload, "items": [{**item, field: convert(item[field])} for item in payload["items"]]}
+
+
+def _raw(value):
+    return value
+
+
+def _to_iso(value):
+    return _iso(value) if value else None
+
+
+def _percentile(values: list, pct: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100.0))]
+
+
+def measure(fn, iterations: int) -> dict:
+    for _ in range(min(50, iterations)):
+        fn()
+
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000.0)
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    size = len(fn().get_data())
+    _, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename") if stat.count_diff > 0)
+
+    return {
+        "p50_ms": round(_percentile(timings, 50), 4),
+        "p95_ms": round(_percentile(timings, 95), 4),
+        "alloc_blocks": blocks,
+        "alloc_peak_kb": round(peak / 1024.0, 1),
+        "response_bytes": size,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--out", default="", help="arquivo JSON de saida")
+    args = parser.parse_args(argv)
+
+    app = Flask(__name__)
+    providers = {"flask_iso": DefaultJSONProvider(app), "stdlib": CRMJSONProvider(app, backend="stdlib")}
+    if orjson is not None:
+        providers["orjson"] = CRMJSONProvider(app, backend="orjson")
+    else:
+        print("orjson nao instalado; medindo apenas a stdlib")
+
+    pages = {
+        "messages": (build_messages_page(args.page_size), "ts"),
+        "conversations": (build_conversations_page(args.page_size), "updated_at"),
+    }
+
+    results = {}
+    with app.app_context():
+        for page_name, (payload, ts_field) in pages.items():
+            for name, provider in providers.items():
+                convert = _to_iso if name == "flask_iso" else _raw
+                fn = lambda p=provider, d=payload, f=ts_field, c=convert: p.response(_build_page(d, f, c))  # noqa: E731
+                res = measure(fn, args.iterations)
+                results[f"{page_name}/{name}"] = res
+                print(
+                    f"{page_name:14} {name:10} p50={res['p50_ms']:.3f}ms p95={res['p95_ms']:.3f}ms "
+                    f"blocks={res['alloc_blocks']:<6} peak={res['alloc_peak_kb']}KB bytes={res['response_bytes']}"
+                )
+
+    if args.out:
+        Path(args.out).write_text(json.dumps({"page_size": args.page_size, "results": results}, indent=2))
+        print(f"resultado salvo em {args.out}")
+
+
+if __name__ == "__main__":
+    main()
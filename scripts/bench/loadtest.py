@@ -0,0 +1,451 @@
+#!/usr/bin/env python3
+"""
+Teste de carga com sessoes realistas de atendentes.
+
+Cada atendente simulado faz login em /login e repete o que o SPA faz:
+- a cada 10s recarrega as abas (bot, pending_handoff, claimed+active; limit=50);
+- abre uma conversa (detalhe + mensagens + janela de 24h) e faz polling das
+  mensagens a cada 10s enquanto ela esta aberta;
+- troca de conversa de tempos em tempos e envia mensagens nas que sao suas.
+Um emissor separado reproduz os callbacks de status do Twilio (assinados) na
+proporcao de ``--status-per-send`` callbacks por mensagem enviada.
+
+A carga sobe em degraus (``--start-agents`` + ``--step-agents``) ate o p95 passar
+de ``--p95-slo-ms`` ou a taxa de erro passar de ``--max-error-rate``. O resultado
+indica quantos atendentes simultaneos a configuracao -w/--threads sustenta.
+
+Uso contra uma instancia ja rodando:
+    python scripts/bench/loadtest.py --base-url http://127.0.0.1:8080 --password senha
+
+Subindo o Gunicorn local (fake_app + stub do Twilio) com a configuracao a testar:
+    python scripts/bench/loadtest.py --spawn --workers 3 --threads 6 --out load-3x6.json
+
+O mesmo com o modo ASGI (uvicorn; requer requirements-asgi.txt), para comparar:
+    python scripts/bench/loadtest.py --spawn --asgi --workers 3 --out load-3-asgi.json
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import requests
+
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_ROOT = BENCH_DIR.parents[1]
+sys.path.insert(0, str(BENCH_DIR))
+
+from run_bench import TWILIO_SIGNATURE_TOKEN, percentile  # noqa: E402
+
+# Cadencias do SPA (src/features/conversations/ConversationsPage.tsx e chat/ChatPanel.tsx)
+LIST_POLL_SEC = 10.0
+MESSAGES_POLL_SEC = 10.0
+LIST_TABS = ("bot", "pending_handoff", "claimed,active")
+LIST_LIMIT = 50
+MESSAGES_LIMIT = 50
+
+
+class Recorder:
+    """Coleta latencias por endpoint; cada degrau comeca com um Recorder novo."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples: dict[str, list[float]] = {}
+        self.errors: dict[str, int] = {}
+
+    def record(self, name: str, elapsed_ms: float, ok: bool):
+        with self._lock:
+            self.samples.setdefault(name, []).append(elapsed_ms)
+            if not ok:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+    def summary(self, duration_s: float) -> dict:
+        with self._lock:
+            samples = {k: sorted(v) for k, v in self.samples.items()}
+            errors = dict(self.errors)
+        all_values = sorted(v for values in samples.values() for v in values)
+        total = len(all_values)
+        total_errors = sum(errors.values())
+        return {
+            "requests": total,
+            "errors": total_errors,
+            "error_rate": round(total_errors / total, 4) if total else 0.0,
+            "throughput_rps": round(total / duration_s, 2) if duration_s else None,
+            "p50_ms": round(percentile(all_values, 50), 2),
+            "p95_ms": round(percentile(all_values, 95), 2),
+            "p99_ms": round(percentile(all_values, 99), 2),
+            "endpoints": {
+                name: {
+                    "requests": len(values),
+                    "errors": errors.get(name, 0),
+                    "p50_ms": round(percentile(values, 50), 2),
+                    "p95_ms": round(percentile(values, 95), 2),
+                }
+                for name, values in sorted(samples.items())
+            },
+        }
+
+
+class StatusCallbackQueue:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._items: list[tuple[str, str]] = []
+
+    def push(self, conversation_id: str, sid: str):
+        with self._lock:
+            self._items.append((conversation_id, sid))
+
+    def pop(self):
+        with self._lock:
+            return self._items.pop(0) if self._items else None
+
+
+class Agent(threading.Thread):
+    def __init__(self, idx: int, args, recorder_ref, stop_event, callbacks: StatusCallbackQueue):
+        super().__init__(daemon=True, name=f"agent-{idx}")
+        self.idx = idx
+        self.args = args
+        self.recorder_ref = recorder_ref
+        self.stop_event = stop_event
+        self.callbacks = callbacks
+        self.username = args.users[idx % len(args.users)]
+        self.rng = random.Random(1000 + idx)
+        self.http = requests.Session()
+        self.known: list[dict] = []
+        self.open_id: str | None = None
+        self.latest_cursor: str | None = None
+
+    def _call(self, name: str, method: str, path: str, **kwargs):
+        started = time.perf_counter()
+        ok = False
+        resp = None
+        try:
+            resp = self.http.request(method, self.args.base_url + path, timeout=self.args.request_timeout, **kwargs)
+            ok = resp.status_code < 400 or resp.status_code in (403, 409)
+        except requests.RequestException:
+            ok = False
+        self.recorder_ref[0].record(name, (time.perf_counter() - started) * 1000, ok)
+        return resp
+
+    def _scaled(self, seconds: float) -> float:
+        return seconds / self.args.speed
+
+    def login(self) -> bool:
+        resp = self._call(
+            "login",
+            "POST",
+            "/login",
+            data={"username": self.username, "password": self.args.password},
+            allow_redirects=False,
+        )
+        return resp is not None and resp.status_code in (302, 303)
+
+    def refresh_lists(self):
+        seen = []
+        for status in LIST_TABS:
+            resp = self._call(
+                "list_conversations",
+                "GET",
+                "/api/admin/conversations",
+                params={"status": status, "limit": LIST_LIMIT},
+                headers={"Accept": "application/json"},
+            )
+            if resp is not None and resp.ok:
+                seen.extend((resp.json() or {}).get("items") or [])
+        if seen:
+            self.known = seen
+
+    def open_chat(self):
+        if not self.known:
+            return
+        mine = [c for c in self.known if c.get("assignee") == self.username]
+        pool = mine if mine and self.rng.random() < 0.7 else self.known
+        conv_id = self.rng.choice(pool)["conversation_id"]
+        self.open_id = conv_id
+        self.latest_cursor = None
+        quoted = requests.utils.quote(conv_id, safe="")
+        self._call("get_conversation", "GET", f"/api/admin/conversations/{quoted}")
+        self.poll_messages()
+        self._call("window_status", "GET", f"/api/admin/conversations/{quoted}/window-status")
+
+    def poll_messages(self):
+        if not self.open_id:
+            return
+        quoted = requests.utils.quote(self.open_id, safe="")
+        path = f"/api/admin/conversations/{quoted}/messages"
+        if self.latest_cursor:
+            # Mesmo fluxo do SPA: so mensagens novas (204 quando nao ha)
+            resp = self._call("list_messages_after", "GET", path, params={"limit": MESSAGES_LIMIT, "after": self.latest_cursor})
+        else:
+            resp = self._call("list_messages", "GET", path, params={"limit": MESSAGES_LIMIT})
+        if resp is not None and resp.status_code == 200:
+            self.latest_cursor = (resp.json() or {}).get("latest_cursor") or self.latest_cursor
+
+    def send(self):
+        if not self.open_id:
+            return
+        conv = next((c for c in self.known if c.get("conversation_id") == self.open_id), None)
+        if not conv or conv.get("assignee") != self.username or conv.get("status") not in ("claimed", "active"):
+            return
+        quoted = requests.utils.quote(self.open_id, safe="")
+        resp = self._call(
+            "send_message",
+            "POST",
+            f"/api/admin/conversations/{quoted}/send",
+            json={"text": f"Mensagem de carga {self.idx}", "client_request_id": str(uuid.uuid4())},
+        )
+        if resp is not None and resp.ok:
+            sid = ((resp.json() or {}).get("message") or {}).get("twilio_sid")
+            if sid:
+                self.callbacks.push(self.open_id, sid)
+
+    def run(self):
+        # Espalha o inicio para nao sincronizar os polls
+        if self.stop_event.wait(self.rng.uniform(0, self._scaled(LIST_POLL_SEC))):
+            return
+        if not self.login():
+            return
+        self.refresh_lists()
+        self.open_chat()
+
+        now = time.monotonic()
+        next_list = now + self._scaled(LIST_POLL_SEC)
+        next_messages = now + self._scaled(MESSAGES_POLL_SEC)
+        next_switch = now + self._scaled(self.rng.expovariate(1 / self.args.chat_dwell_sec))
+        next_send = now + self._scaled(self.rng.expovariate(1 / self.args.send_interval_sec))
+
+        while not self.stop_event.is_set():
+            now = time.monotonic()
+            if now >= next_list:
+                self.refresh_lists()
+                next_list += self._scaled(LIST_POLL_SEC)
+            if now >= next_messages:
+                self.poll_messages()
+                next_messages += self._scaled(MESSAGES_POLL_SEC)
+            if now >= next_switch:
+                self.open_chat()
+                next_switch = now + self._scaled(self.rng.expovariate(1 / self.args.chat_dwell_sec))
+            if now >= next_send:
+                self.send()
+                next_send = now + self._scaled(self.rng.expovariate(1 / self.args.send_interval_sec))
+            wake = min(next_list, next_messages, next_switch, next_send)
+            self.stop_event.wait(max(0.0, wake - time.monotonic()))
+
+
+def _twilio_signature(token: str, url: str, params: dict) -> str:
+    payload = url + "".join(k + params[k] for k in sorted(params.keys()))
+    return base64.b64encode(hmac.new(token.encode(), payload.encode(), hashlib.sha1).digest()).decode()
+
+
+def status_replayer(args, recorder_ref, stop_event, callbacks: StatusCallbackQueue):
+    http = requests.Session()
+    url = args.base_url + "/api/admin/twilio-status"
+    statuses = ("sent", "delivered", "read", "failed")
+    while not stop_event.is_set():
+        item = callbacks.pop()
+        if item is None:
+            stop_event.wait(0.2)
+            continue
+        conv_id, sid = item
+        for stat in statuses[: max(1, args.status_per_send)]:
+            params = {
+                "MessageSid": sid,
+                "To": f"whatsapp:{conv_id}",
+                "From": "whatsapp:+5531000000000",
+                "MessageStatus": stat,
+            }
+            started = time.perf_counter()
+            ok = False
+            try:
+                resp = http.post(
+                    url,
+                    data=params,
+                    headers={"X-Twilio-Signature": _twilio_signature(args.twilio_auth_token, url, params)},
+                    timeout=args.request_timeout,
+                )
+                ok = resp.status_code < 400
+            except requests.RequestException:
+                pass
+            recorder_ref[0].record("twilio_status", (time.perf_counter() - started) * 1000, ok)
+
+
+def seed_emulator(args):
+    """No emulador o estado e compartilhado: popula uma unica vez antes do Gunicorn."""
+    from google.cloud import firestore
+    from seed import seed_data
+
+    os.environ.setdefault("GOOGLE_CLOUD_PROJECT", "crm-bench")
+    seed_data(
+        firestore.Client(),
+        args.conversations,
+        args.messages,
+        conv_coll=os.getenv("FS_CONV_COLL", "bench_conversations"),
+        msg_subcoll=os.getenv("FS_MSG_SUBCOLL", "messages"),
+    )
+
+
+def spawn_server(args):
+    if os.getenv("FIRESTORE_EMULATOR_HOST"):
+        seed_emulator(args)
+    env = dict(os.environ)
+    env.setdefault("PORT", str(args.port))
+    env["BENCH_PASSWORD"] = args.password
+    env["BENCH_CONVERSATIONS"] = str(args.conversations)
+    env["BENCH_MESSAGES"] = str(args.messages)
+    if args.asgi:
+        env["BENCH_ASGI"] = "1"
+    cmd = [
+        sys.executable,
+        "-m",
+        "gunicorn",
+        "-c",
+        str(REPO_ROOT / "gunicorn.conf.py"),
+        "--workers",
+        str(args.workers),
+        "--threads",
+        str(args.threads),
+        "--bind",
+        f"127.0.0.1:{args.port}",
+        "--pythonpath",
+        str(BENCH_DIR),
+    ]
+    cmd += ["-k", "uvicorn.workers.UvicornWorker", "fake_app:asgi_app"] if args.asgi else ["fake_app:app"]
+    proc = subprocess.Popen(cmd, cwd=str(REPO_ROOT), env=env)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f"http://127.0.0.1:{args.port}/login", timeout=1)
+            return proc
+        except requests.RequestException:
+            if proc.poll() is not None:
+                raise RuntimeError("gunicorn encerrou durante o boot")
+            time.sleep(0.5)
+    proc.send_signal(signal.SIGTERM)
+    raise RuntimeError("gunicorn nao respondeu em 60s")
+
+
+def run_stages(args) -> dict:
+    callbacks = StatusCallbackQueue()
+    recorder_ref = [Recorder()]
+    stop_all = threading.Event()
+    replayer = threading.Thread(
+        target=status_replayer, args=(args, recorder_ref, stop_all, callbacks), daemon=True
+    )
+    replayer.start()
+
+    agents: list[Agent] = []
+    agent_stop = threading.Event()
+    stages = []
+    sustained = 0
+    target = args.start_agents
+    try:
+        while target <= args.max_agents:
+            while len(agents) < target:
+                agent = Agent(len(agents), args, recorder_ref, agent_stop, callbacks)
+                agents.append(agent)
+                agent.start()
+
+            # Descarta o aquecimento do degrau (logins e primeiras cargas)
+            time.sleep(min(args.stage_seconds / 4, args.ramp_seconds))
+            recorder_ref[0] = Recorder()
+            started = time.monotonic()
+            time.sleep(args.stage_seconds)
+            summary = recorder_ref[0].summary(time.monotonic() - started)
+            summary["agents"] = target
+            passed = summary["p95_ms"] <= args.p95_slo_ms and summary["error_rate"] <= args.max_error_rate
+            summary["passed"] = passed
+            stages.append(summary)
+            print(
+                f"agentes={target:<4} req={summary['requests']:<6} rps={summary['throughput_rps']:<8} "
+                f"p50={summary['p50_ms']:.1f}ms p95={summary['p95_ms']:.1f}ms erros={summary['error_rate']:.2%} "
+                f"{'OK' if passed else 'DEGRADOU'}"
+            )
+            if not passed:
+                break
+            sustained = target
+            target += args.step_agents
+    finally:
+        agent_stop.set()
+        stop_all.set()
+        for agent in agents:
+            agent.join(timeout=args.request_timeout + 1)
+
+    return {"sustained_agents": sustained, "stages": stages}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8080")
+    parser.add_argument("--users", default="admin,secretaria", help="usuarios de login (CSV)")
+    parser.add_argument("--password", default="bench")
+    parser.add_argument("--twilio-auth-token", default=os.getenv("TWILIO_AUTH_TOKEN", TWILIO_SIGNATURE_TOKEN))
+    parser.add_argument("--start-agents", type=int, default=5)
+    parser.add_argument("--step-agents", type=int, default=5)
+    parser.add_argument("--max-agents", type=int, default=200)
+    parser.add_argument("--stage-seconds", type=float, default=60)
+    parser.add_argument("--ramp-seconds", type=float, default=10)
+    parser.add_argument("--p95-slo-ms", type=float, default=800)
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--speed", type=float, default=1.0, help="acelera as cadencias do SPA (2 = duas vezes mais rapido)")
+    parser.add_argument("--chat-dwell-sec", type=float, default=90, help="tempo medio com uma conversa aberta")
+    parser.add_argument("--send-interval-sec", type=float, default=45, help="intervalo medio entre envios")
+    parser.add_argument("--status-per-send", type=int, default=3, help="callbacks de status por envio (sent/delivered/read)")
+    parser.add_argument("--request-timeout", type=float, default=30)
+    parser.add_argument("--spawn", action="store_true", help="sobe gunicorn + fake_app localmente")
+    parser.add_argument("--asgi", action="store_true", help="com --spawn, sobe o modo ASGI (uvicorn) em vez de gthread")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "3")))
+    parser.add_argument("--threads", type=int, default=int(os.getenv("GUNICORN_THREADS", "6")))
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--conversations", type=int, default=300)
+    parser.add_argument("--messages", type=int, default=30)
+    parser.add_argument("--out", default="")
+    args = parser.parse_args(argv)
+    args.users = [u.strip() for u in args.users.split(",") if u.strip()]
+
+    proc = None
+    if args.spawn:
+        args.base_url = f"http://127.0.0.1:{args.port}"
+        proc = spawn_server(args)
+    try:
+        mode = "asgi" if args.asgi else "gthread"
+        print(f"Alvo {args.base_url} ({mode} workers={args.workers} threads={args.threads} spawn={args.spawn})")
+        result = run_stages(args)
+    finally:
+        if proc is not None:
+            proc.send_signal(signal.SIGTERM)
+            try:
+                proc.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+    result["config"] = {
+        "base_url": args.base_url,
+        "workers": args.workers,
+        "threads": args.threads,
+        "spawned": args.spawn,
+        "mode": "asgi" if args.asgi else "gthread",
+        "speed": args.speed,
+        "p95_slo_ms": args.p95_slo_ms,
+        "max_error_rate": args.max_error_rate,
+        "stage_seconds": args.stage_seconds,
+        "status_per_send": args.status_per_send,
+    }
+    print(f"Capacidade sustentada: {result['sustained_agents']} atendentes (p95 <= {args.p95_slo_ms:.0f}ms)")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"Resultado salvo em {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
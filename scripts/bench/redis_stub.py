@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Stub local do protocolo Redis (RESP2) para testar CACHE_BACKEND=redis sem servidor.
+
+Comandos: PING, AUTH, SELECT, GET, SET (EX/PX/NX), INCR/INCRBY, EXPIRE/PEXPIRE,
+PTTL, DEL, PUBLISH, SUBSCRIBE. Um unico banco em memoria, expiracao preguicosa.
+``drop_connections()`` fecha todas as conexoes abertas (exercita reconexao do
+pool e do pub/sub).
+
+Uso direto:
+    python scripts/bench/redis_stub.py --port 6399
+    CACHE_BACKEND=redis CACHE_REDIS_URL=redis://127.0.0.1:6399/0 ...
+"""
+import argparse
+import socket
+import socketserver
+import threading
+import time
+
+
+def _encode(value) -> bytes:
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, bool):
+        return b":%d\r\n" % int(value)
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, list):
+        return b"*%d\r\n" % len(value) + b"".join(_encode(v) for v in value)
+    if isinstance(value, _Status):
+        return b"+%s\r\n" % value.encode()
+    if isinstance(value, _Error):
+        return b"-%s\r\n" % value.encode()
+    data = value if isinstance(value, bytes) else str(value).encode()
+    return b"$%d\r\n%s\r\n" % (len(data), data)
+
+
+class _Status(str):
+    pass
+
+
+class _Error(str):
+    pass
+
+
+OK = _Status("OK")
+# SUBSCRIBE responde direto pelo handler (uma resposta por canal)
+_NO_REPLY = object()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections.add(self.connection)
+
+    def finish(self):
+        with self.server.lock:
+            self.server.connections.discard(self.connection)
+            for subscribers in self.server.channels.values():
+                subscribers.discard(self)
+        try:
+            super().finish()
+        except OSError:
+            pass
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            return line.decode().split()
+        args = []
+        for _ in range(int(line[1:])):
+            size = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(size + 2)[:-2].decode())
+        return args
+
+    def write(self, data: bytes):
+        with self.server.lock:
+            self.wfile.write(data)
+
+    def handle(self):
+        while True:
+            try:
+                args = self._read_command()
+            except (OSError, ValueError):
+                return
+            if not args:
+                return
+            try:
+                reply = self.server.execute(self, args[0].upper(), args[1:])
+            except (IndexError, ValueError):
+                reply = _Error(f"ERR wrong arguments for '{args[0]}'")
+            if reply is not _NO_REPLY:
+                try:
+                    self.write(_encode(reply))
+                except OSError:
+                    return
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, addr):
+        super().__init__(addr, _Handler)
+        self.lock = threading.RLock()
+        self.data: dict = {}  # key -> (value, expires_at | None)
+        self.channels: dict = {}  # canal -> {handler}
+        self.connections: set = set()
+        self.commands = 0
+
+    def _live(self, key):
+        entry = self.data.get(key)
+        if entry and entry[1] is not None and entry[1] <= time.monotonic():
+            del self.data[key]
+            return None
+        return entry
+
+    def execute(self, handler, cmd, args):
+        with self.lock:
+            self.commands += 1
+            if cmd == "PING":
+                return _Status("PONG")
+            if cmd in ("AUTH", "SELECT"):
+                return OK
+            if cmd == "GET":
+                entry = self._live(args[0])
+                return entry[0] if entry else None
+            if cmd == "SET":
+                key, value, opts = args[0], args[1], [a.upper() for a in args[2:]]
+                expires_at = None
+                if "EX" in opts:
+                    expires_at = time.monotonic() + int(args[2 + opts.index("EX") + 1])
+                if "PX" in opts:
+                    expires_at = time.monotonic() + int(args[2 + opts.index("PX") + 1]) / 1000.0
+                if "NX" in opts and self._live(key):
+                    return None
+                self.data[key] = (value, expires_at)
+                return OK
+            if cmd in ("INCR", "INCRBY"):
+                entry = self._live(args[0])
+                amount = int(args[1]) if cmd == "INCRBY" else 1
+                value = (int(entry[0]) if entry else 0) + amount
+                self.data[args[0]] = (str(value), entry[1] if entry else None)
+                return value
+            if cmd in ("EXPIRE", "PEXPIRE"):
+                entry = self._live(args[0])
+                if not entry:
+                    return 0
+                ttl = int(args[1]) / (1.0 if cmd == "EXPIRE" else 1000.0)
+                self.data[args[0]] = (entry[0], time.monotonic() + ttl)
+                return 1
+            if cmd == "PTTL":
+                entry = self._live(args[0])
+                if not entry:
+                    return -2
+                return -1 if entry[1] is None else int((entry[1] - time.monotonic()) * 1000)
+            if cmd == "DEL":
+                return sum(1 for key in args if self._live(key) and self.data.pop(key, None))
+            if cmd == "PUBLISH":
+                subscribers = list(self.channels.get(args[0], ()))
+                message = _encode(["message", args[0], args[1]])
+                for sub in subscribers:
+                    try:
+                        sub.wfile.write(message)
+                    except OSError:
+                        pass
+                return len(subscribers)
+            if cmd == "SUBSCRIBE":
+                for channel in args:
+                    self.channels.setdefault(channel, set()).add(handler)
+                    handler.wfile.write(_encode(["subscribe", channel, len(self.channels[channel])]))
+                return _NO_REPLY
+        return _Error(f"ERR unknown command '{cmd}'")
+
+
+class RedisStub:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self._server = _Server((host, port))
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"redis://{host}:{port}/0"
+
+    @property
+    def commands(self) -> int:
+        return self._server.commands
+
+    def drop_connections(self):
+        with self._server.lock:
+            conns = list(self._server.connections)
+        for conn in conns:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6399)
+    args = parser.parse_args()
+
+    stub = RedisStub(args.host, args.port)
+    print(f"Redis stub em {stub.url} (CACHE_REDIS_URL)")
+    try:
+        stub._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+"""
+Benchmark local do crm-api.
+
+Sobe create_app() contra um Firestore em memoria (ou o emulador, se
+FIRESTORE_EMULATOR_HOST estiver definido) e um stub HTTP do Twilio, popula N
+conversas com M mensagens cada e mede throughput e p50/p95/p99 dos endpoints
+mais usados. O resultado vai para JSON para comparar entre commits.
+
+Uso:
+    python scripts/bench/run_bench.py --conversations 500 --messages 40 --out bench-main.json
+    python scripts/bench/run_bench.py --out bench-branch.json --compare bench-main.json
+    python scripts/bench/run_bench.py --scenarios list_conversations,list_messages --concurrency 6
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_ROOT = BENCH_DIR.parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+sys.path.insert(0, str(BENCH_DIR))
+
+TWILIO_SIGNATURE_TOKEN = "bench-signature-token"
+ADMIN_TOKEN = "bench-admin-token"
+
+
+def configure_env(twilio_base_url: str, backend: str):
+    os.environ.setdefault("SESSION_SECRET_KEY", "bench-secret")
+    os.environ.setdefault("USER_ADMIN_PASSWORD_HASH", "bench")
+    os.environ.setdefault("USER_SECRETARIA_PASSWORD_HASH", "bench")
+    os.environ["TWILIO_API_BASE"] = twilio_base_url
+    os.environ.setdefault("TWILIO_ACCOUNT_SID", "ACbench")
+    os.environ.setdefault("TWILIO_AUTH_TOKEN_REST", "bench")
+    os.environ.setdefault("TWILIO_WHATSAPP_FROM", "whatsapp:+5531000000000")
+    os.environ["TWILIO_AUTH_TOKEN"] = TWILIO_SIGNATURE_TOKEN
+    os.environ.setdefault("CRM_ADMIN_TOKEN", ADMIN_TOKEN)
+    # Evita warnings de orcamento poluindo a saida do benchmark
+    os.environ.setdefault("FIRESTORE_READ_BUDGET", "0")
+    # Downloads em segundo plano do prefetch de midia disputariam CPU com o stub no mesmo processo
+    os.environ.setdefault("MEDIA_PREFETCH_ENABLED", "false")
+    # Mede a lista/contadores servidos pela replica em memoria (desligada por padrao)
+    os.environ.setdefault("CONVERSATION_REPLICA_ENABLED", "true")
+    # Os cenarios de envio repetem a mesma conversa varias vezes por segundo
+    os.environ.setdefault("RATE_LIMIT_SEND_PER_CONVO_PER_SEC", "0")
+    if backend == "emulator":
+        os.environ.setdefault("GOOGLE_CLOUD_PROJECT", "crm-bench")
+        os.environ.setdefault("FS_CONV_COLL", "bench_conversations")
+        os.environ.setdefault("FS_USERS_COLL", "bench_crm_users")
+
+
+def boot_app(backend: str):
+    """Importa crm_app com o backend escolhido e devolve (app, fs)."""
+    if backend == "fake":
+        import fake_firestore
+
+        fake_firestore.install()
+
+    from crm_app import create_app
+    from crm_app import core
+
+    return create_app(), core.fs
+
+
+def twilio_signature(url: str, params: dict) -> str:
+    payload = url + "".join(k + params[k] for k in sorted(params.keys()))
+    digest = hmac.new(TWILIO_SIGNATURE_TOKEN.encode(), payload.encode(), hashlib.sha1).digest()
+    return base64.b64encode(digest).decode()
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    if len(sorted_values) == 1:
+        return sorted_values[0]
+    rank = (len(sorted_values) - 1) * pct / 100.0
+    low = int(rank)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (rank - low)
+
+
+def parse_server_timing_reads(header: str | None):
+    for part in (header or "").split(","):
+        if "reads=" in part:
+            try:
+                return int(part.split("reads=", 1)[1].split()[0].strip('"'))
+            except ValueError:
+                return None
+    return None
+
+
+# ================== Cenarios ==================
+
+class Scenarios:
+    def __init__(self, app, index: dict, rng_seed: int = 7):
+        self.app = app
+        self.index = index
+        self._rng_seed = rng_seed
+        self._local = threading.local()
+        self.list_cursor = None
+        self.latest_cursors: dict[str, str] = {}
+        self.message_etags: dict[str, str] = {}
+
+    def _client(self):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self.app.test_client()
+            with client.session_transaction() as sess:
+                sess["user"] = "admin"
+            self._local.client = client
+            self._local.rng = random.Random(self._rng_seed + threading.get_ident() % 1000)
+        return client
+
+    def _rng(self) -> random.Random:
+        self._client()
+        return self._local.rng
+
+    def prepare(self):
+        resp = self._client().get("/api/admin/conversations?status=claimed,active&limit=50")
+        self.list_cursor = (resp.get_json() or {}).get("next_cursor")
+
+    def list_conversations(self):
+        return self._client().get("/api/admin/conversations?status=claimed,active&limit=50")
+
+    def list_conversations_cursor(self):
+        cursor = self.list_cursor or ""
+        return self._client().get(f"/api/admin/conversations?status=claimed,active&limit=50&cursor={cursor}")
+
+    def conversation_counts(self):
+        return self._client().get("/api/admin/conversations/counts")
+
+    def search_conversations_phone(self):
+        conv_id = self._rng().choice(self.index["conversation_ids"])
+        return self._client().get(f"/api/admin/conversations/search?q={conv_id[1:10]}&limit=50")
+
+    def search_conversations_tag(self):
+        return self._client().get("/api/admin/conversations/search?q=tag:urgente&limit=50")
+
+    def list_messages(self):
+        conv_id = self._rng().choice(self.index["conversation_ids"])
+        return self._client().get(f"/api/admin/conversations/{conv_id}/messages?limit=50")
+
+    def list_messages_after(self):
+        # Poll de chat aberto sem mensagens novas (caso mais frequente)
+        conv_id = self._rng().choice(self.index["conversation_ids"])
+        cursor = self.latest_cursors.get(conv_id)
+        if cursor is None:
+            resp = self._client().get(f"/api/admin/conversations/{conv_id}/messages?limit=1")
+            cursor = (resp.get_json() or {}).get("latest_cursor") or ""
+            self.latest_cursors[conv_id] = cursor
+        return self._client().get(f"/api/admin/conversations/{conv_id}/messages?limit=50&after={cursor}")
+
+    def list_messages_revalidate(self):
+        # Reabertura de um chat ja carregado: If-None-Match com o ETag anterior (304 sem novidades)
+        conv_id = self._rng().choice(self.index["conversation_ids"][:10])
+        url = f"/api/admin/conversations/{conv_id}/messages?limit=50"
+        etag = self.message_etags.get(conv_id)
+        resp = self._client().get(url, headers={"If-None-Match": etag} if etag else None)
+        if resp.headers.get("ETag"):
+            self.message_etags[conv_id] = resp.headers["ETag"]
+        return resp
+
+    def send_message(self):
+        conv_id = self._rng().choice(self.index["owned"]["admin"])
+        return self._client().post(
+            f"/api/admin/conversations/{conv_id}/send",
+            json={"text": "Mensagem de benchmark", "client_request_id": str(uuid.uuid4())},
+        )
+
+    def twilio_status(self):
+        conv_id, sid = self._rng().choice(self.index["twilio_sids"])
+        params = {
+            "MessageSid": sid,
+            "To": f"whatsapp:{conv_id}",
+            "From": "whatsapp:+5531000000000",
+            "MessageStatus": self._rng().choice(("sent", "delivered", "read")),
+        }
+        url = "http://localhost/api/admin/twilio-status"
+        return self._client().post(
+            "/api/admin/twilio-status",
+            data=params,
+            headers={"X-Twilio-Signature": twilio_signature(url, params)},
+        )
+
+    def reopen_preview(self):
+        return self._client().post(
+            "/api/admin/reopen-outdated-conversations",
+            json={"scope": "all", "preview": True},
+        )
+
+
+# Cenarios de varredura completa rodam menos iteracoes
+SCENARIO_WEIGHTS = {
+    "list_conversations": 1.0,
+    "list_conversations_cursor": 1.0,
+    "conversation_counts": 1.0,
+    "search_conversations_phone": 1.0,
+    "search_conversations_tag": 1.0,
+    "list_messages": 1.0,
+    "list_messages_after": 1.0,
+    "list_messages_revalidate": 1.0,
+    "send_message": 1.0,
+    "twilio_status": 1.0,
+    "reopen_preview": 0.05,
+}
+
+
+def run_scenario(fn, iterations: int, concurrency: int, warmup: int) -> dict:
+    for _ in range(warmup):
+        fn()
+
+    latencies: list[float] = []
+    reads: list[int] = []
+    errors = 0
+    lock = threading.Lock()
+
+    def one(_):
+        nonlocal errors
+        started = time.perf_counter()
+        resp = fn()
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        read_count = parse_server_timing_reads(resp.headers.get("Server-Timing"))
+        with lock:
+            latencies.append(elapsed_ms)
+            if read_count is not None:
+                reads.append(read_count)
+            if resp.status_code >= 400:
+                errors += 1
+
+    wall_started = time.perf_counter()
+    if concurrency <= 1:
+        for i in range(iterations):
+            one(i)
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(one, range(iterations)))
+    wall = time.perf_counter() - wall_started
+
+    latencies.sort()
+    return {
+        "iterations": iterations,
+        "errors": errors,
+        "throughput_rps": round(iterations / wall, 2) if wall else None,
+        "mean_ms": round(sum(latencies) / len(latencies), 3) if latencies else None,
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "max_ms": round(latencies[-1], 3) if latencies else None,
+        "fs_reads_mean": round(sum(reads) / len(reads), 2) if reads else None,
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO_ROOT,
+            capture_output=True,
+            text=True,
+            timeout=10,
+        )
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+
+def compare(current: dict, baseline: dict, max_regression_pct: float) -> bool:
+    ok = True
+    print()
+    print(f"Comparando com {baseline.get('meta', {}).get('commit')} (limite p95 +{max_regression_pct:.0f}%)")
+    print(f"{'cenario':32} {'p50 base':>10} {'p50 atual':>10} {'p95 base':>10} {'p95 atual':>10} {'delta p95':>10}")
+    for name, cur in current["results"].items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            continue
+        delta = ((cur["p95_ms"] - base["p95_ms"]) / base["p95_ms"] * 100) if base["p95_ms"] else 0.0
+        flag = ""
+        if max_regression_pct and delta > max_regression_pct:
+            ok = False
+            flag = "  << REGRESSAO"
+        print(
+            f"{name:32} {base['p50_ms']:>10.2f} {cur['p50_ms']:>10.2f} "
+            f"{base['p95_ms']:>10.2f} {cur['p95_ms']:>10.2f} {delta:>+9.1f}%{flag}"
+        )
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=300)
+    parser.add_argument("--messages", type=int, default=30, help="mensagens por conversa")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--scenarios", default="", help="lista CSV (default: todos)")
+    parser.add_argument(
+        "--backend",
+        choices=("fake", "emulator"),
+        default="emulator" if os.getenv("FIRESTORE_EMULATOR_HOST") else "fake",
+    )
+    parser.add_argument("--twilio-latency-ms", type=float, default=0)
+    parser.add_argument("--out", default="", help="arquivo JSON de saida")
+    parser.add_argument("--compare", default="", help="JSON de referencia para comparar")
+    parser.add_argument("--max-regression-pct", type=float, default=20.0)
+    args = parser.parse_args(argv)
+
+    from twilio_stub import TwilioStub
+
+    stub = TwilioStub(latency_ms=args.twilio_latency_ms).start()
+    configure_env(stub.base_url, args.backend)
+    app, fs = boot_app(args.backend)
+
+    import logging
+
+    logging.getLogger().setLevel(logging.WARNING)
+    app.logger.setLevel(logging.WARNING)
+
+    from crm_app.core import FS_CONV_COLL, FS_MSG_SUBCOLL
+    from seed import seed_data
+
+    seed_started = time.perf_counter()
+    index = seed_data(
+        fs,
+        args.conversations,
+        args.messages,
+        conv_coll=FS_CONV_COLL,
+        msg_subcoll=FS_MSG_SUBCOLL,
+        media_base_url=stub.base_url,
+    )
+    seed_s = time.perf_counter() - seed_started
+    print(f"Massa: {args.conversations} conversas x {args.messages} mensagens ({seed_s:.1f}s, backend={args.backend})")
+
+    scenarios = Scenarios(app, index)
+    scenarios.prepare()
+    selected = [s.strip() for s in args.scenarios.split(",") if s.strip()] or list(SCENARIO_WEIGHTS)
+
+    results = {}
+    for name in selected:
+        fn = getattr(scenarios, name, None)
+        if fn is None or name not in SCENARIO_WEIGHTS:
+            print(f"cenario desconhecido: {name}")
+            continue
+        iterations = max(3, int(args.iterations * SCENARIO_WEIGHTS[name]))
+        res = run_scenario(fn, iterations, args.concurrency, min(args.warmup, iterations))
+        results[name] = res
+        print(
+            f"{name:32} n={res['iterations']:<5} err={res['errors']:<3} {res['throughput_rps']:>8} rps  "
+            f"p50={res['p50_ms']:.2f}ms p95={res['p95_ms']:.2f}ms p99={res['p99_ms']:.2f}ms "
+            f"reads~{res['fs_reads_mean']}"
+        )
+
+    stub.stop()
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+            "python": platform.python_version(),
+            "backend": args.backend,
+            "conversations": args.conversations,
+            "messages_per_conversation": args.messages,
+            "iterations": args.iterations,
+            "concurrency": args.concurrency,
+            "twilio_latency_ms": args.twilio_latency_ms,
+        },
+        "results": results,
+    }
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"Resultado salvo em {args.out}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if not compare(report, baseline, args.max_regression_pct):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+"""Massa de dados deterministica para benchmarks e testes de carga."""
+import random
+from datetime import datetime, timedelta, timezone
+
+SEED_AGENTS = ("admin", "secretaria")
+SEED_TAGS = ("marcacao", "remarcacao", "duvida", "exames", "urgente", "reclamacao", "retorno", "convenio")
+SEED_NAMES = ("Maria", "José", "Ana Paula", "João", "Conceição", "Antônio", "Francisca", "Luíza")
+SEED_TEXTS = (
+    "Bom dia, gostaria de marcar uma consulta",
+    "Qual o valor da avaliação?",
+    "Vocês atendem pelo convênio?",
+    "Preciso remarcar meu horário de amanhã",
+    "Obrigado pelo retorno!",
+    "Segue o resultado dos exames",
+    "Estou com dor na perna, é urgente",
+    "Pode me mandar o endereço da clínica?",
+)
+
+# Proporcao de status na massa (soma 1.0)
+STATUS_MIX = (
+    ("bot", 0.30),
+    ("pending_handoff", 0.15),
+    ("claimed", 0.15),
+    ("active", 0.25),
+    ("resolved", 0.15),
+)
+
+
+def conversation_id_for(index: int) -> str:
+    return f"+55319{index:08d}"
+
+
+def _pick_status(rng: random.Random) -> str:
+    roll = rng.random()
+    acc = 0.0
+    for status, weight in STATUS_MIX:
+        acc += weight
+        if roll <= acc:
+            return status
+    return STATUS_MIX[-1][0]
+
+
+def seed_data(
+    fs,
+    conversations: int,
+    messages_per_conversation: int,
+    conv_coll: str = "conversations",
+    msg_subcoll: str = "messages",
+    media_base_url: str = "",
+    seed: int = 42,
+    now: datetime | None = None,
+) -> dict:
+    """
+    Popula conversas + mensagens via WriteBatch (funciona no fake e no emulador).
+
+    Retorna um indice com ids por status/assignee e os twilio_sid gerados, usado
+    pelos cenarios para escolher alvos realistas.
+    """
+    rng = random.Random(seed)
+    now = now or datetime.now(timezone.utc)
+    index = {
+        "conversation_ids": [],
+        "by_status": {},
+        "owned": {agent: [] for agent in SEED_AGENTS},
+        "twilio_sids": [],
+    }
+
+    batch = fs.batch()
+    pending_writes = 0
+
+    def add(ref, data):
+        nonlocal batch, pending_writes
+        batch.set(ref, data)
+        pending_writes += 1
+        if pending_writes >= 400:
+            batch.commit()
+            batch = fs.batch()
+            pending_writes = 0
+
+    for i in range(conversations):
+        conv_id = conversation_id_for(i)
+        status = _pick_status(rng)
+        updated_at = now - timedelta(minutes=i * 7 + rng.randint(0, 5))
+        created_at = updated_at - timedelta(days=rng.randint(0, 30))
+        conv = {
+            "conversation_id": conv_id,
+            "status": status,
+            "created_at": created_at,
+            "updated_at": updated_at,
+            "wa_profile_name": rng.choice(SEED_NAMES),
+            "tags": rng.sample(SEED_TAGS, rng.randint(0, 3)),
+            "last_message_text": rng.choice(SEED_TEXTS),
+            "last_message_by": "user",
+            "session_parameters": (
+                {"user_name": rng.choice(SEED_NAMES)}
+                if i % 3
+                else {"user_name": {"user_name": rng.choice(SEED_NAMES)}}
+            ),
+        }
+        if status in ("claimed", "active"):
+            agent = SEED_AGENTS[i % len(SEED_AGENTS)]
+            conv["assignee"] = agent
+            conv["assignee_name"] = agent.capitalize()
+            index["owned"][agent].append(conv_id)
+        if i % 10 < 7:
+            # 70% com last_inbound_at; metade disso fora da janela de 24h
+            hours_ago = rng.choice((1, 5, 12, 30, 48, 96))
+            conv["last_inbound_at"] = now - timedelta(hours=hours_ago)
+
+        conv_ref = fs.collection(conv_coll).document(conv_id)
+        add(conv_ref, conv)
+        index["conversation_ids"].append(conv_id)
+        index["by_status"].setdefault(status, []).append(conv_id)
+
+        for j in range(messages_per_conversation):
+            direction = "in" if j % 2 == 0 else "out"
+            message_id = f"m{i:06d}{j:04d}"
+            msg = {
+                "message_id": message_id,
+                "direction": direction,
+                "by": "user" if direction == "in" else "human:admin",
+                "display_name": conv["wa_profile_name"] if direction == "in" else "Administrador",
+                "text": rng.choice(SEED_TEXTS),
+                "ts": updated_at - timedelta(minutes=(messages_per_conversation - j) * 3),
+            }
+            if direction == "out":
+                sid = f"SMseed{i:06d}{j:04d}"
+                msg["twilio_sid"] = sid
+                index["twilio_sids"].append((conv_id, sid))
+            if media_base_url and j % 9 == 4:
+                msg["media_url"] = f"{media_base_url}/media/{message_id}.jpg"
+                msg["media_type"] = "image/jpeg"
+            add(conv_ref.collection(msg_subcoll).document(message_id), msg)
+
+    if pending_writes:
+        batch.commit()
+    return index
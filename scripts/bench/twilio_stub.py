@@ -0,0 +1,136 @@
+"""
+Stub HTTP local dos endpoints do Twilio usados pelo crm_app.
+
+- POST /2010-04-01/Accounts/<sid>/Messages.json -> 201 {"sid", "status"}
+- GET  /media/<nome>                              -> bytes de midia (image/jpeg)
+
+``inject(status, times, retry_after)`` faz as proximas requisicoes responderem com
+``status`` (ex.: 429 ou 503) para exercitar retry, AIMD e circuit breaker.
+
+Uso direto:
+    python scripts/bench/twilio_stub.py --port 8099 --latency-ms 80
+"""
+import argparse
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "TwilioStub/1.0"
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _sleep(self):
+        latency = self.server.latency_ms
+        if latency:
+            time.sleep(latency / 1000.0)
+
+    def _fault(self) -> bool:
+        with self.server.lock:
+            if not self.server.faults:
+                return False
+            status, retry_after = self.server.faults.pop(0)
+        self.send_response(status)
+        if retry_after is not None:
+            self.send_header("Retry-After", str(retry_after))
+        body = json.dumps({"code": 20429 if status == 429 else 20500, "message": "injected"}).encode()
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        return True
+
+    def _send(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        self._sleep()
+        if self._fault():
+            return
+        with self.server.lock:
+            self.server.messages_sent += 1
+        if self.path.endswith("/Messages.json"):
+            body = json.dumps({"sid": f"SM{uuid.uuid4().hex}", "status": "queued"}).encode()
+            self._send(201, body, "application/json")
+            return
+        self._send(404, b'{"code": 20404, "message": "not found"}', "application/json")
+
+    def do_GET(self):
+        self._sleep()
+        if self._fault():
+            return
+        if self.path.startswith("/media/"):
+            self._send(200, self.server.media_payload, "image/jpeg")
+            return
+        self._send(404, b'{"code": 20404, "message": "not found"}', "application/json")
+
+
+class TwilioStub:
+    """Servidor em thread daemon; use ``base_url`` como TWILIO_API_BASE."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_ms: float = 0, media_bytes: int = 64 * 1024):
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.latency_ms = latency_ms
+        self._server.media_payload = b"\xff\xd8\xff" + b"\x00" * max(0, media_bytes - 3)
+        self._server.messages_sent = 0
+        self._server.faults = []
+        self._server.lock = threading.Lock()
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def messages_sent(self) -> int:
+        return self._server.messages_sent
+
+    def media_url(self, name: str) -> str:
+        return f"{self.base_url}/media/{name}"
+
+    def inject(self, status: int, times: int = 1, retry_after: float | None = None):
+        with self._server.lock:
+            self._server.faults.extend([(status, retry_after)] * times)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--media-bytes", type=int, default=64 * 1024)
+    args = parser.parse_args()
+
+    stub = TwilioStub(args.host, args.port, args.latency_ms, args.media_bytes)
+    print(f"Twilio stub em {stub.base_url} (TWILIO_API_BASE)")
+    try:
+        stub._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Tamanho da resposta de ``list_messages`` por formato (v1, v2, v2 colunar).
+
+Usa a massa do seed (mesmo formato das mensagens reais: metade in/out, midia do
+Twilio a cada 9 mensagens com ``media_meta``) e chama a rota de verdade via
+test_client. Mede bytes do JSON e bytes com gzip (o que trafega com compressao).
+
+Uso:
+    python scripts/bench/wire_size.py --page-sizes 25,50,100 --out wire-size.json
+"""
+import argparse
+import gzip
+import json
+import sys
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR.parents[1]))
+sys.path.insert(0, str(BENCH_DIR))
+
+from run_bench import boot_app, configure_env  # noqa: E402
+from seed import seed_data  # noqa: E402
+
+FORMATS = {
+    "v1": "",
+    "v2": "&format=v2",
+    "v2_columns": "&format=v2&layout=columns",
+}
+
+
+def _add_media_meta(fs, conv_coll: str, msg_subcoll: str):
+    """O prefetch grava media_meta nas mensagens com midia; reproduz isso na massa."""
+    for conv in fs.collection(conv_coll).stream():
+        for msg in conv.reference.collection(msg_subcoll).stream():
+            if (msg.to_dict() or {}).get("media_url"):
+                msg.reference.update({
+                    "media_meta": {"size": 183_412, "content_type": "image/jpeg", "width": 1280, "height": 960},
+                })
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--page-sizes", default="25,50,100")
+    parser.add_argument("--conversations", type=int, default=5)
+    parser.add_argument("--out", default="", help="arquivo JSON de saida")
+    args = parser.parse_args(argv)
+    page_sizes = [int(p) for p in args.page_sizes.split(",") if p.strip()]
+
+    configure_env("http://127.0.0.1:9", "fake")
+    app, fs = boot_app("fake")
+    from crm_app.core import FS_CONV_COLL, FS_MSG_SUBCOLL
+
+    index = seed_data(
+        fs,
+        args.conversations,
+        max(page_sizes),
+        conv_coll=FS_CONV_COLL,
+        msg_subcoll=FS_MSG_SUBCOLL,
+        media_base_url="https://api.twilio.com/2010-04-01/Accounts/ACbench/Messages/MMbench",
+    )
+    _add_media_meta(fs, FS_CONV_COLL, FS_MSG_SUBCOLL)
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess["user"] = "admin"
+
+    results = {}
+    for page_size in page_sizes:
+        totals = {name: [0, 0] for name in FORMATS}
+        for conv_id in index["conversation_ids"]:
+            for name, suffix in FORMATS.items():
+                resp = client.get(f"/api/admin/conversations/{conv_id}/messages?limit={page_size}{suffix}")
+                body = resp.get_data()
+                totals[name][0] += len(body)
+                totals[name][1] += len(gzip.compress(body))
+        n = len(index["conversation_ids"])
+        base_raw, base_gz = totals["v1"][0] / n, totals["v1"][1] / n
+        for name, (raw, gz) in totals.items():
+            raw, gz = raw / n, gz / n
+            results[f"{page_size}/{name}"] = {
+                "bytes": round(raw),
+                "gzip_bytes": round(gz),
+                "vs_v1": round(raw / base_raw, 3),
+                "gzip_vs_v1": round(gz / base_gz, 3),
+            }
+            print(
+                f"limit={page_size:<4} {name:11} bytes={raw:>8.0f} ({raw / base_raw:6.1%}) "
+                f"gzip={gz:>7.0f} ({gz / base_gz:6.1%})"
+            )
+
+    if args.out:
+        Path(args.out).write_text(json.dumps({"results": results}, indent=2))
+        print(f"resultado salvo em {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -341,9 +341,11 @@ export function ChatPanel({
       : `${Date.now()}-${Math.random().toString(16).slice(2)}`;
 
     try {
+      // Atalho fora da lista local (criado em outra aba): o servidor expande pela lista atual
       const response = await sendMessage(conversationId, {
         text: textToSend,
-        client_request_id: rid
+        client_request_id: rid,
+        expand_shortcut: !matchedReply
       });
       setMessageText("");
 
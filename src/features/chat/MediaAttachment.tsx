@@ -1,4 +1,11 @@
-﻿import { getSafeMediaUrl, MediaAttachment as MediaItem } from "../../shared/utils/mediaUrl";
+﻿import { useState } from "react";
+import {
+  formatMediaSize,
+  getSafeMediaUrl,
+  getThumbnailUrl,
+  MediaAttachment as MediaItem,
+  MediaMeta,
+} from "../../shared/utils/mediaUrl";
 import { Message } from "./chatApi";
 
 function normalizeAttachments(message: Message): MediaItem[] {
@@ -6,7 +13,9 @@ function normalizeAttachments(message: Message): MediaItem[] {
 
   if (Array.isArray(message.media)) attachments.push(...message.media);
   if (Array.isArray(message.media_urls)) attachments.push(...message.media_urls.map((url) => ({ url })));
-  if (message.media_url) attachments.push({ url: message.media_url, content_type: message.media_type || message.mime });
+  if (message.media_url) {
+    attachments.push({ url: message.media_url, content_type: message.media_type || message.mime, meta: message.media_meta });
+  }
   if (message.url && (message.mime || message.content_type)) {
     attachments.push({ url: message.url, content_type: message.mime || message.content_type });
   }
@@ -14,6 +23,40 @@ function normalizeAttachments(message: Message): MediaItem[] {
   return attachments;
 }
 
+const PREVIEW_MAX_WIDTH = 260;
+// Sem miniatura, arquivos acima disso so carregam no clique
+const AUTOLOAD_MAX_BYTES = 5 * 1024 * 1024;
+const previewStyle = { maxWidth: PREVIEW_MAX_WIDTH, height: "auto", borderRadius: 8, display: "block", marginTop: 6 } as const;
+
+/** width/height do preview (reserva o espaco antes de carregar), limitados a PREVIEW_MAX_WIDTH. */
+function previewSize(meta?: MediaMeta | null) {
+  if (!meta?.width || !meta?.height) return {};
+  const width = Math.min(meta.width, PREVIEW_MAX_WIDTH);
+  return { width, height: Math.round((meta.height * width) / meta.width) };
+}
+
+/** Poster do video (primeiro frame); sem miniatura vira link para o original. */
+function VideoPoster({ url, thumbUrl, meta }: { url: string; thumbUrl: string | null; meta?: MediaMeta | null }) {
+  const [failed, setFailed] = useState(false);
+  const size = formatMediaSize(meta?.size);
+  return (
+    <a href={url} target="_blank" rel="noopener" style={{ display: "inline-block", marginTop: 6 }}>
+      {thumbUrl && !failed ? (
+        <img
+          src={thumbUrl}
+          alt="Video"
+          loading="lazy"
+          style={previewStyle}
+          {...previewSize(meta)}
+          onError={() => setFailed(true)}
+        />
+      ) : (
+        `Abrir video${size ? ` (${size})` : ""}`
+      )}
+    </a>
+  );
+}
+
 export function MediaAttachment({ message, conversationId }: { message: Message; conversationId: string }) {
   const attachments = normalizeAttachments(message);
   if (!attachments.length) return null;
@@ -29,6 +72,10 @@ export function MediaAttachment({ message, conversationId }: { message: Message;
         const isOgg = /\.ogg(\?.*)?$/i.test(url);
         const isAudio = contentType.startsWith("audio/") || contentType === "application/ogg";
         const isImage = contentType.startsWith("image/") || /\.(png|jpe?g|gif|webp)$/i.test(url);
+        const isVideo = contentType.startsWith("video/") || /\.(mp4|3gp|mov)(\?.*)?$/i.test(url);
+        const thumbUrl = getThumbnailUrl(url);
+        const meta = attachment.meta;
+        const tooLargeToAutoload = !thumbUrl && (meta?.too_large || (meta?.size ?? 0) > AUTOLOAD_MAX_BYTES);
 
         if (isAudio || isOgg || /\.(mp3|wav)(\?.*)?$/i.test(url)) {
           return (
@@ -44,17 +91,21 @@ export function MediaAttachment({ message, conversationId }: { message: Message;
           );
         }
 
-        if (isImage) {
+        if (isImage && !tooLargeToAutoload) {
+          // Miniatura no chat; o original abre no clique
           return (
-            <img
-              key={`${url}-${index}`}
-              src={url}
-              alt="Anexo"
-              style={{ maxWidth: 260, borderRadius: 8, display: "block", marginTop: 6 }}
-            />
+            <a key={`${url}-${index}`} href={url} target="_blank" rel="noopener">
+              <img src={thumbUrl || url} alt="Anexo" loading="lazy" style={previewStyle} {...previewSize(meta)} />
+            </a>
           );
         }
 
+        if (isVideo) {
+          return <VideoPoster key={`${url}-${index}`} url={url} thumbUrl={thumbUrl} meta={meta} />;
+        }
+
+        const size = formatMediaSize(meta?.size);
+
         return (
           <a
             key={`${url}-${index}`}
@@ -63,7 +114,7 @@ export function MediaAttachment({ message, conversationId }: { message: Message;
             rel="noopener"
             style={{ display: "inline-block", marginTop: 6 }}
           >
-            Abrir anexo
+            {`Abrir anexo${size ? ` (${size})` : ""}`}
           </a>
         );
       })}
@@ -1,5 +1,5 @@
 ﻿import { api } from "../../shared/api/client";
-import type { MediaAttachment } from "../../shared/utils/mediaUrl";
+import type { MediaAttachment, MediaMeta } from "../../shared/utils/mediaUrl";
 
 export type MessageDirection = "in" | "out" | string;
 
@@ -17,23 +17,39 @@ export type Message = {
   mime?: string;
   content_type?: string;
   url?: string;
+  media_meta?: MediaMeta | null;
 };
 
 export type MessagesResponse = {
   items: Message[];
   next_cursor?: string;
+  latest_cursor?: string;
+  has_more?: boolean;
 };
 
 export async function fetchMessages(conversationId: string, options?: { limit?: number; cursor?: string | null }) {
   const params = new URLSearchParams();
   params.set("limit", String(options?.limit ?? 50));
   if (options?.cursor) params.set("cursor", options.cursor);
+  // no-cache: o navegador revalida com If-None-Match e reaproveita o corpo no 304
   return api<MessagesResponse>(
+    `/api/admin/conversations/${encodeURIComponent(conversationId)}/messages?${params.toString()}`,
+    { cache: "no-cache" }
+  );
+}
+
+// Mensagens mais novas que `after` (latest_cursor), em ordem crescente.
+// Sem novidades o backend responde 204 e a funcao retorna undefined.
+export async function fetchNewerMessages(conversationId: string, after: string, options?: { limit?: number }) {
+  const params = new URLSearchParams();
+  params.set("limit", String(options?.limit ?? 50));
+  params.set("after", after);
+  return api<MessagesResponse | undefined>(
     `/api/admin/conversations/${encodeURIComponent(conversationId)}/messages?${params.toString()}`
   );
 }
 
-export async function sendMessage(conversationId: string, payload: { text: string; client_request_id: string }) {
+export async function sendMessage(conversationId: string, payload: { text: string; client_request_id: string; expand_shortcut?: boolean }) {
   return api<{ message?: Message }>(
     `/api/admin/conversations/${encodeURIComponent(conversationId)}/send`,
     {
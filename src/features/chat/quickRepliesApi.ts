@@ -8,7 +8,8 @@ export type QuickReply = {
 };
 
 export async function listQuickReplies() {
-  return api<{ items: QuickReply[] }>(`/api/user/quick-replies`);
+  // no-cache: revalida com If-None-Match (304 quando a lista nao mudou)
+  return api<{ items: QuickReply[] }>(`/api/user/quick-replies`, { cache: "no-cache" });
 }
 
 export async function createQuickReply(payload: { title: string; text: string; shortcut?: string }) {
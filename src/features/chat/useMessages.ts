@@ -1,6 +1,6 @@
 ﻿import { useCallback, useEffect, useLayoutEffect, useRef, useState } from "react";
 import { cmpMsg } from "../../shared/utils/sortMessages";
-import { fetchMessages, Message } from "./chatApi";
+import { fetchMessages, fetchNewerMessages, Message } from "./chatApi";
 
 function messageKey(message: Message) {
   if (message.message_id) return message.message_id;
@@ -46,8 +46,10 @@ export function useMessages(conversationId: string | null, listRef: React.RefObj
 
   const pendingScrollAdjust = useRef<{ prevScrollTop: number; prevScrollHeight: number } | null>(null);
   const scrollToBottom = useRef(false);
+  const latestCursor = useRef<string | null>(null);
 
   const reset = useCallback(() => {
+    latestCursor.current = null;
     setMessages([]);
     setCursor(null);
     setHasMore(true);
@@ -68,6 +70,7 @@ export function useMessages(conversationId: string | null, listRef: React.RefObj
       setMessages(sorted);
       setCursor(response.next_cursor || null);
       setHasMore(Boolean(response.next_cursor));
+      latestCursor.current = response.latest_cursor || null;
       scrollToBottom.current = true;
     } finally {
       setIsRefreshing(false);
@@ -98,8 +101,23 @@ export function useMessages(conversationId: string | null, listRef: React.RefObj
     if (!conversationId || isLoadingMore) return;
     setIsRefreshing(true);
     try {
-      const response = await fetchMessages(conversationId, { limit: 50 });
-      const incoming = response.items || [];
+      let incoming: Message[] = [];
+      if (latestCursor.current) {
+        // Polling incremental: so o que chegou depois da ultima mensagem vista
+        let after: string | null = latestCursor.current;
+        for (let page = 0; after && page < 5; page += 1) {
+          const response = await fetchNewerMessages(conversationId, after, { limit: 50 });
+          if (!response) break;
+          incoming = incoming.concat(response.items || []);
+          if (response.latest_cursor) latestCursor.current = response.latest_cursor;
+          after = response.has_more ? response.latest_cursor || null : null;
+        }
+      } else {
+        const response = await fetchMessages(conversationId, { limit: 50 });
+        incoming = response.items || [];
+        latestCursor.current = response.latest_cursor || null;
+      }
+      if (incoming.length === 0) return;
       setMessages((prev) => {
         const withIds = applyServerIds(prev, incoming);
         return mergeMessages(withIds, incoming);
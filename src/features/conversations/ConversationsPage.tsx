@@ -15,6 +15,7 @@ import {
 import {
   Conversation,
   getReopenBatchCapabilities,
+  getReopenPreviewPage,
   ReopenBatchResponse,
   ReopenBatchScope,
   reopenOutdatedConversations,
@@ -59,15 +60,19 @@ type ReopenBatchCapabilitiesState = {
 
 type ReopenResultDialogState = {
   mode: "preview" | "execute";
+  scope: ReopenBatchScope;
   scopeLabel: string;
+  previewId: string | null;
   eligibleCount: number;
   skippedWindowOpen: number;
   skippedRecent: number;
   skippedNotAllowed: number;
+  skippedChanged: number;
   checked: number;
   reopenedCount: number;
   errorCount: number;
   sampleConversations: NonNullable<ReopenBatchResponse["sample_conversations"]>;
+  nextCursor: string | null;
 };
 
 function usePageVisibility() {
@@ -110,6 +115,15 @@ function formatPreviewTimestamp(value?: string | null) {
   return date.toLocaleString("pt-BR");
 }
 
+function TabCount({ value, mine }: { value?: number; mine?: number }) {
+  if (value === undefined) return null;
+  return (
+    <span className="tab-count" title={mine !== undefined ? `${mine} minhas` : undefined}>
+      {mine !== undefined ? `${mine}/${value}` : value}
+    </span>
+  );
+}
+
 export function ConversationsPage() {
   const { push } = useToast();
   const auth = useAuth();
@@ -119,6 +133,7 @@ export function ConversationsPage() {
     selectedConversation,
     selectedUserName,
     hasMoreByTab,
+    counts,
     isLoadingConversations,
     setCurrentTab,
     loadTab,
@@ -136,6 +151,7 @@ export function ConversationsPage() {
   const [adminMenuOpen, setAdminMenuOpen] = useState(false);
   const [profileOpen, setProfileOpen] = useState(false);
   const [reopenResultDialog, setReopenResultDialog] = useState<ReopenResultDialogState | null>(null);
+  const [reopenPreviewLoading, setReopenPreviewLoading] = useState(false);
   const [reopenCapabilities, setReopenCapabilities] = useState<ReopenBatchCapabilitiesState>({
     isStaging: false,
     hasStagingTestScope: false,
@@ -341,7 +357,11 @@ export function ConversationsPage() {
     await selectConversation(conversationId);
   }, [selectConversation]);
 
-  const handleReopenBatchAction = useCallback(async (scope: ReopenBatchScope, preview: boolean) => {
+  const handleReopenBatchAction = useCallback(async (
+    scope: ReopenBatchScope,
+    preview: boolean,
+    previewId: string | null = null
+  ) => {
     const scopeLabel =
       scope === "bot"
         ? "Bot"
@@ -355,7 +375,9 @@ export function ConversationsPage() {
         : "";
 
     let confirmMessage = "";
-    if (scope === "bot" && !preview) {
+    if (previewId) {
+      confirmMessage = "Voce vai reabrir as conversas elegiveis desta pre-visualizacao. Confirme a operacao.";
+    } else if (scope === "bot" && !preview) {
       confirmMessage = "Voce vai reabrir todas as conversas fora da janela de 24h em Bot. Confirme a operacao.";
     } else if (scope === "active" && !preview) {
       confirmMessage = "Voce vai reabrir todas as conversas fora da janela de 24h em Ativas. Confirme a operacao.";
@@ -372,32 +394,40 @@ export function ConversationsPage() {
     }
 
     try {
-      const result = await reopenOutdatedConversations({ scope, preview });
+      const result = await reopenOutdatedConversations({ scope, preview, previewId });
       if (preview) {
         setReopenResultDialog({
           mode: "preview",
+          scope,
           scopeLabel,
+          previewId: result.preview_id || null,
           eligibleCount: Number(result.eligible_count || 0),
           skippedWindowOpen: Number(result.skipped_window_open || 0),
           skippedRecent: Number(result.skipped_recent || 0),
           skippedNotAllowed: Number(result.skipped_not_allowed || 0),
+          skippedChanged: Number(result.skipped_changed || 0),
           checked: Number(result.checked || 0),
           reopenedCount: Number(result.reopened_count || 0),
           errorCount: Array.isArray(result.errors) ? result.errors.length : 0,
-          sampleConversations: Array.isArray(result.sample_conversations) ? result.sample_conversations : []
+          sampleConversations: Array.isArray(result.sample_conversations) ? result.sample_conversations : [],
+          nextCursor: result.next_cursor || null
         });
       } else {
         setReopenResultDialog({
           mode: "execute",
+          scope,
           scopeLabel,
+          previewId: result.preview_id || null,
           eligibleCount: Number(result.eligible_count || 0),
           skippedWindowOpen: Number(result.skipped_window_open || 0),
           skippedRecent: Number(result.skipped_recent || 0),
           skippedNotAllowed: Number(result.skipped_not_allowed || 0),
+          skippedChanged: Number(result.skipped_changed || 0),
           checked: Number(result.checked || 0),
           reopenedCount: Number(result.reopened_count || 0),
           errorCount: Array.isArray(result.errors) ? result.errors.length : 0,
-          sampleConversations: []
+          sampleConversations: [],
+          nextCursor: null
         });
         await refreshAll();
       }
@@ -408,6 +438,28 @@ export function ConversationsPage() {
     }
   }, [push, refreshAll, reopenCapabilities.testPhoneCount]);
 
+  const handleLoadMorePreview = useCallback(async () => {
+    const dialog = reopenResultDialog;
+    if (!dialog?.previewId || !dialog.nextCursor || reopenPreviewLoading) return;
+    setReopenPreviewLoading(true);
+    try {
+      const page = await getReopenPreviewPage(dialog.previewId, dialog.nextCursor);
+      setReopenResultDialog((current) =>
+        current && current.previewId === dialog.previewId
+          ? {
+              ...current,
+              sampleConversations: [...current.sampleConversations, ...(page.items || [])],
+              nextCursor: page.next_cursor || null
+            }
+          : current
+      );
+    } catch (error) {
+      push(`Erro: ${(error as Error)?.message || "Falha ao carregar pre-visualizacao"}`);
+    } finally {
+      setReopenPreviewLoading(false);
+    }
+  }, [push, reopenPreviewLoading, reopenResultDialog]);
+
   const listTitle = getTabTitle(currentTab);
   const showPendingAlert = conversationsByTab.pending.length > 0;
   const isSearchMode = Boolean(searchQuery.trim());
@@ -486,18 +538,24 @@ export function ConversationsPage() {
               onClick={() => handleTabChange("bot")}
             >
               Atendente Val
+              <TabCount value={counts?.counts.bot} />
             </button>
             <button
               className={`tab ${currentTab === "pending" ? "active" : ""} ${showPendingAlert ? "alert" : ""}`}
               onClick={() => handleTabChange("pending")}
             >
               Fila
+              <TabCount value={counts?.counts.pending_handoff} />
             </button>
             <button
               className={`tab ${currentTab === "claimed" ? "active" : ""}`}
               onClick={() => handleTabChange("claimed")}
             >
               Atendente Humano
+              <TabCount
+                value={counts ? counts.counts.claimed + counts.counts.active : undefined}
+                mine={counts?.mine ? counts.mine.claimed + counts.mine.active : undefined}
+              />
             </button>
             <button
               className={`tab ${currentTab === "resolved" ? "active" : ""}`}
@@ -593,6 +651,9 @@ export function ConversationsPage() {
             <div><strong>Dentro da janela:</strong> {reopenResultDialog?.skippedWindowOpen || 0}</div>
             <div><strong>Reabertura recente:</strong> {reopenResultDialog?.skippedRecent || 0}</div>
             <div><strong>Fora da whitelist:</strong> {reopenResultDialog?.skippedNotAllowed || 0}</div>
+            {reopenResultDialog?.skippedChanged ? (
+              <div><strong>Alteradas desde a prévia:</strong> {reopenResultDialog.skippedChanged}</div>
+            ) : null}
             <div><strong>Avaliadas:</strong> {reopenResultDialog?.checked || 0}</div>
           </div>
 
@@ -610,10 +671,29 @@ export function ConversationsPage() {
                   </div>
                 ))
               )}
+              {reopenResultDialog?.nextCursor ? (
+                <button className="btn" disabled={reopenPreviewLoading} onClick={() => void handleLoadMorePreview()}>
+                  {reopenPreviewLoading
+                    ? "Carregando..."
+                    : `Carregar mais (${reopenResultDialog.sampleConversations.length} de ${reopenResultDialog.eligibleCount})`}
+                </button>
+              ) : null}
             </div>
           ) : null}
 
           <div className="reopen-preview-actions">
+            {reopenResultDialog?.mode === "preview" && reopenResultDialog.previewId && reopenResultDialog.eligibleCount > 0 ? (
+              <button
+                className="btn"
+                onClick={() => {
+                  const dialog = reopenResultDialog;
+                  setReopenResultDialog(null);
+                  void handleReopenBatchAction(dialog.scope, false, dialog.previewId);
+                }}
+              >
+                Reabrir estas conversas
+              </button>
+            ) : null}
             <button className="btn btn-acc" onClick={() => setReopenResultDialog(null)}>
               Fechar
             </button>
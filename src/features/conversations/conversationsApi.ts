@@ -19,6 +19,11 @@ export type ListConversationsResponse = {
   next_cursor?: string;
 };
 
+export type ConversationCountsResponse = {
+  counts: Record<"bot" | "pending_handoff" | "claimed" | "active", number>;
+  mine?: Record<"claimed" | "active", number>;
+};
+
 export type ReopenBatchScope = "all" | "bot" | "active" | "staging_test";
 
 export type ReopenBatchCapabilities = {
@@ -28,24 +33,40 @@ export type ReopenBatchCapabilities = {
   scopes: Array<{ id: ReopenBatchScope; label: string }>;
 };
 
+export type ReopenPreviewItem = {
+  conversation_id: string;
+  status: string;
+  template_name?: string;
+  updated_at?: string | null;
+  last_message_text?: string;
+};
+
+export type ReopenPreviewPage = {
+  preview_id: string;
+  scope: string;
+  expires_at?: string | null;
+  eligible_count: number;
+  items: ReopenPreviewItem[];
+  next_cursor?: string | null;
+};
+
 export type ReopenBatchResponse = {
   success: boolean;
   preview: boolean;
   scope: ReopenBatchScope | string;
   is_staging: boolean;
+  preview_id?: string | null;
+  expires_at?: string | null;
   reopened_count?: number;
   eligible_count?: number;
   skipped_recent: number;
   skipped_window_open: number;
   skipped_not_allowed: number;
+  skipped_changed?: number;
   checked: number;
   sample_count?: number;
-  sample_conversations?: Array<{
-    conversation_id: string;
-    status: string;
-    updated_at?: string | null;
-    last_message_text?: string;
-  }>;
+  sample_conversations?: ReopenPreviewItem[];
+  next_cursor?: string | null;
   errors?: Array<{ conversation_id: string; error: { code?: string; message?: string } }>;
 };
 
@@ -63,8 +84,20 @@ export async function listConversations(params: {
   return api<ListConversationsResponse>(`/api/admin/conversations?${search.toString()}`);
 }
 
+export async function fetchConversationCounts() {
+  return api<ConversationCountsResponse>(`/api/admin/conversations/counts`);
+}
+
+export async function batchGetConversations(ids: string[]) {
+  return api<{ items: Conversation[]; missing: string[] }>(`/api/admin/conversations:batchGet`, {
+    method: "POST",
+    body: { ids }
+  });
+}
+
 export async function getConversation(conversationId: string) {
-  return api<Conversation>(`/api/admin/conversations/${encodeURIComponent(conversationId)}`);
+  // no-cache: revalida com If-None-Match (304 sem corpo quando nada mudou)
+  return api<Conversation>(`/api/admin/conversations/${encodeURIComponent(conversationId)}`, { cache: "no-cache" });
 }
 
 export async function searchConversations(params: { query: string; limit?: number }) {
@@ -115,12 +148,26 @@ export async function getReopenBatchCapabilities() {
   return api<ReopenBatchCapabilities>(`/api/admin/reopen-outdated-conversations/capabilities`);
 }
 
-export async function reopenOutdatedConversations(params?: { scope?: ReopenBatchScope; preview?: boolean }) {
+export async function getReopenPreviewPage(previewId: string, cursor?: string | null, limit = 100) {
+  const search = new URLSearchParams();
+  search.set("limit", String(limit));
+  if (cursor) search.set("cursor", cursor);
+  return api<ReopenPreviewPage>(
+    `/api/admin/reopen-outdated-conversations/previews/${encodeURIComponent(previewId)}?${search.toString()}`
+  );
+}
+
+export async function reopenOutdatedConversations(params?: {
+  scope?: ReopenBatchScope;
+  preview?: boolean;
+  previewId?: string | null;
+}) {
   return api<ReopenBatchResponse>(`/api/admin/reopen-outdated-conversations`, {
     method: "POST",
     body: {
       scope: params?.scope ?? "all",
       preview: Boolean(params?.preview),
+      ...(params?.previewId ? { preview_id: params.previewId } : {}),
     }
   });
 }
@@ -2,6 +2,8 @@
 import { useToast } from "../../shared/ui/Toast";
 import {
   Conversation,
+  ConversationCountsResponse,
+  fetchConversationCounts,
   getConversation,
   listConversations
 } from "./conversationsApi";
@@ -13,6 +15,7 @@ type ConversationsContextValue = {
   conversationsByTab: Record<ConversationsTab, Conversation[]>;
   cursorsByTab: Record<ConversationsTab, string | null>;
   hasMoreByTab: Record<ConversationsTab, boolean>;
+  counts: ConversationCountsResponse | null;
   selectedConversation: Conversation | null;
   selectedUserName: string;
   isLoadingConversations: boolean;
@@ -57,6 +60,7 @@ export function ConversationsProvider({ children }: { children: ReactNode }) {
     claimed: true,
     resolved: true
   });
+  const [counts, setCounts] = useState<ConversationCountsResponse | null>(null);
   const [selectedConversation, setSelectedConversation] = useState<Conversation | null>(null);
   const [selectedUserName, setSelectedUserName] = useState<string>("");
   const [isLoadingConversations, setIsLoadingConversations] = useState(false);
@@ -137,7 +141,9 @@ export function ConversationsProvider({ children }: { children: ReactNode }) {
         loadTab("bot"),
         loadTab("pending"),
         loadTab("claimed"),
-        currentTab === "resolved" ? loadTab("resolved") : Promise.resolve()
+        currentTab === "resolved" ? loadTab("resolved") : Promise.resolve(),
+        // Badges: falha aqui nao deve derrubar as listas
+        fetchConversationCounts().then(setCounts).catch(() => undefined)
       ]);
     } catch (error) {
       console.error("Erro ao carregar dados:", error);
@@ -181,6 +187,7 @@ export function ConversationsProvider({ children }: { children: ReactNode }) {
     conversationsByTab,
     cursorsByTab,
     hasMoreByTab,
+    counts,
     selectedConversation,
     selectedUserName,
     isLoadingConversations,
@@ -197,6 +204,7 @@ export function ConversationsProvider({ children }: { children: ReactNode }) {
     conversationsByTab,
     cursorsByTab,
     hasMoreByTab,
+    counts,
     selectedConversation,
     selectedUserName,
     isLoadingConversations,
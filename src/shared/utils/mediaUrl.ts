@@ -1,9 +1,21 @@
-﻿export type MediaAttachment = {
+﻿/** Gravado pelo prefetch do backend (crm_app/media_meta.py). */
+export type MediaMeta = {
+  size?: number;
+  content_type?: string;
+  width?: number;
+  height?: number;
+  duration_sec?: number;
+  too_large?: boolean;
+  error?: string;
+};
+
+export type MediaAttachment = {
   signed_url?: string | null;
   gcs_url?: string | null;
   url?: string | null;
   content_type?: string | null;
   mime?: string | null;
+  meta?: MediaMeta | null;
 };
 
 export function getSafeMediaUrl(conversationId: string, messageId: string | undefined, attachment: MediaAttachment) {
@@ -19,3 +31,16 @@ export function getSafeMediaUrl(conversationId: string, messageId: string | unde
 
   return direct;
 }
+
+const PROXY_PREFIX = "/api/admin/media/";
+
+/** Miniatura gerada pelo proxy (imagens e poster de video); null para URLs diretas. */
+export function getThumbnailUrl(url: string) {
+  return url.startsWith(PROXY_PREFIX) ? `${url}?variant=thumb` : null;
+}
+
+export function formatMediaSize(bytes?: number) {
+  if (!bytes) return "";
+  if (bytes >= 1024 * 1024) return `${(bytes / (1024 * 1024)).toFixed(1)} MB`;
+  return `${Math.max(1, Math.round(bytes / 1024))} KB`;
+}
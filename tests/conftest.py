@@ -0,0 +1,44 @@
+"""
+App de teste: create_app() sobre o Firestore em memoria e o stub do Twilio de
+scripts/bench (mesmo ambiente do benchmark). O Firestore e unico no processo:
+cada teste usa ids proprios.
+"""
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+BENCH_DIR = Path(__file__).resolve().parents[1] / "scripts" / "bench"
+sys.path.insert(0, str(BENCH_DIR))
+
+from run_bench import ADMIN_TOKEN, boot_app, configure_env  # noqa: E402
+from twilio_stub import TwilioStub  # noqa: E402
+
+os.environ.pop("FIRESTORE_EMULATOR_HOST", None)
+_stub = TwilioStub().start()
+configure_env(_stub.base_url, "fake")
+_app, _fs = boot_app("fake")
+
+
+@pytest.fixture
+def app():
+    return _app
+
+
+@pytest.fixture
+def fs():
+    return _fs
+
+
+@pytest.fixture
+def admin_token():
+    return ADMIN_TOKEN
+
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess["user"] = "admin"
+    return client
@@ -0,0 +1,44 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("httpx")
+pytest.importorskip("asgiref")
+
+import httpx  # noqa: E402
+from fake_firestore import FakeAsyncClient  # noqa: E402
+
+from crm_app.asgi import create_asgi_app  # noqa: E402
+from crm_app.core import conv_ref  # noqa: E402
+
+PATH = "/api/admin/conversations/asgi-auth/messages"
+AFTER = {"after": "2020-01-01T00:00:00Z,m0"}
+
+
+def _get(app, fs, **kwargs) -> int:
+    async def run():
+        asgi_app = create_asgi_app(app, async_fs=FakeAsyncClient(fs), http=httpx.AsyncClient())
+        transport = httpx.ASGITransport(app=asgi_app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://crm") as client:
+            resp = await client.get(PATH, **kwargs)
+        await asgi_app.http.aclose()
+        return resp.status_code
+
+    return asyncio.run(run())
+
+
+def test_asgi_route_accepts_admin_token_like_flask(app, fs, admin_token):
+    conv_ref("asgi-auth").set({"status": "active"})
+    headers = {"X-Admin-Token": admin_token, "Accept": "application/json"}
+
+    assert _get(app, fs, params=AFTER, headers=headers) == 204
+    assert app.test_client().get(PATH, query_string=AFTER, headers=headers).status_code == 204
+
+
+def test_asgi_route_accepts_query_token(app, fs, admin_token):
+    assert _get(app, fs, params={**AFTER, "token": admin_token}) == 204
+
+
+def test_asgi_route_rejects_missing_or_wrong_token(app, fs):
+    assert _get(app, fs, params=AFTER) == 401
+    assert _get(app, fs, params=AFTER, headers={"X-Admin-Token": "wrong"}) == 401
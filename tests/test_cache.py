@@ -0,0 +1,70 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("redis")
+
+from redis_stub import RedisStub  # noqa: E402
+
+from crm_app import cache  # noqa: E402
+from crm_app.cache import MicroCache, RedisBackend  # noqa: E402
+
+
+@pytest.fixture
+def stub():
+    stub = RedisStub().start()
+    yield stub
+    stub.stop()
+
+
+def _wait(predicate, timeout=5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_redis_backend_commands(stub):
+    backend = RedisBackend(stub.url, prefix="t:")
+    assert backend.set("k", "v", ttl_sec=60)
+    assert backend.get("k") == "v"
+    assert not backend.set("k", "outro", nx=True)
+    assert backend.incr("n", 2, ttl_sec=60) == 2
+    assert backend.incr("n", 3, ttl_sec=60) == 5
+    assert 0 < backend.ttl("n") <= 60
+    assert backend.delete("k", "n") == 2
+    assert backend.get("k") is None and backend.ttl("n") is None
+
+
+def test_redis_backend_down_is_a_miss():
+    backend = RedisBackend("redis://127.0.0.1:1/0", timeout_sec=0.2)
+    assert backend.get("k") is None
+    assert backend.set("k", "v") is False
+    assert backend.incr("k") == 0
+
+
+def test_pubsub_reconnect_clears_only_broadcast_caches(stub):
+    received = []
+    got = threading.Event()
+    backend = RedisBackend(stub.url, prefix="t:")
+    backend.subscribe("canal", lambda message: (received.append(message), got.set()))
+    publisher = RedisBackend(stub.url, prefix="t:")
+    assert _wait(lambda: publisher.publish("canal", "a") == 1)
+    assert got.wait(5) and received == ["a"]
+
+    shared = MicroCache("test_broadcast", 60, broadcast_invalidation=True)
+    local = MicroCache("test_local", 60)
+    shared.get_or_compute("k", lambda: 1)
+    local.get_or_compute("k", lambda: 1)
+    assert local.name not in cache._registry
+
+    stub.drop_connections()
+    assert _wait(lambda: not shared._entries)
+    assert local._entries
+    # Reassina os canais depois de reconectar
+    got.clear()
+    assert _wait(lambda: publisher.publish("canal", "b") == 1)
+    assert got.wait(5) and received[-1] == "b"
@@ -0,0 +1,47 @@
+import csv
+import io
+from datetime import datetime, timedelta, timezone
+
+from crm_app.core import conv_ref
+
+
+def _seed(prefix: str, count: int, base: datetime):
+    for i in range(count):
+        conv_ref(f"{prefix}-{i}").set({
+            "status": "resolved",
+            "updated_at": base + timedelta(minutes=i),
+            "tags": ["export"],
+        })
+
+
+def _csv_rows(resp):
+    return list(csv.DictReader(io.StringIO(resp.get_data(as_text=True))))
+
+
+def test_csv_export_paginates_with_end_row(client):
+    base = datetime(2099, 1, 1, tzinfo=timezone.utc)
+    _seed("csvpage", 5, base)
+    params = {"format": "csv", "limit": 2, "since": "2099-01-01", "until": "2099-01-02"}
+
+    seen = []
+    cursor = None
+    for _ in range(5):
+        resp = client.get("/api/admin/export", query_string={**params, **({"cursor": cursor} if cursor else {})})
+        assert resp.status_code == 200
+        rows = _csv_rows(resp)
+        assert rows[-1]["type"] == "end"
+        seen += [r["conversation_id"] for r in rows if r["type"] == "conversation"]
+        cursor = rows[-1]["cursor"]
+        if not cursor:
+            break
+
+    assert seen == [f"csvpage-{i}" for i in range(5)]
+
+
+def test_csv_export_without_limit_ends_with_empty_cursor(client):
+    base = datetime(2098, 1, 1, tzinfo=timezone.utc)
+    _seed("csvall", 3, base)
+    resp = client.get("/api/admin/export", query_string={"format": "csv", "since": "2098-01-01", "until": "2098-01-02"})
+    rows = _csv_rows(resp)
+    assert [r["type"] for r in rows] == ["conversation"] * 3 + ["end"]
+    assert rows[-1]["cursor"] == ""
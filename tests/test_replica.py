@@ -0,0 +1,21 @@
+from datetime import datetime, timedelta, timezone
+
+from crm_app.blueprints.admin.routes import _search_conversations_by_tag
+from crm_app.core import conv_ref
+from crm_app.replica import ConversationRecord, ConversationReplica
+
+
+def test_tag_search_matches_firestore_path():
+    base = datetime(2030, 1, 1, tzinfo=timezone.utc)
+    spellings = ["vipteste", "Vipteste", "VIPTESTE", "VipTeste", "vípteste"]
+    replica = ConversationReplica(None)
+    for i, tag in enumerate(spellings):
+        conv_id = f"replica-tag-{i}"
+        conv_ref(conv_id).set({"status": "active", "tags": [tag], "updated_at": base + timedelta(minutes=i)})
+        replica._upsert(ConversationRecord.from_snapshot(conv_ref(conv_id).get()))
+
+    from_firestore = [item["conversation_id"] for item in _search_conversations_by_tag("vipteste", 50)["items"]]
+    from_replica = [item["conversation_id"] for item in replica.search_tag("vipteste", 50)]
+
+    assert from_replica == from_firestore
+    assert set(from_replica) == {"replica-tag-0", "replica-tag-1", "replica-tag-2"}
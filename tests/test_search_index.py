@@ -0,0 +1,39 @@
+from datetime import datetime, timedelta, timezone
+
+from crm_app import search_index
+from crm_app.search_index import _write_postings, index_message, index_ref
+
+
+def _index(conversation_id: str) -> dict:
+    return index_ref(conversation_id).get().to_dict()
+
+
+def test_sync_does_not_move_updated_at_backwards():
+    index_message("idx-recency", "pedido confirmado")
+    sent_at = _index("idx-recency")["updated_at"]
+
+    older = sent_at - timedelta(hours=1)
+    _write_postings({"idx-recency": [{"entrega", "pedido"}, older]})
+
+    doc = _index("idx-recency")
+    assert doc["updated_at"] == sent_at
+    assert set(doc["terms"]) == {"pedido", "confirmado", "entrega"}
+
+
+def test_sync_advances_updated_at():
+    past = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    _write_postings({"idx-advance": [{"boleto"}, past]})
+    _write_postings({"idx-advance": [{"boleto"}, past + timedelta(days=1)]})
+    assert _index("idx-advance")["updated_at"] == past + timedelta(days=1)
+
+
+def test_terms_capped_on_incremental_writes(monkeypatch):
+    monkeypatch.setattr(search_index, "MESSAGE_INDEX_MAX_TERMS_PER_CONVERSATION", 4)
+    index_message("idx-cap", "alfa beta gama")
+    index_message("idx-cap", "alfa beta gama")
+    index_message("idx-cap", "delta epsilon zeta")
+    _write_postings({"idx-cap": [{"omega", "theta"}, datetime.now(timezone.utc)]})
+
+    terms = _index("idx-cap")["terms"]
+    assert len(terms) == 4
+    assert {"alfa", "beta", "gama"} <= set(terms)
@@ -0,0 +1,52 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from crm_app.blueprints.admin import routes
+from crm_app.core import conv_ref
+
+HEADERS = {"X-Agent-Id": "admin", "X-Agent-Name": "Admin"}
+
+
+@pytest.fixture
+def conversation():
+    conversation_id = "whatsapp:+5511988887777"
+    conv_ref(conversation_id).set({
+        "status": "active",
+        "assignee": "admin",
+        "updated_at": datetime.now(timezone.utc),
+        "last_inbound_at": datetime.now(timezone.utc),
+    })
+    return conversation_id
+
+
+def _send(client, conversation_id, request_id):
+    return client.post(
+        f"/api/admin/conversations/{conversation_id}/send",
+        json={"text": "ola", "client_request_id": request_id},
+        headers=HEADERS,
+    )
+
+
+def test_exception_in_send_releases_client_request_id(app, client, conversation, monkeypatch):
+    def boom(*args, **kwargs):
+        raise RuntimeError("firestore fora do ar")
+
+    with monkeypatch.context() as m:
+        m.setattr(routes, "_send_message", boom)
+        app.config["PROPAGATE_EXCEPTIONS"] = False
+        try:
+            assert _send(client, conversation, "idem-raise").status_code == 500
+        finally:
+            app.config["PROPAGATE_EXCEPTIONS"] = None
+
+    resp = _send(client, conversation, "idem-raise")
+    assert resp.status_code == 200, resp.get_json()
+
+
+def test_repeated_client_request_id_replays_response(client, conversation):
+    first = _send(client, conversation, "idem-replay")
+    second = _send(client, conversation, "idem-replay")
+    assert first.status_code == second.status_code == 200
+    assert second.headers.get("Idempotent-Replayed") == "true"
+    assert second.get_json() == first.get_json()